@@ -6,6 +6,8 @@
 # Borg thingy too nice not to use.  See:
 # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/66531
 
+import threading
+
 class CounterBorg:
     """Borg-pattern (similar to a Singleton) for maintaining a
     monotonically increasing counter.
@@ -13,19 +15,27 @@ class CounterBorg:
     Instantiate this anywhere, and call get() to return and increment
     the increasing counter.  DeVIDE uses this to stamp modified and
     execute times of modules.
+
+    get() is protected by a lock, as the wavefront scheduler stamps
+    execute times from more than one worker thread.
     """
 
     # we start with 1, so that client code can init to 0 and guarantee
     # an initial invalid state.  The counter is explicitly long, this
     # gives us unlimited precision (up to your memory limits, YEAH!)
-    __shared_state = {'counter' : 1L}
+    __shared_state = {'counter' : 1L, 'lock' : threading.Lock()}
 
     def __init__(self):
         self.__dict__ = self.__shared_state
 
     def get(self):
-        c = self.counter
-        self.counter += 1
+        self.lock.acquire()
+        try:
+            c = self.counter
+            self.counter += 1
+        finally:
+            self.lock.release()
+
         return c
 
 def counter():
@@ -51,6 +51,33 @@ else:
     JOHANNES_REVISION_ID = devide_versions.JOHANNES_REVISION_ID
 
 
+############################################################################
+def get_user_dir():
+    """Return the per-user directory in which DeVIDE keeps its caches and
+    indices, creating it if required.
+
+    This is %APPDATA%\\DeVIDE on Windows and ~/.devide elsewhere.  It is
+    created readable and writable only by the user, so that other users
+    can't read or plant cache files.  If it can't be created, a new private
+    temporary directory is used, so that caches still work, but only for
+    this session.
+    """
+
+    if os.name == 'nt' and os.environ.get('APPDATA'):
+        user_dir = os.path.join(os.environ['APPDATA'], 'DeVIDE')
+    else:
+        user_dir = os.path.join(os.path.expanduser('~'), '.devide')
+
+    try:
+        if not os.path.isdir(user_dir):
+            os.makedirs(user_dir, 0700)
+
+    except OSError:
+        import tempfile
+        user_dir = tempfile.mkdtemp(prefix='devide_')
+
+    return user_dir
+
 ############################################################################
 class MainConfigClass(object):
 
@@ -63,11 +90,21 @@ class MainConfigClass(object):
 
         config_defaults = {
                 'nokits': '', 
+                'lazy_kits' : 1,
+                'preload_kits' : '',
                 'interface' : 'wx',
                 'scheduler' : 'hybrid',
+                'scheduler_workers' : 0,
                 'extra_module_paths' : '',
                 'streaming_pieces' : 5,
-                'streaming_memory' : 100000}
+                'streaming_memory' : 100000,
+                'output_cache' : 'off',
+                'output_cache_dir' : '',
+                'output_cache_entries' : 100,
+                'output_memory_budget' : 0,
+                'profile' : 0,
+                'profile_dir' : '',
+                'module_index_cache' : ''}
 
         cp = ConfigParser.ConfigParser(config_defaults)
         cp.read(os.path.join(appdir, 'devide.cfg'))
@@ -81,18 +118,45 @@ class MainConfigClass(object):
         # is for emps later, but we like to be consistent)
         self.nokits = [i for i in nokits if i]
 
+        # non-crucial kits that are not preloaded are only loaded when
+        # a module that requires them is created
+        self.lazy_kits = bool(cp.getint(CSEC, 'lazy_kits'))
+        preload_kits = [i.strip() for i in cp.get(CSEC, \
+                'preload_kits').split(',')]
+        self.preload_kits = [i for i in preload_kits if i]
+
         self.streaming_pieces = cp.getint(CSEC, 'streaming_pieces')
         self.streaming_memory = cp.getint(CSEC, 'streaming_memory')
 
+        self.output_cache = cp.get(CSEC, 'output_cache').strip()
+        self.user_dir = get_user_dir()
+
+        self.output_cache_dir = cp.get(CSEC, 'output_cache_dir').strip()
+        if not self.output_cache_dir:
+            self.output_cache_dir = os.path.join(
+                self.user_dir, 'output_cache')
+
+        self.output_cache_entries = cp.getint(CSEC, 'output_cache_entries')
+        self.output_memory_budget = cp.getint(CSEC, 'output_memory_budget')
+
+        self.profile = bool(cp.getint(CSEC, 'profile'))
+        self.profile_dir = cp.get(CSEC, 'profile_dir').strip()
+
         self.interface = cp.get(CSEC, 'interface') 
 
         self.scheduler = cp.get(CSEC, 'scheduler')
+        self.scheduler_workers = cp.getint(CSEC, 'scheduler_workers')
 
         emps = [i.strip() for i in cp.get(CSEC, \
                 'extra_module_paths').split(',')]
         # ''.split(',') will yield [''], which we have to get rid of
         self.extra_module_paths = [i for i in emps if i]
 
+        self.module_index_cache = cp.get(CSEC, 'module_index_cache').strip()
+        if not self.module_index_cache:
+            self.module_index_cache = os.path.join(
+                self.user_dir, 'module_index_cache')
+
         # finally apply command line switches ############################
         ##################################################################
 
@@ -105,9 +169,23 @@ class MainConfigClass(object):
         if pcl_data.scheduler:
             self.scheduler = pcl_data.scheduler
 
+        if pcl_data.scheduler_workers is not None:
+            self.scheduler_workers = pcl_data.scheduler_workers
+
         if pcl_data.extra_module_paths:
             self.extra_module_paths = pcl_data.extra_module_paths
 
+        if pcl_data.output_cache:
+            self.output_cache = pcl_data.output_cache
+
+        if pcl_data.profile_dir:
+            self.profile_dir = pcl_data.profile_dir
+            # writing profiles implies profiling
+            self.profile = True
+
+        if pcl_data.profile:
+            self.profile = True
+
         # command-line only, defaults set in PCLData ctor
         # so we DON'T have to check if config file has already set
         # them
@@ -118,6 +196,14 @@ class MainConfigClass(object):
         self.script_params = pcl_data.script_params
         self.load_network = pcl_data.load_network
         self.hide_devide_ui = pcl_data.hide_devide_ui
+        self.config_profile = pcl_data.config_profile
+        self.log_file = pcl_data.log_file
+        self.batch_runs = pcl_data.batch_runs
+        self.batch_workers = pcl_data.batch_workers
+        self.batch_retries = pcl_data.batch_retries
+        self.batch_dir = pcl_data.batch_dir
+        self.rpc_host = pcl_data.rpc_host
+        self.rpc_port = pcl_data.rpc_port
 
         # now sanitise some options
         if type(self.nokits) != type([]):
@@ -132,17 +218,33 @@ class MainConfigClass(object):
         print "--config-profile name : Use config profile with name."
         print "--no-kits kit1,kit2   : Don't load the specified kits."
         print "--kits kit1,kit2      : Load the specified kits."
-        print "--scheduler hybrid|event"
+        print "--scheduler hybrid|event|wavefront"
         print "                      : Select scheduler (def: hybrid)"
+        print "--scheduler-workers n : Worker threads for wavefront scheduler."
         print "--extra-module-paths path1,path2"
         print "                      : Specify extra module paths."
-        print "--interface wx|script"
-        print "                      : Load 'wx' or 'script' interface."
+        print "--interface wx|script|batch|xmlrpc|pyro"
+        print "                      : Load 'wx', 'script', 'batch' or a remote"
+        print "                        execution ('xmlrpc', 'pyro') interface."
         print "--stereo              : Allocate stereo visuals."
         print "--test                : Perform built-in unit testing."
         print "--script              : Run specified .py in script mode."
         print "--load-network        : Load specified DVN after startup."
+        print "--output-cache off|memory|disk"
+        print "                      : Cache module outputs (def: off)."
+        print "--profile             : Report per-module execution times."
+        print "--profile-dir dir     : Also write execution timelines to dir."
         print "--hide-devide-ui      : Hide the DeVIDE UI at startup."
+        print "--log-file filename   : Log to filename (def: devide.log)."
+        print "--batch-runs file.csv : Runs table for the batch interface."
+        print "--batch-workers n     : Concurrent batch runs (def: 0, one"
+        print "                        per processor)."
+        print "--batch-retries n     : Retries of failed batch runs (def: 1)."
+        print "--batch-dir dir       : Batch logs and report (def: devide_batch)."
+        print "--rpc-host host       : Address that the xmlrpc and pyro interfaces"
+        print "                        listen on (def: localhost)."
+        print "--rpc-port n          : Port of the xmlrpc and pyro interfaces"
+        print "                        (def: 8000 for xmlrpc, 7766 for pyro)."
 
     def disp_version(self):
         print "DeVIDE v%s" % (DEVIDE_VERSION,)
@@ -162,6 +264,7 @@ class MainConfigClass(object):
                 self.nokits = None
                 self.interface = None
                 self.scheduler = None
+                self.scheduler_workers = None
                 self.extra_module_paths = None
                 self.stereo = False
                 self.test = False
@@ -169,6 +272,17 @@ class MainConfigClass(object):
                 self.script_params = None
                 self.load_network = None
                 self.hide_devide_ui = None
+                self.output_cache = None
+                self.profile = False
+                self.profile_dir = None
+                self.log_file = 'devide.log'
+                self.batch_runs = None
+                self.batch_workers = 0
+                self.batch_retries = 1
+                self.batch_dir = 'devide_batch'
+                self.rpc_host = 'localhost'
+                # 0 means the default port of the interface
+                self.rpc_port = 0
 
         pcl_data = PCLData()
 
@@ -178,7 +292,11 @@ class MainConfigClass(object):
                 sys.argv[1:], 'hv',
                 ['help', 'version', 'version-more', 'no-kits=', 'kits=', 'stereo', 'interface=', 'test',
                  'script=', 'script-params=', 'config-profile=',
-                 'scheduler=', 'extra-module-paths=', 'load-network='])
+                 'scheduler=', 'scheduler-workers=', 'extra-module-paths=',
+                 'load-network=', 'output-cache=', 'profile',
+                 'profile-dir=', 'log-file=', 'batch-runs=',
+                 'batch-workers=', 'batch-retries=', 'batch-dir=',
+                 'rpc-host=', 'rpc-port='])
             
         except getopt.GetoptError,e:
             self.dispUsage()
@@ -219,15 +337,22 @@ class MainConfigClass(object):
                     pcl_data.interface = 'xmlrpc'
                 elif a == 'script':
                     pcl_data.interface = 'script'
+                elif a == 'batch':
+                    pcl_data.interface = 'batch'
                 else:
                     pcl_data.interface = 'wx'
 
             elif o in ('--scheduler',):
                 if a == 'event':
                     pcl_data.scheduler = 'event'
+                elif a == 'wavefront':
+                    pcl_data.scheduler = 'wavefront'
                 else:
                     pcl_data.scheduler = 'hybrid'
 
+            elif o in ('--scheduler-workers',):
+                pcl_data.scheduler_workers = int(a)
+
             elif o in ('--extra-module-paths',):
                 emps = [i.strip() for i in a.split(',')]
                 # get rid of empty paths
@@ -251,6 +376,36 @@ class MainConfigClass(object):
             elif o in ('--hide-devide-ui',):
                 pcl_data.hide_devide_ui = a
 
+            elif o in ('--output-cache',):
+                pcl_data.output_cache = a
+
+            elif o in ('--profile',):
+                pcl_data.profile = True
+
+            elif o in ('--profile-dir',):
+                pcl_data.profile_dir = a
+
+            elif o in ('--log-file',):
+                pcl_data.log_file = a
+
+            elif o in ('--batch-runs',):
+                pcl_data.batch_runs = a
+
+            elif o in ('--batch-workers',):
+                pcl_data.batch_workers = int(a)
+
+            elif o in ('--batch-retries',):
+                pcl_data.batch_retries = int(a)
+
+            elif o in ('--batch-dir',):
+                pcl_data.batch_dir = a
+
+            elif o in ('--rpc-host',):
+                pcl_data.rpc_host = a
+
+            elif o in ('--rpc-port',):
+                pcl_data.rpc_port = int(a)
+
         return pcl_data
 
 ############################################################################
@@ -308,6 +463,11 @@ class DeVIDEApp:
             from interfaces.script_interface import ScriptInterface
             self._interface = ScriptInterface(self)
             self.main_config.nokits.append('wx_kit')
+
+        elif self.main_config.interface == 'batch':
+            from interfaces.batch_interface import BatchInterface
+            self._interface = BatchInterface(self)
+            self.main_config.nokits.append('wx_kit')
             
         else:
             from interfaces.wx_interface import WXInterface
@@ -353,6 +513,13 @@ class DeVIDEApp:
                     scheduler.SchedulerProxy.EVENT_DRIVEN_MODE
             self.log_info('Selected event-driven scheduler.')
 
+        elif self.main_config.scheduler == 'wavefront':
+            self.scheduler.mode = \
+                    scheduler.SchedulerProxy.WAVEFRONT_MODE
+            self.log_info(
+                'Selected wavefront scheduler with %d workers.' %
+                (self.scheduler.wavefront_scheduler.num_workers,))
+
         else:
             self.scheduler.mode = \
                     scheduler.SchedulerProxy.HYBRID_MODE
@@ -0,0 +1,464 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Per-module profiling of network executions.
+
+See the documentation of L{ExecutionProfiler} for details.
+"""
+
+import os
+import sys
+import threading
+import time
+
+from memory_budget import get_output_size
+
+try:
+    import resource
+except ImportError:
+    # e.g. on Windows; we then don't report RSS
+    resource = None
+
+try:
+    import json
+except ImportError:
+    json = None
+
+def get_cpu_time():
+    """Return user + system CPU time in seconds consumed by this process.
+    """
+    t = os.times()
+    return t[0] + t[1]
+
+def get_peak_rss():
+    """Return peak resident set size of this process in bytes, or None if
+    this can't be determined on this platform.
+    """
+
+    if resource is None:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # OS X reports bytes, everyone else kilobytes
+        return maxrss
+
+    return maxrss * 1024
+
+#########################################################################
+class ExecutionRecord:
+    """Timing and resource information of a single module part during one
+    network run.
+
+    @ivar status: 'executed', 'cached' (outputs restored from the output
+    cache), 'skipped' (scheduled, but already up to date) or 'failed'.
+    @ivar wall_time: wall clock seconds spent in execution.
+    @ivar cpu_time: process CPU seconds spent during execution.  With the
+    wavefront scheduler, modules running concurrently share this.
+    @ivar rss_delta: increase of the process peak RSS in bytes during
+    execution, or None if unknown.
+    @ivar output_size: total size in bytes of the outputs of this part
+    after execution, as far as it can be determined.
+    @ivar transfer_time: wall clock seconds spent transferring data into
+    the inputs of this part.
+    """
+
+    def __init__(self, instance_name, module_name, part):
+        self.instance_name = instance_name
+        self.module_name = module_name
+        self.part = part
+
+        self.status = 'skipped'
+        self.streaming = False
+        self.executions = 0
+        self.start_time = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.rss_delta = None
+        self.output_size = 0
+        self.transfers = 0
+        self.transfer_time = 0.0
+
+    def get_label(self):
+        if self.part == 0:
+            return self.instance_name
+
+        return '%s:%d' % (self.instance_name, self.part)
+
+    def as_dict(self):
+        return {
+            'instance_name' : self.instance_name,
+            'module_name' : self.module_name,
+            'part' : self.part,
+            'status' : self.status,
+            'streaming' : self.streaming,
+            'executions' : self.executions,
+            'wall_time' : self.wall_time,
+            'cpu_time' : self.cpu_time,
+            'rss_delta' : self.rss_delta,
+            'output_size' : self.output_size,
+            'transfers' : self.transfers,
+            'transfer_time' : self.transfer_time}
+
+#########################################################################
+class ExecutionRun:
+    """All ExecutionRecords of a single network execution, as well as the
+    timeline of events in Chrome trace event format.
+    """
+
+    def __init__(self, run_idx):
+        self.run_idx = run_idx
+        self.start_time = time.time()
+        self.end_time = None
+        self.scheduler = None
+
+        # (meta_module, part) -> ExecutionRecord
+        self.records = {}
+        # list of trace events (dicts)
+        self.events = []
+        # thread name -> trace tid
+        self._tids = {}
+
+    def get_wall_time(self):
+        if self.end_time is None:
+            return time.time() - self.start_time
+
+        return self.end_time - self.start_time
+
+    def get_sorted_records(self):
+        """Return list of records, most expensive first.
+        """
+        records = self.records.values()
+        records.sort(key=lambda r: (r.wall_time + r.transfer_time,
+                                    r.get_label()), reverse=True)
+        return records
+
+    def add_event(self, name, category, start_time, duration, args):
+        tname = threading.currentThread().getName()
+        tid = self._tids.setdefault(tname, len(self._tids))
+        self.events.append({
+            'name' : name,
+            'cat' : category,
+            'ph' : 'X',
+            'pid' : os.getpid(),
+            'tid' : tid,
+            # trace event times are in microseconds
+            'ts' : int((start_time - self.start_time) * 1e6),
+            'dur' : int(duration * 1e6),
+            'args' : args})
+
+    def get_trace(self):
+        """Return timeline as a dictionary in Chrome trace event format,
+        suitable for chrome://tracing or any other trace viewer.
+        """
+
+        events = list(self.events)
+        for tname, tid in self._tids.items():
+            events.append({'name' : 'thread_name', 'ph' : 'M',
+                           'pid' : os.getpid(), 'tid' : tid,
+                           'args' : {'name' : tname}})
+
+        return {
+            'traceEvents' : events,
+            'displayTimeUnit' : 'ms',
+            'otherData' : {
+                'run' : self.run_idx,
+                'scheduler' : self.scheduler,
+                'start' : time.ctime(self.start_time),
+                'wall_time' : self.get_wall_time(),
+                'modules' : [r.as_dict() for r in
+                             self.get_sorted_records()]}}
+
+    def get_summary(self):
+        """Return summary table of this run as a multi-line string.
+        """
+
+        def fmt_size(nbytes):
+            if nbytes is None:
+                return '-'
+            return '%.1f' % (nbytes / (1024.0 * 1024.0),)
+
+        header = '%-28s %-24s %-8s %9s %9s %9s %9s %9s' % \
+                 ('module', 'type', 'status', 'wall(s)', 'cpu(s)',
+                  'xfer(s)', 'rss(MB)', 'out(MB)')
+
+        lines = ['Network run %d (%s scheduler): %.3f s, %d module parts' %
+                 (self.run_idx, self.scheduler, self.get_wall_time(),
+                  len(self.records)),
+                 header, '-' * len(header)]
+
+        totals = {'wall' : 0.0, 'cpu' : 0.0, 'xfer' : 0.0}
+        counts = {}
+        for r in self.get_sorted_records():
+            lines.append('%-28s %-24s %-8s %9.3f %9.3f %9.3f %9s %9s' %
+                         (r.get_label()[:28], r.module_name[:24], r.status,
+                          r.wall_time, r.cpu_time, r.transfer_time,
+                          fmt_size(r.rss_delta), fmt_size(r.output_size)))
+            totals['wall'] += r.wall_time
+            totals['cpu'] += r.cpu_time
+            totals['xfer'] += r.transfer_time
+            counts[r.status] = counts.get(r.status, 0) + 1
+
+        lines.append('-' * len(header))
+        lines.append('%-28s %-24s %-8s %9.3f %9.3f %9.3f' %
+                     ('total', '', '', totals['wall'], totals['cpu'],
+                      totals['xfer']))
+
+        status_counts = ['%d %s' % (counts[s], s)
+                         for s in ('executed', 'cached', 'skipped', 'failed')
+                         if s in counts]
+        lines.append(', '.join(status_counts))
+
+        return '\n'.join(lines)
+
+#########################################################################
+class ExecutionProfiler:
+    """Records per-module execution statistics during network runs.
+
+    The NetworkManager calls L{begin_run} and L{end_run} around every
+    network execution.  In between, the ModuleManager reports every
+    module execution (via L{start_execution} and L{finish_execution})
+    and every data transfer (via L{start_transfer} and
+    L{finish_transfer}).  For each scheduled
+    module part, the wall time, CPU time, increase in peak RSS, total
+    output size, time spent transferring its inputs and its status
+    (executed, restored from the output cache, skipped or failed) are
+    recorded.
+
+    At the end of a run, a summary table listing the most expensive
+    modules first is logged, and if profile_dir has been set, the
+    timeline is written as a Chrome trace (JSON) file together with the
+    summary table.  The timeline shows concurrently executing modules on
+    separate tracks.  The last few runs remain available via
+    L{get_runs}.
+
+    When the profiler is not enabled, all methods return immediately.
+
+    @author: Charl P. Botha <http://cpbotha.net/>
+    """
+
+    def __init__(self, module_manager, enabled=False, profile_dir=None,
+                 max_runs=10):
+        """
+        @param profile_dir: if set, trace and summary of each run are
+        written to this directory.
+        @param max_runs: number of runs to keep in memory.
+        """
+
+        self._module_manager = module_manager
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.max_runs = max_runs
+
+        self._runs = []
+        self._current_run = None
+        self._run_idx = 0
+        # the wavefront scheduler executes modules from more than one
+        # thread
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._runs = []
+        self._current_run = None
+        del self._module_manager
+
+    def get_runs(self):
+        """Return list of ExecutionRun instances, most recent last.
+        """
+        return list(self._runs)
+
+    def get_last_run(self):
+        if self._runs:
+            return self._runs[-1]
+
+        return None
+
+    def begin_run(self, vertices, scheduler_name=None):
+        """Start recording a network run.
+
+        @param vertices: (meta_module, part) tuples that have been
+        scheduled.  Those that are not executed will be reported as
+        skipped.
+        """
+
+        if not self.enabled:
+            return
+
+        self._run_idx += 1
+        run = ExecutionRun(self._run_idx)
+        run.scheduler = scheduler_name
+        for v in vertices:
+            self._get_record(run, v[0], v[1])
+
+        self._current_run = run
+
+    def end_run(self):
+        """Stop recording the current network run, log the summary and
+        export the trace if so configured.
+
+        @return: the ExecutionRun that has just finished, or None.
+        """
+
+        run = self._current_run
+        if run is None:
+            return None
+
+        self._current_run = None
+        run.end_time = time.time()
+
+        self._runs.append(run)
+        del self._runs[:-self.max_runs]
+
+        self._module_manager.log_info(run.get_summary())
+
+        if self.profile_dir:
+            try:
+                self.export_run(run, self.profile_dir)
+            except Exception, e:
+                self._module_manager.log_warning(
+                    'Could not write execution profile: %s' % (str(e),))
+
+        return run
+
+    def export_run(self, run, profile_dir):
+        """Write trace (devide_profile_N.json) and summary
+        (devide_profile_N.txt) of run to profile_dir.
+
+        @return: (trace_filename, summary_filename)
+        """
+
+        if json is None:
+            raise RuntimeError('json module is required for trace export.')
+
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+
+        basename = os.path.join(
+            profile_dir, 'devide_profile_%s_%d' %
+            (time.strftime('%Y%m%d-%H%M%S', time.localtime(run.start_time)),
+             run.run_idx))
+
+        trace_fname = basename + '.json'
+        f = open(trace_fname, 'w')
+        try:
+            json.dump(run.get_trace(), f)
+        finally:
+            f.close()
+
+        summary_fname = basename + '.txt'
+        f = open(summary_fname, 'w')
+        try:
+            f.write(run.get_summary() + '\n')
+        finally:
+            f.close()
+
+        return trace_fname, summary_fname
+
+    def _get_record(self, run, meta_module, part):
+        k = (meta_module, part)
+        r = run.records.get(k)
+        if r is None:
+            r = ExecutionRecord(meta_module.instance_name,
+                                meta_module.instance.__class__.__name__,
+                                part)
+            run.records[k] = r
+
+        return r
+
+    def start_execution(self, meta_module, part=0, streaming=False):
+        """Called by the ModuleManager right before it executes a module
+        part.
+
+        @return: opaque token that has to be passed to
+        L{finish_execution}, or None if we're not recording.
+        """
+
+        run = self._current_run
+        if run is None:
+            return None
+
+        return (run, meta_module, part, streaming,
+                time.time(), get_cpu_time(), get_peak_rss())
+
+    def finish_execution(self, token, status='executed'):
+        """Called by the ModuleManager right after a module part has been
+        executed, restored from the output cache or has failed.
+        """
+
+        if token is None:
+            return
+
+        run, meta_module, part, streaming, start_wall, start_cpu, \
+             start_rss = token
+
+        wall_time = time.time() - start_wall
+        cpu_time = get_cpu_time() - start_cpu
+        end_rss = get_peak_rss()
+
+        output_size = 0
+        if status != 'failed':
+            for output_idx in range(len(meta_module.outputs)):
+                if meta_module.getPartForOutput(output_idx) == part:
+                    try:
+                        output_size += get_output_size(
+                            meta_module.get_output(output_idx))
+                    except Exception:
+                        pass
+
+        self._lock.acquire()
+        try:
+            r = self._get_record(run, meta_module, part)
+            if r.start_time is None:
+                r.start_time = start_wall
+
+            r.executions += 1
+            r.status = status
+            r.streaming = r.streaming or streaming
+            r.wall_time += wall_time
+            r.cpu_time += cpu_time
+            if start_rss is not None and end_rss is not None:
+                r.rss_delta = (r.rss_delta or 0) + end_rss - start_rss
+            r.output_size = output_size
+
+            run.add_event(
+                r.get_label(), status, start_wall, wall_time,
+                {'module' : r.module_name, 'part' : part,
+                 'streaming' : streaming, 'cpu_time' : cpu_time,
+                 'output_size' : output_size})
+        finally:
+            self._lock.release()
+
+    def start_transfer(self):
+        if self._current_run is None:
+            return None
+
+        return (self._current_run, time.time())
+
+    def finish_transfer(self, token, meta_module, output_idx,
+                        consumer_meta_module, consumer_input_idx):
+        """Called by the ModuleManager after it has transferred output_idx
+        of meta_module to consumer_input_idx of consumer_meta_module.
+        The time is attributed to the consumer.
+        """
+
+        if token is None:
+            return
+
+        run, start_wall = token
+        duration = time.time() - start_wall
+        part = consumer_meta_module.getPartForInput(consumer_input_idx)
+
+        self._lock.acquire()
+        try:
+            r = self._get_record(run, consumer_meta_module, part)
+            r.transfers += 1
+            r.transfer_time += duration
+
+            run.add_event(
+                '%s:%d -> %s:%d' % (meta_module.instance_name, output_idx,
+                                    consumer_meta_module.instance_name,
+                                    consumer_input_idx),
+                'transfer', start_wall, duration, {})
+        finally:
+            self._lock.release()
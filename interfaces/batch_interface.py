@@ -0,0 +1,347 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+import cPickle
+import csv
+from logging_mixin import LoggingMixin
+import os
+import Queue
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from ast import literal_eval
+except ImportError:
+    literal_eval = None
+
+class BatchException(Exception):
+    pass
+
+def parse_value(value_string):
+    """Convert a cell of the batch runs table to a config value.
+
+    Python literals (numbers, quoted strings, lists, tuples, True /
+    False) are evaluated, everything else is used verbatim as a string,
+    so that filenames don't have to be quoted.
+    """
+
+    if literal_eval is not None:
+        try:
+            return literal_eval(value_string)
+        except (ValueError, SyntaxError):
+            pass
+
+    return value_string
+
+def read_runs_table(filename):
+    """Read table of per-run config overrides from a CSV file.
+
+    The first row is the header.  An optional column named run_id
+    gives every run a name, otherwise runs are numbered.  All other
+    column names have the form instance_name.config_attribute, e.g.
+    dcm_rdr.dicom_filenames.  Every following row is a run: each
+    non-empty cell overrides that config attribute of that module for
+    the run.
+
+    @return: list of (run_id, overrides) tuples, where overrides is a
+    dictionary mapping from instance name to list of (attribute, value)
+    tuples.
+    @raise BatchException: if the table is malformed.
+    """
+
+    f = open(filename, 'rb')
+    try:
+        rows = [row for row in csv.reader(f) if row]
+    finally:
+        f.close()
+
+    if not rows:
+        raise BatchException('Runs table %s is empty.' % (filename,))
+
+    header = [h.strip() for h in rows[0]]
+    columns = []
+    for col_idx, h in enumerate(header):
+        if h == 'run_id':
+            continue
+
+        instance_name, dot, attribute = h.rpartition('.')
+        if not dot or not instance_name or not attribute:
+            raise BatchException(
+                'Column %s of runs table is not of the form '
+                'instance_name.config_attribute.' % (h,))
+
+        columns.append((col_idx, instance_name, attribute))
+
+    runs = []
+    run_ids = {}
+    for row_idx, row in enumerate(rows[1:]):
+        if 'run_id' in header and row[header.index('run_id')].strip():
+            run_id = row[header.index('run_id')].strip()
+        else:
+            run_id = '%05d' % (row_idx + 1,)
+
+        if run_id in run_ids:
+            raise BatchException('Duplicate run_id %s in runs table.' %
+                                 (run_id,))
+
+        run_ids[run_id] = 1
+
+        overrides = {}
+        for col_idx, instance_name, attribute in columns:
+            if col_idx >= len(row) or not row[col_idx].strip():
+                continue
+
+            overrides.setdefault(instance_name, []).append(
+                (attribute, parse_value(row[col_idx].strip())))
+
+        runs.append((run_id, overrides))
+
+    return runs
+
+class BatchRun:
+    def __init__(self, run_id, overrides, run_dir):
+        self.run_id = run_id
+        self.overrides = overrides
+        self.run_dir = run_dir
+        self.log_filename = os.path.join(run_dir, 'run.log')
+
+        self.status = 'pending'
+        self.attempts = 0
+        self.returncode = None
+        self.wall_time = 0.0
+        # command line of the DeVIDE process executing this run
+        self.command = None
+
+class BatchInterface(LoggingMixin):
+    """Headless interface that executes a single network over many
+    input sets.
+
+    The network given with --load-network is executed once for every
+    row of the runs table given with --batch-runs (see
+    L{read_runs_table}), with the config overrides of that row applied.
+    Every run is executed by its own DeVIDE process using the script
+    interface and batch_worker.py, so that runs are isolated from each
+    other and crashes in a module only affect a single run.  Up to
+    batch_workers of these processes are active at the same time.
+
+    Every run gets a directory in the batch directory containing its run
+    specification, the combined stdout / stderr of all attempts
+    (run.log) and the DeVIDE log (devide.log).  Failed runs are retried
+    up to batch_retries times.  At the end, batch_report.csv with the
+    status, attempts and wall time of every run is written to the batch
+    directory and a summary is logged.  DeVIDE exits with status 1 if
+    any of the runs failed.
+    """
+
+    def __init__(self, devide_app):
+        self._devide_app = devide_app
+
+        # initialise logging mixin
+        LoggingMixin.__init__(self, devide_app.main_config.log_file)
+
+        print "Initialising batch interface..."
+
+        self._runs = []
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def handler_post_app_init(self):
+        """DeVIDE-required method for interfaces."""
+
+        pass
+
+    def close(self):
+        pass
+
+    def quit(self):
+        if self._failed:
+            sys.exit(1)
+
+    def start_main_loop(self):
+        try:
+            self.run_batch()
+
+        except KeyboardInterrupt:
+            self.log_message('Got keyboard interrupt.')
+            self._failed = True
+
+        except BatchException, e:
+            self.log_error(str(e))
+            self._failed = True
+
+        self.log_message('Shutting down.')
+        self.quit()
+
+    def _get_worker_command(self, run, spec_filename):
+        main_config = self._devide_app.main_config
+        appdir = self._devide_app.get_appdir()
+
+        if hasattr(sys, 'frozen') and sys.frozen:
+            cmd = [sys.executable]
+        else:
+            cmd = [sys.executable, os.path.join(appdir, 'devide.py')]
+
+        cmd.extend([
+            '--interface', 'script',
+            '--config-profile', main_config.config_profile,
+            '--script', os.path.join(appdir, 'interfaces', 'batch_worker.py'),
+            '--script-params', spec_filename,
+            '--log-file', os.path.join(run.run_dir, 'devide.log')])
+
+        if main_config.profile:
+            # every run gets its own execution profile
+            cmd.extend(['--profile-dir', run.run_dir])
+
+        return cmd
+
+    def run_batch(self):
+        """Execute all runs, then write and log the report.
+        """
+
+        main_config = self._devide_app.main_config
+
+        if not main_config.load_network:
+            raise BatchException(
+                'Specify the network to run with --load-network.')
+
+        if not main_config.batch_runs:
+            raise BatchException(
+                'Specify the runs table with --batch-runs.')
+
+        network = os.path.abspath(main_config.load_network)
+        if not os.path.isfile(network):
+            raise BatchException('Network %s does not exist.' % (network,))
+
+        try:
+            runs_table = read_runs_table(main_config.batch_runs)
+        except (IOError, csv.Error), e:
+            raise BatchException('Could not read runs table %s: %s' %
+                                 (main_config.batch_runs, str(e)))
+
+        batch_dir = os.path.abspath(main_config.batch_dir)
+
+        num_workers = main_config.batch_workers
+        if num_workers <= 0:
+            try:
+                import multiprocessing
+                num_workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                num_workers = 1
+
+        self.log_info('Executing %s for %d runs with %d workers in %s.' %
+                      (network, len(runs_table), num_workers, batch_dir))
+
+        run_queue = Queue.Queue()
+        for run_id, overrides in runs_table:
+            run = BatchRun(run_id, overrides,
+                           os.path.join(batch_dir, run_id))
+            if not os.path.isdir(run.run_dir):
+                os.makedirs(run.run_dir)
+
+            spec_filename = os.path.join(run.run_dir, 'run_spec.pickle')
+            f = open(spec_filename, 'wb')
+            try:
+                cPickle.dump({'run_id' : run_id, 'network' : network,
+                              'overrides' : overrides}, f)
+            finally:
+                f.close()
+
+            run.command = self._get_worker_command(run, spec_filename)
+            self._runs.append(run)
+            run_queue.put(run)
+
+        start_time = time.time()
+
+        def worker():
+            while True:
+                try:
+                    run = run_queue.get_nowait()
+                except Queue.Empty:
+                    return
+
+                self._execute_run(run, main_config.batch_retries)
+
+        threads = [threading.Thread(target=worker)
+                   for i in range(min(num_workers, len(self._runs)))]
+        for t in threads:
+            t.setDaemon(True)
+            t.start()
+
+        # join with timeout so that KeyboardInterrupt still gets through
+        for t in threads:
+            while t.isAlive():
+                t.join(0.5)
+
+        self._write_report(batch_dir, time.time() - start_time)
+
+    def _execute_run(self, run, retries):
+        """Execute run in a separate DeVIDE process, retrying up to retries
+        times on failure.
+        """
+
+        while run.attempts <= retries:
+            run.attempts += 1
+            run.status = 'running'
+            self.log_info('Run %s: starting attempt %d.' %
+                          (run.run_id, run.attempts))
+
+            start_time = time.time()
+            log_file = open(run.log_filename, 'ab')
+            try:
+                log_file.write('\n##### attempt %d, %s\n' %
+                               (run.attempts, time.ctime()))
+                log_file.flush()
+                try:
+                    p = subprocess.Popen(run.command, stdout=log_file,
+                                         stderr=subprocess.STDOUT)
+                    run.returncode = p.wait()
+                except OSError, e:
+                    log_file.write('Could not start DeVIDE: %s\n' % (str(e),))
+                    run.returncode = -1
+            finally:
+                log_file.close()
+
+            run.wall_time = time.time() - start_time
+
+            if run.returncode == 0:
+                run.status = 'succeeded'
+                self.log_info('Run %s: succeeded in %.1f s.' %
+                              (run.run_id, run.wall_time))
+                return
+
+            run.status = 'failed'
+            self.log_warning('Run %s: attempt %d failed with exit code %d, '
+                             'see %s.' % (run.run_id, run.attempts,
+                                          run.returncode, run.log_filename))
+
+        self._lock.acquire()
+        self._failed = True
+        self._lock.release()
+
+    def _write_report(self, batch_dir, wall_time):
+        report_filename = os.path.join(batch_dir, 'batch_report.csv')
+        f = open(report_filename, 'wb')
+        try:
+            w = csv.writer(f)
+            w.writerow(['run_id', 'status', 'attempts', 'returncode',
+                        'wall_time', 'log'])
+            for run in self._runs:
+                w.writerow([run.run_id, run.status, run.attempts,
+                            run.returncode, '%.2f' % (run.wall_time,),
+                            run.log_filename])
+        finally:
+            f.close()
+
+        failed = [run.run_id for run in self._runs
+                  if run.status != 'succeeded']
+
+        self.log_info('Batch done in %.1f s: %d runs succeeded, %d failed.' %
+                      (wall_time, len(self._runs) - len(failed),
+                       len(failed)))
+        if failed:
+            self.log_warning('Failed runs: %s' % (', '.join(failed),))
+
+        self.log_info('Report written to %s.' % (report_filename,))
@@ -0,0 +1,53 @@
+# worker script for a single run of the DeVIDE batch interface
+
+# The BatchInterface starts one DeVIDE process per run with:
+# devide --interface script --script batch_worker.py --script-params spec
+# where spec is the filename of a pickled run specification written by
+# BatchInterface.  As with all DeVIDE scripts, the following variables
+# are magically set:
+# interface - instance of ScriptInterface, see simple_api_mixin.py
+# script_params - the name of the run specification file
+
+# Any exception terminates DeVIDE with a non-zero exit code, which the
+# BatchInterface reports as a failed attempt.
+
+import cPickle
+import time
+
+def main():
+    f = open(script_params, 'rb')
+    try:
+        spec = cPickle.load(f)
+    finally:
+        f.close()
+
+    print "batch run %s starting" % (spec['run_id'],)
+    start_time = time.time()
+
+    mdict, conn = interface.load_and_realise_network(spec['network'])
+
+    # spec['overrides'] maps from module instance name to a list of
+    # (config attribute, value) tuples
+    for instance_name, attributes in spec['overrides'].items():
+        if interface.get_module_instance(instance_name) is None:
+            raise RuntimeError(
+                'Module %s does not exist in network %s.' %
+                (instance_name, spec['network']))
+
+        config = interface.get_module_config(instance_name)
+        for attribute, value in attributes:
+            if not hasattr(config, attribute):
+                raise RuntimeError(
+                    'Module %s has no config attribute %s.' %
+                    (instance_name, attribute))
+
+            setattr(config, attribute, value)
+
+        interface.set_module_config(instance_name, config)
+
+    interface.execute_network(mdict.values())
+
+    print "batch run %s done in %.2f s." % \
+          (spec['run_id'], time.time() - start_time)
+
+main()
@@ -5,13 +5,13 @@ import sys
 
 class LoggingMixin:
 
-    def __init__(self):
+    def __init__(self, log_filename='devide.log'):
         # this sets things up for logging to stderr
         logging.basicConfig(level=logging.DEBUG,
                             format='%(asctime)s %(levelname)s %(message)s',
                             stream=sys.stdout)
 
-        file_handler = logging.FileHandler('devide.log', 'w')
+        file_handler = logging.FileHandler(log_filename, 'w')
         file_handler.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
         file_handler.setFormatter(formatter)
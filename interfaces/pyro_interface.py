@@ -1,4 +1,5 @@
 import Pyro.core
+from remote_api import JobServer, RemoteAPI
 import time
 
 # client example:
@@ -6,11 +7,13 @@ import time
 # Pyro.core.initClient()
 # URI = 'PYROLOC://localhost:7766/DeVIDE'
 # p = Pyro.core.getProxyForURI(URI)
-# p.test_func()
+# p.test_function()
+# see remote_api.py for the complete API
 
-class ServerProxy(Pyro.core.ObjBase):
-    def test_function(self):
-        return "Hello world!"
+class ServerProxy(Pyro.core.ObjBase, RemoteAPI):
+    def __init__(self, job_server):
+        Pyro.core.ObjBase.__init__(self)
+        RemoteAPI.__init__(self, job_server)
 
 class PyroInterface:
 
@@ -18,10 +21,14 @@ class PyroInterface:
         self._devide_app = devide_app
 
         print "Initialising Pyro..."
+        self.job_server = JobServer(devide_app)
+
         Pyro.core.initServer()
-        self.daemon = Pyro.core.Daemon()
+        main_config = devide_app.main_config
+        self.daemon = Pyro.core.Daemon(host=main_config.rpc_host,
+                                       port=main_config.rpc_port or 7766)
 
-        self.server_proxy = ServerProxy()
+        self.server_proxy = ServerProxy(self.job_server)
         self.server_proxy_name = 'DeVIDE'
         self.uri = self.daemon.connect(
             self.server_proxy, self.server_proxy_name)
@@ -32,11 +39,20 @@ class PyroInterface:
     def handler_post_app_init(self):
         """DeVIDE-required method for interfaces."""
 
-        pass
+        self.job_server.start()
+
+        # a network given with --load-network is loaded before the first
+        # request, so that the process is warm
+        load_network = self._devide_app.main_config.load_network
+        if load_network:
+            self.job_server.submit('load_network',
+                                   self.job_server.load_network,
+                                   load_network)
 
     def quit(self):
 	self.daemon.disconnect(self.server_proxy)
 	self.daemon.shutdown()
+        self.job_server.stop()
 
     def log_error_list(self, msgs):
         """Log a list of strings as error.
@@ -86,10 +102,13 @@ class PyroInterface:
         # in cases where DeVIDE is very busy, this is quite
         # handy.
         print "PROGRESS: %s: %.2f" % (message, progress)
+        self.job_server.set_progress(progress, message)
 
     def start_main_loop(self):
         self.log_message('DeVIDE available at %s' % (self.easy_uri,))
         self.log_message('Starting Pyro request loop.')
+        self.log_message('Output handoff directory is %s' %
+                         (self.job_server.get_handoff_dir(),))
         try:
             self.daemon.requestLoop()
             
@@ -0,0 +1,723 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Job queue and remote API shared by the XML-RPC and Pyro interfaces.
+
+A single DeVIDE process can serve any number of jobs, so that kit
+loading and module instantiation are paid only once per node.  All
+operations that touch the network are executed, in the order in which
+they were requested, by a single worker thread of the L{JobServer}.
+Long operations (network execution) are asynchronous: they return a job
+id that can be polled with get_job_status.  Short operations (loading
+the network, config changes, fetching outputs) are queued in the same
+way, but the call waits for them.
+
+Small outputs are returned as values.  Large outputs are handed off as
+files in the handoff directory, which is on the shared memory file
+system /dev/shm if there is one, so that clients on the same node can
+read or numpy.load(mmap_mode='r') them without going to disk.
+
+XML-RPC client example::
+
+ import xmlrpclib
+ s = xmlrpclib.ServerProxy('http://localhost:8000', allow_none=True)
+ job_id = s.submit_job('/data/seg.dvn',
+                       {'dcm_rdr' : {'dicom_filenames' : [...]}},
+                       [['thresh', 0, 'file']])
+ while s.get_job_status(job_id)['status'] in ('queued', 'running'):
+     time.sleep(1)
+ output_filename, = s.get_job_result(job_id)
+"""
+
+import copy
+import cPickle
+import os
+import Queue
+import shutil
+from simple_api_mixin import SimpleAPIMixin
+import tempfile
+import threading
+import time
+import traceback
+
+# outputs with more elements than this have to be fetched as file
+MAX_VALUE_ELEMENTS = 65536
+# number of finished jobs of which the status and results are kept
+MAX_FINISHED_JOBS = 1000
+# VTK XML file extension of every dataset type that we can hand off
+VTK_XML_EXTENSIONS = (
+    ('vtkImageData', 'vti'), ('vtkPolyData', 'vtp'),
+    ('vtkUnstructuredGrid', 'vtu'), ('vtkStructuredGrid', 'vts'),
+    ('vtkRectilinearGrid', 'vtr'))
+
+class RemoteAPIException(Exception):
+    pass
+
+def to_remote_value(value, max_elements=MAX_VALUE_ELEMENTS):
+    """Convert value to nested lists, dictionaries and scalars that can
+    be transported by XML-RPC and Pyro.
+
+    Tuples become lists, numpy arrays and scalars are converted with
+    their tolist() method and dictionary keys become strings.
+
+    @raise RemoteAPIException: if value is of a type that can't be
+    converted, e.g. a VTK object, or if it has more than max_elements
+    elements.
+    """
+
+    # number of elements converted so far, in a list so that the nested
+    # function can modify it
+    count = [0]
+
+    def convert(v):
+        count[0] += 1
+        if count[0] > max_elements:
+            raise RemoteAPIException(
+                'Value has more than %d elements, fetch it as file.' %
+                (max_elements,))
+
+        if v is None or isinstance(v, (bool, int, long, float, str,
+                                       unicode)):
+            return v
+
+        elif isinstance(v, (list, tuple)):
+            return [convert(i) for i in v]
+
+        elif isinstance(v, dict):
+            return dict([(str(k), convert(i)) for k, i in v.items()])
+
+        elif hasattr(v, 'tolist') and hasattr(v, 'size'):
+            # numpy array or scalar
+            if v.size > max_elements:
+                raise RemoteAPIException(
+                    'Array has %d elements, fetch it as file.' % (v.size,))
+
+            count[0] += v.size
+            return v.tolist()
+
+        else:
+            raise RemoteAPIException(
+                'Values of type %s can not be returned, fetch them as '
+                'file.' % (type(v).__name__,))
+
+    return convert(value)
+
+def write_output_file(data, basename):
+    """Write data to basename with an extension that depends on its type
+    and return the full filename.
+
+    VTK datasets are written in the VTK XML format with raw appended
+    data, numpy arrays as .npy and everything else is pickled.
+
+    @raise RemoteAPIException: if data can't be written.
+    """
+
+    if hasattr(data, 'IsA'):
+        import vtk
+        for class_name, ext in VTK_XML_EXTENSIONS:
+            if data.IsA(class_name):
+                filename = '%s.%s' % (basename, ext)
+                writer = vtk.vtkXMLDataSetWriter()
+                writer.SetInput(data)
+                writer.SetFileName(filename)
+                # raw binary is much faster to write and read than the
+                # default base64 encoding
+                writer.SetDataModeToAppended()
+                writer.EncodeAppendedDataOff()
+                if not writer.Write():
+                    raise RemoteAPIException(
+                        'Could not write %s.' % (filename,))
+
+                return filename
+
+        raise RemoteAPIException(
+            'Outputs of type %s can not be fetched as file.' %
+            (data.GetClassName(),))
+
+    if hasattr(data, 'tofile') and hasattr(data, 'dtype'):
+        import numpy
+        filename = '%s.npy' % (basename,)
+        numpy.save(filename, data)
+        return filename
+
+    filename = '%s.pickle' % (basename,)
+    f = open(filename, 'wb')
+    try:
+        try:
+            cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError), e:
+            raise RemoteAPIException(
+                'Outputs of type %s can not be fetched as file: %s' %
+                (type(data).__name__, str(e)))
+    finally:
+        f.close()
+
+    return filename
+
+def get_default_handoff_dir():
+    """Return new directory for output files, on the shared memory file
+    system if there is one.
+    """
+
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return tempfile.mkdtemp(prefix='devide_handoff_', dir='/dev/shm')
+
+    return tempfile.mkdtemp(prefix='devide_handoff_')
+
+class RemoteJob:
+    """Operation queued on the JobServer, with its status and result.
+    """
+
+    def __init__(self, job_id, kind, function, args):
+        self.job_id = job_id
+        self.kind = kind
+        self.function = function
+        self.args = args
+
+        # queued, running, done, failed or cancelled
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+
+        self.submit_time = time.time()
+        self.start_time = None
+        self.end_time = None
+
+        # set when the job is done, failed or cancelled
+        self.finished = threading.Event()
+
+    def get_status(self):
+        """Return dictionary with the status of this job, in remote
+        values.
+        """
+
+        if self.start_time is None:
+            wall_time = 0.0
+        elif self.end_time is None:
+            wall_time = time.time() - self.start_time
+        else:
+            wall_time = self.end_time - self.start_time
+
+        return {'job_id' : self.job_id, 'kind' : self.kind,
+                'status' : self.status, 'progress' : self.progress,
+                'message' : self.message, 'error' : self.error,
+                'wall_time' : wall_time}
+
+class JobServer(SimpleAPIMixin):
+    """Executes network operations for remote clients, one at a time, in
+    a worker thread.
+
+    The loaded network is kept between jobs.  A job for the network
+    that is already loaded only applies its config overrides, after
+    restoring the configs that the previous job overrode, so that only
+    the modules downstream of actual config changes are re-executed.
+    """
+
+    def __init__(self, devide_app, handoff_dir=None):
+        SimpleAPIMixin.__init__(self, devide_app)
+
+        self._queue = Queue.Queue()
+        self._jobs = {}
+        # ids of finished jobs, oldest first
+        self._finished_ids = []
+        self._next_job_id = 1
+        self._current_job = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+        if handoff_dir:
+            if not os.path.isdir(handoff_dir):
+                os.makedirs(handoff_dir)
+
+            self._handoff_dir = os.path.abspath(handoff_dir)
+            self._own_handoff_dir = False
+        else:
+            self._handoff_dir = get_default_handoff_dir()
+            self._own_handoff_dir = True
+
+        # (filename, mtime) of the loaded network, None if there is none
+        self._network = None
+        # maps from instance name to MetaModule of the loaded network
+        self._meta_modules = {}
+        # maps from instance name to dictionary mapping from config
+        # attribute to the value it had before a job overrode it
+        self._overridden = {}
+
+    def get_handoff_dir(self):
+        return self._handoff_dir
+
+    def start(self):
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker thread after the current job and remove the
+        handoff directory if we created it.
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(5.0)
+            self._thread = None
+
+        if self._own_handoff_dir:
+            shutil.rmtree(self._handoff_dir, True)
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            self._lock.acquire()
+            try:
+                if job.status == 'cancelled':
+                    continue
+
+                job.status = 'running'
+                job.start_time = time.time()
+                self._current_job = job
+            finally:
+                self._lock.release()
+
+            try:
+                result = job.function(*job.args)
+
+            except Exception, e:
+                self.devide_app.log_error(
+                    'Job %d (%s) failed: %s' % (job.job_id, job.kind, str(e)))
+                error = ''.join(traceback.format_exception_only(
+                    e.__class__, e)).strip()
+                self._finish_job(job, 'failed', error=error)
+
+            else:
+                self._finish_job(job, 'done', result=result)
+
+    def _finish_job(self, job, status, result=None, error=None):
+        self._lock.acquire()
+        try:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.end_time = time.time()
+            if status == 'done':
+                job.progress = 100.0
+
+            if self._current_job is job:
+                self._current_job = None
+
+            self._finished_ids.append(job.job_id)
+            while len(self._finished_ids) > MAX_FINISHED_JOBS:
+                del self._jobs[self._finished_ids.pop(0)]
+
+        finally:
+            self._lock.release()
+
+        job.finished.set()
+
+    def submit(self, kind, function, *args):
+        """Queue function(*args) for execution by the worker thread and
+        return its RemoteJob.
+        """
+
+        self._lock.acquire()
+        try:
+            job = RemoteJob(self._next_job_id, kind, function, args)
+            self._next_job_id += 1
+            self._jobs[job.job_id] = job
+        finally:
+            self._lock.release()
+
+        self._queue.put(job)
+        return job
+
+    def call(self, kind, function, *args):
+        """Queue function(*args), wait for it and return its result.
+
+        @raise RemoteAPIException: if the function failed.
+        """
+
+        job = self.submit(kind, function, *args)
+        # wait with timeout so that KeyboardInterrupt still gets through
+        while not job.finished.isSet():
+            job.finished.wait(0.5)
+
+        if job.status != 'done':
+            raise RemoteAPIException(job.error or job.status)
+
+        return job.result
+
+    def get_job(self, job_id):
+        self._lock.acquire()
+        try:
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise RemoteAPIException('Unknown job %s.' % (job_id,))
+        finally:
+            self._lock.release()
+
+    def get_jobs(self):
+        self._lock.acquire()
+        try:
+            job_ids = self._jobs.keys()
+            job_ids.sort()
+            return [self._jobs[job_id] for job_id in job_ids]
+        finally:
+            self._lock.release()
+
+    def cancel(self, job_id):
+        """Cancel job if it is still queued.
+
+        @return: True if the job was cancelled.
+        """
+
+        job = self.get_job(job_id)
+        self._lock.acquire()
+        try:
+            if job.status != 'queued':
+                return False
+
+            job.status = 'cancelled'
+        finally:
+            self._lock.release()
+
+        self._finish_job(job, 'cancelled')
+        return True
+
+    def set_progress(self, progress, message):
+        """Record progress of the running job, called by the interface.
+        """
+
+        job = self._current_job
+        if job is not None:
+            job.progress = progress
+            job.message = message
+
+    # the methods below are executed by the worker thread ############
+
+    def get_module_names(self):
+        names = self._meta_modules.keys()
+        names.sort()
+        return names
+
+    def _get_instance(self, instance_name):
+        mi = self.get_module_instance(instance_name)
+        if mi is None:
+            raise RemoteAPIException(
+                'Module %s does not exist.' % (instance_name,))
+
+        return mi
+
+    def load_network(self, filename):
+        """Load filename, unless it is the network that is already
+        loaded, and return the list of its instance names.
+        """
+
+        filename = os.path.abspath(filename)
+        try:
+            network = (filename, os.stat(filename).st_mtime)
+        except OSError, e:
+            raise RemoteAPIException(
+                'Could not open network file %s: %s' % (filename, str(e)))
+
+        if network == self._network:
+            return self.get_module_names()
+
+        self.clear_network()
+        self._network = None
+        self._meta_modules = {}
+        self._overridden = {}
+
+        self._meta_modules, connections = \
+                            self.load_and_realise_network(filename)
+        self._network = network
+        return self.get_module_names()
+
+    def get_remote_config(self, instance_name):
+        """Return dictionary with all config attributes of the module
+        that can be transported as remote values.
+        """
+
+        config = self._get_instance(instance_name).get_config()
+        remote_config = {}
+        for attribute, value in config.__dict__.items():
+            try:
+                remote_config[attribute] = to_remote_value(value)
+            except RemoteAPIException:
+                pass
+
+        return remote_config
+
+    def _set_config_values(self, instance_name, values, record=False):
+        """Set the config attributes in dictionary values of the module
+        and mark it modified if anything changed.
+
+        @param record: if True, remember the old values so that the next
+        job can restore them.
+        """
+
+        mi = self._get_instance(instance_name)
+        config = copy.copy(mi.get_config())
+        changed = False
+        for attribute, value in values.items():
+            if not hasattr(config, attribute):
+                raise RemoteAPIException(
+                    'Module %s has no config attribute %s.' %
+                    (instance_name, attribute))
+
+            old_value = getattr(config, attribute)
+            if record:
+                self._overridden.setdefault(instance_name, {}).setdefault(
+                    attribute, old_value)
+
+            if value != old_value:
+                setattr(config, attribute, value)
+                changed = True
+
+        if changed:
+            mi.set_config(config)
+            mm = self.devide_app.get_module_manager()
+            meta_module = mm.get_meta_module(mi)
+            for part in range(meta_module.numParts):
+                mm.modify_module(mi, part)
+
+    def set_remote_config(self, instance_name, values):
+        self._set_config_values(instance_name, values)
+        # these changes are permanent, so the next job should not
+        # restore them
+        overridden = self._overridden.get(instance_name, {})
+        for attribute in values:
+            if attribute in overridden:
+                del overridden[attribute]
+
+        return True
+
+    def execute(self):
+        if not self._meta_modules:
+            raise RemoteAPIException('No network has been loaded.')
+
+        self.execute_network(self._meta_modules.values())
+        return True
+
+    def get_output_value(self, instance_name, output_idx):
+        mi = self._get_instance(instance_name)
+        return to_remote_value(mi.get_output(output_idx))
+
+    def get_output_file(self, instance_name, output_idx):
+        mi = self._get_instance(instance_name)
+        job = self._current_job
+        basename = os.path.join(
+            self._handoff_dir,
+            'job%d_%s_%d' % (job.job_id, instance_name, output_idx))
+        return write_output_file(mi.get_output(output_idx), basename)
+
+    def run_job(self, filename, overrides, outputs):
+        """Load the network in filename, apply the config overrides,
+        execute it and return the requested outputs.
+
+        @param overrides: dictionary mapping from instance name to
+        dictionary mapping from config attribute to value.
+        @param outputs: list of (instance name, output index, mode)
+        sequences, where mode is 'value' or 'file'.
+        @return: list with the value or filename of every output.
+        """
+
+        self.load_network(filename)
+
+        # restore what the previous job overrode, but leave alone what
+        # this job is going to override anyway, so that modules are only
+        # modified if their config really changes
+        previous = self._overridden
+        self._overridden = {}
+        for instance_name, values in previous.items():
+            new_values = overrides.get(instance_name, {})
+            restore = dict([(a, v) for a, v in values.items()
+                            if a not in new_values])
+            if restore:
+                self._set_config_values(instance_name, restore)
+
+            for attribute in new_values:
+                if attribute in values:
+                    # remember the value of the network file, not the
+                    # one of the previous job
+                    self._overridden.setdefault(instance_name, {})[
+                        attribute] = values[attribute]
+
+        for instance_name, values in overrides.items():
+            self._set_config_values(instance_name, values, record=True)
+
+        self.execute()
+
+        results = []
+        for instance_name, output_idx, mode in outputs:
+            if mode == 'file':
+                results.append(self.get_output_file(instance_name,
+                                                    output_idx))
+            elif mode == 'value':
+                results.append(self.get_output_value(instance_name,
+                                                     output_idx))
+            else:
+                raise RemoteAPIException(
+                    'Output mode should be value or file, not %s.' %
+                    (mode,))
+
+        return results
+
+class RemoteAPI:
+    """Methods that are exposed to remote clients.
+
+    All arguments and return values are remote values, see
+    L{to_remote_value}.  Errors are raised as exceptions, which XML-RPC
+    clients receive as faults.
+    """
+
+    def __init__(self, job_server):
+        self._job_server = job_server
+
+    def test_function(self):
+        return "Hello World!"
+
+    def load_network(self, filename):
+        """Load network file filename, unless it is already loaded, and
+        return the list of its module instance names.
+        """
+
+        js = self._job_server
+        return js.call('load_network', js.load_network, filename)
+
+    def get_module_names(self):
+        """Return the instance names of the modules in the network.
+        """
+
+        js = self._job_server
+        return js.call('get_module_names', js.get_module_names)
+
+    def get_module_config(self, instance_name):
+        """Return dictionary with the config attributes of the module.
+        """
+
+        js = self._job_server
+        return js.call('get_module_config', js.get_remote_config,
+                       instance_name)
+
+    def set_module_config(self, instance_name, values):
+        """Change the config attributes in dictionary values of the
+        module.  The changes are kept until the network is reloaded.
+        """
+
+        js = self._job_server
+        return js.call('set_module_config', js.set_remote_config,
+                       instance_name, values)
+
+    def execute_network(self):
+        """Queue execution of the loaded network and return job id.
+        """
+
+        js = self._job_server
+        return js.submit('execute_network', js.execute).job_id
+
+    def submit_job(self, filename, overrides=None, outputs=None):
+        """Queue a complete job and return its job id.
+
+        The job loads network file filename (unless it is already
+        loaded), applies the config overrides for this job only,
+        executes the network and fetches the outputs.  Fetch the result
+        with get_job_result.
+
+        @param overrides: dictionary mapping from instance name to
+        dictionary mapping from config attribute to value.
+        @param outputs: list of [instance name, output index, mode]
+        lists, where mode is 'value' to return the output itself or
+        'file' to write it to the handoff directory and return the
+        filename.
+        """
+
+        if overrides is None:
+            overrides = {}
+
+        if outputs is None:
+            outputs = []
+
+        js = self._job_server
+        return js.submit('job', js.run_job, filename, overrides,
+                         [tuple(o) for o in outputs]).job_id
+
+    def get_job_status(self, job_id):
+        """Return dictionary with status (queued, running, done, failed
+        or cancelled), progress, message, error and wall_time of the
+        job.
+        """
+
+        return self._job_server.get_job(job_id).get_status()
+
+    def wait_for_job(self, job_id, timeout=10.0):
+        """Wait at most timeout seconds for the job to finish and return
+        its status.
+        """
+
+        job = self._job_server.get_job(job_id)
+        job.finished.wait(timeout)
+        return job.get_status()
+
+    def get_job_result(self, job_id):
+        """Return the result of a finished job.
+        """
+
+        job = self._job_server.get_job(job_id)
+        if job.status != 'done':
+            raise RemoteAPIException(
+                'Job %d is %s.' % (job_id, job.error or job.status))
+
+        return job.result
+
+    def cancel_job(self, job_id):
+        """Cancel a queued job.  Return False if it is already running or
+        finished.
+        """
+
+        return self._job_server.cancel(job_id)
+
+    def list_jobs(self):
+        """Return list with the status of all known jobs.
+        """
+
+        return [job.get_status() for job in self._job_server.get_jobs()]
+
+    def get_output(self, instance_name, output_idx):
+        """Return output output_idx of the module, if it is small enough
+        to be returned as a value.
+        """
+
+        js = self._job_server
+        return js.call('get_output', js.get_output_value, instance_name,
+                       output_idx)
+
+    def get_output_file(self, instance_name, output_idx):
+        """Write output output_idx of the module to the handoff directory
+        and return the filename.  Call release_file when done with it.
+        """
+
+        js = self._job_server
+        return js.call('get_output_file', js.get_output_file,
+                       instance_name, output_idx)
+
+    def get_handoff_dir(self):
+        return self._job_server.get_handoff_dir()
+
+    def release_file(self, filename):
+        """Remove a file that was handed off.  Return False if filename
+        is not in the handoff directory or does not exist.
+        """
+
+        filename = os.path.abspath(filename)
+        if os.path.dirname(filename) != self._job_server.get_handoff_dir() \
+           or not os.path.isfile(filename):
+            return False
+
+        os.remove(filename)
+        return True
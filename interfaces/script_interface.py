@@ -9,7 +9,7 @@ class ScriptInterface(SimpleAPIMixin, LoggingMixin):
         self.devide_app = devide_app
 
         # initialise logging mixin
-        LoggingMixin.__init__(self)
+        LoggingMixin.__init__(self, devide_app.main_config.log_file)
 
         print "Initialising script interface..."
         
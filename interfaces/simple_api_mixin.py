@@ -36,6 +36,22 @@ class SimpleAPIMixin:
         
         return new_modules_dict2, new_connections
 
+    def save_network(self, filename, meta_modules):
+        """Save the network represented by the given MetaModule
+        instances to a dvn file.
+
+        The glyphs of the modules are laid out automatically, so that
+        the network can be loaded and edited in the graph editor.
+
+        @param filename: name of .dvn network file.
+        """
+
+        mm = self.devide_app.get_module_manager()
+        pms_dict, connection_list = mm.serialise_module_instances(
+            [meta_module.instance for meta_module in meta_modules])
+        self.devide_app.network_manager.save_network(
+            pms_dict, connection_list, None, filename)
+
     def execute_network(self, meta_modules):
         """Given a list of MetaModule instances, execute the network
         represented by those modules.
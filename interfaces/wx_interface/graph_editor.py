@@ -27,20 +27,18 @@ from internal.devide_canvas.devide_canvas import DeVIDECanvas
 from internal.devide_canvas.devide_canvas_object import \
 DeVIDECanvasGlyph, DeVIDECanvasLine, DeVIDECanvasSimpleLine, \
 DeVIDECanvasRBBox
+from internal.devide_canvas.line_router import LineRouter
 import gen_utils
-from module_manager import ModuleManagerException
+from module_manager import ModuleManagerException, PickledConnection
 import module_utils # for get_module_icon
+import network_layout
 import os
 import re
 import string
-import sys
 import time
 import weakref
 import wx
 
-# so we're using VTK here for doing the graph layout.
-import vtk
-
 from module_kits.misc_kit import dprint
 
 
@@ -318,6 +316,14 @@ class GraphEditor:
                     [(wx.ACCEL_NORMAL, wx.WXK_DELETE, 
                         self.ID_DELETE_GLYPHS)]))
 
+        # routes lines around the glyphs near them, which are found
+        # with the spatial index of the canvas
+        self._line_router = LineRouter(
+            self._get_glyph_bounds_in, DeVIDECanvasLine.routingOvershoot)
+        # world bounds of the glyphs that are being dragged, at the start
+        # of the drag
+        self._drag_start_bounds = []
+
         # initialise selection
         self._selected_glyphs = GlyphSelection(self.canvas,
                                               'selected')
@@ -978,13 +984,14 @@ class GraphEditor:
                 ni.Enable(False)
 
         #############################################################
-        if False:
-            layout_sucky_id = wx.NewId()
-            ni = wx.MenuItem(pmenu, layout_sucky_id, 'Sucky graph layout\tF7',
-                             'Perform SUCKY(tm) graph layout.')
-            pmenu.AppendItem(ni)
-            wx.EVT_MENU(eventWidget, layout_sucky_id,
-                    lambda e: self._layout_network_sucky())
+        layout_id = wx.NewId()
+        ni = wx.MenuItem(pmenu, layout_id, 'Layout network\tF7',
+                         'Automatically lay out the selected modules, or '
+                         'the whole network if fewer than two modules '
+                         'are selected.')
+        pmenu.AppendItem(ni)
+        wx.EVT_MENU(eventWidget, layout_id,
+                    lambda e: self._handler_layout_network())
 
         reset_graph_view_id = wx.NewId()
         ni = wx.MenuItem(pmenu, reset_graph_view_id, 
@@ -1062,8 +1069,8 @@ class GraphEditor:
                         mm.get_instance_name(temp_module)]
                 glyph = self.create_glyph(x,y,gLabel,temp_module)
 
-                # route all lines
-                self._route_all_lines()
+                # route the lines that the new glyph is in the way of
+                self._route_affected_lines([glyph])
 
                 return (temp_module, glyph)
 
@@ -1320,9 +1327,15 @@ class GraphEditor:
         else: # no search string, only selected categories
             results_disp['misc'] = self._moduleCats[selected_cat]
 
-        # make sure separate results are sorted
+        # make sure separate results are sorted: search results on
+        # relevance first, then alphabetically
         for where_found in results_disp:
-            results_disp[where_found].sort()
+            if search_results is None:
+                results_disp[where_found].sort()
+            else:
+                score = mm.module_search.get_match_score
+                results_disp[where_found].sort(
+                    key=lambda srkey: (-score(srkey, where_found), srkey))
 
         # now populate the mlb
         mlb = mf.module_list_box
@@ -1461,13 +1474,14 @@ class GraphEditor:
                 ll.append(new_name)
 
                 # change the list of labels
+                old_bounds = glyph.get_world_bounds()
                 glyph.setLabelList(ll)
                 # which means we have to update the geometry (so they
                 # are actually rendered)
                 glyph.update_geometry()
                 # which means we probably have to reroute lines as the
                 # module might have changed size
-                self._route_all_lines()
+                self._route_affected_lines([glyph], [old_bounds])
 
                 self.canvas.redraw()
 
@@ -1876,7 +1890,14 @@ class GraphEditor:
         # only here!
         self.canvas.redraw()
 
-    def _create_line(self, fromObject, fromOutputIdx, toObject, toInputIdx):
+    def _create_line(self, fromObject, fromOutputIdx, toObject, toInputIdx,
+                     route=True):
+        """Create line between the given glyph ports.
+
+        @param route: if False, the line is not routed, so that the
+        caller can route many new lines in one go.
+        """
+        
         l1 = DeVIDECanvasLine(self.canvas, fromObject, fromOutputIdx,
                          toObject, toInputIdx)
         dprint("_create_line:: calling canvas.add_object")
@@ -1887,7 +1908,10 @@ class GraphEditor:
         fromObject.outputLines[fromOutputIdx].append(l1)
 
         # REROUTE THIS LINE
-        self._route_line(l1)
+        if route:
+            self._route_line(l1)
+
+        return l1
 
     def _connect(self, fromObject, fromOutputIdx,
                  toObject, toInputIdx):
@@ -1982,116 +2006,67 @@ class GraphEditor:
             sGlyph = newGlyphDict[connection.source_instance_name]
             tGlyph = newGlyphDict[connection.target_instance_name]
             self._create_line(sGlyph, connection.output_idx,
-                             tGlyph, connection.input_idx)
+                             tGlyph, connection.input_idx, route=False)
+
+        # route all new lines, and the existing lines that the new
+        # glyphs are in the way of, in one go
+        self._route_lines(self._get_affected_lines(newGlyphDict.values()))
 
         # finally we can let the canvas redraw
         self.canvas.update_all_geometry()
         self.canvas.redraw()
 
-    def _layout_network_sucky(self):
+    def _handler_layout_network(self):
+        glyphs = self._selected_glyphs.getSelectedGlyphs()
+        if len(glyphs) < 2:
+            glyphs = self.canvas.getObjectsOfClass(DeVIDECanvasGlyph)
 
-        # I've done it this way so that I can easily paste this method
-        # into the main DeVIDE introspection window.
+        self._layout_network(glyphs)
 
-        #from internal.wxPyCanvas import wxpc
-        iface = self._interface
-        #iface = devide_app.get_interface()
-        canvas = self.canvas
-        ge = iface._graph_editor
-        mm = self._devide_app.get_module_manager()
-        #mm = devide_app.get_module_manager()
-
-        
+    def _layout_network(self, glyphs):
+        """Lay out glyphs with the layered layout of network_layout.
 
-        all_glyphs = self.canvas.getObjectsOfClass(
-            DeVIDECanvasGlyph)
-        num_glyphs = len(all_glyphs)
+        Only the connections between glyphs are taken into account.
+        The top left corner of the laid out glyphs stays where it was,
+        and all lines are rerouted afterwards.
+        """
 
         # we can only do this if we have more than one glyph to
         # move around.
-        if num_glyphs <= 1:
+        if len(glyphs) <= 1:
             return
 
-        (pmsDict, connection_list, glyphPosDict) = \
-                  ge._serialise_network(all_glyphs)
-
-        # first convert all glyph positions to points and connections
-        # to polylines.
-        polynet = vtk.vtkPolyData()
-        points = vtk.vtkPoints()
-        points.Allocate(num_glyphs, 10)
-        lines = vtk.vtkCellArray()
-        lines.Allocate(len(connection_list), 10)
-
-        # for each glyph, we store in a dict its pointid in the
-        # polydata
-        name2ptid = {}
-        ptid2glyph = {}
-
+        mm = self._devide_app.get_module_manager()
+        name2glyph = {}
+        sizes = {}
+        for glyph in glyphs:
+            instance_name = mm.get_instance_name(glyph.module_instance)
+            name2glyph[instance_name] = glyph
+            sizes[instance_name] = glyph.get_bounds()
 
-        for glyph in all_glyphs:
-            pos = glyph.get_position()
+        connection_list = []
+        for instance_name, glyph in name2glyph.items():
+            for output_idx, lines in enumerate(glyph.outputLines):
+                for line in lines:
+                    connection_list.append(PickledConnection(
+                        instance_name, output_idx,
+                        mm.get_instance_name(line.toGlyph.module_instance),
+                        line.toInputIdx))
+
+        # top left of the current glyphs
+        origin = (min([g.get_position()[0] for g in glyphs]),
+                  max([g.get_position()[1] + g.get_bounds()[1]
+                       for g in glyphs]))
+
+        positions = network_layout.layout_network(
+            name2glyph.keys(), connection_list, sizes, origin)
+
+        for instance_name, position in positions.items():
+            glyph = name2glyph[instance_name]
+            glyph.set_position(position)
+            glyph.update_geometry()
 
-            new_pos = pos + (0.0,)
-            ptid = points.InsertNextPoint(new_pos)
-            instance_name = mm.get_instance_name(glyph.module_instance)
-            name2ptid[instance_name] = ptid
-            ptid2glyph[ptid] = glyph
-
-        condone = {} # we use this dict to add each connection once
-        for connection in connection_list:
-            prod_ptid = name2ptid[connection.source_instance_name]
-            cons_ptid = name2ptid[connection.target_instance_name]
-
-            # we keep this for now, we want the number of connections
-            # between two modules to play a role in the layout.
-            #if (prod_ptid, cons_ptid) in condone:
-            #    continue
-            #else:
-            #    condone[(prod_ptid, cons_ptid)] = 1
-
-            v = vtk.vtkIdList()
-            v.InsertNextId(prod_ptid)
-            v.InsertNextId(cons_ptid)
-            lines.InsertNextCell(v)
-
-        # we can also add an extra connection from each glyph to EVERY
-        # other glyph to keep things more balanced...  (SIGH)
-        for iglyph in all_glyphs:
-            iptid = name2ptid[mm.get_instance_name(iglyph.module_instance)]
-            for jglyph in all_glyphs:
-                if iglyph is not jglyph:
-                    jptid = name2ptid[mm.get_instance_name(jglyph.module_instance)]
-                    v = vtk.vtkIdList()
-                    v.InsertNextId(iptid)
-                    v.InsertNextId(jptid)
-                    lines.InsertNextCell(v)
-
-
-        polynet.SetPoints(points)
-        polynet.SetLines(lines)
-
-        lf = vtk.vtkGraphLayoutFilter()
-        lf.SetThreeDimensionalLayout(0)
-        lf.SetAutomaticBoundsComputation(0)
-        minx, miny = canvas.GetViewStart()[0] + 50, canvas.GetViewStart()[1] + 50
-
-        maxx, maxy = canvas.GetClientSize()[0] + minx - 100, canvas.GetClientSize()[1] + miny - 100
-        lf.SetGraphBounds(minx, maxx, miny, maxy, 0.0, 0.0)
-
-        # i've tried a number of things, they all suck.
-        lf.SetCoolDownRate(1000) # default 10
-        lf.SetMaxNumberOfIterations(10) # default 50
-
-        lf.SetInput(polynet)
-        lf.Update()
-
-        new_pts = lf.GetOutput()
-        for ptid, glyph in ptid2glyph.items():
-            new_pos = new_pts.GetPoint(ptid)
-            glyph.setPosition(new_pos[0:2]) 
-
-        ge._route_all_lines()
+        self._route_all_lines()
 
     def _load_and_realise_network(self, filename, position=(0,0),
                                reposition=False):
@@ -2451,6 +2426,11 @@ class GraphEditor:
                 # this indicates that the glyph is being dragged, but that
                 # we don't have to check for a port during this drag
                 glyph.draggedPort = (-1, -1)
+                # at the end of the drag, we reroute the lines that
+                # were affected by the glyphs at their old positions
+                self._drag_start_bounds = \
+                        [g.get_world_bounds() for g in
+                         self._get_dragged_glyphs(glyph)]
 
         # when we get here, glyph.draggedPort CAN't BE None
         if glyph.draggedPort == (-1, -1):
@@ -2696,11 +2676,11 @@ class GraphEditor:
             # draggedObject, but the left mouse button is up.
             # the new VTK canvas event system only switches off draggy
             # things AFTER the left mouse button up event
-            all_lines = \
-                self.canvas.getObjectsOfClass(DeVIDECanvasLine)
-            for line in all_lines:
-                dprint("+-- routing line", line)
-                self._route_line(line)
+            # only the lines of the moved glyphs and the lines near
+            # their old and new positions have to be rerouted
+            self._route_lines(self._get_affected_lines(
+                self._get_dragged_glyphs(glyph), self._drag_start_bounds))
+            self._drag_start_bounds = []
             # the old code also switch off the draggedPort here...
             self.canvas.redraw()
 
@@ -2709,130 +2689,83 @@ class GraphEditor:
         # double clicking on a module opens the View/Config.
         self._view_conf_module(module)
 
-    def _cohenSutherLandClip(self,
-                             x0, y0, x1, y1,
-                             xmin, ymin, xmax, ymax):
-        """Perform Cohen Sutherland line clipping given line defined by
-        endpoints (x0, y0) and (x1, y1) and window (xmin, ymin, xmax, ymax).
-
-        See for e.g.:
-        http://www.cs.fit.edu/~wds/classes/graphics/Clip/clip/clip.html
+    def _route_all_lines(self):
+        """Call _route_line on each and every line on the canvas.
+        Refresh canvas afterwards.
+        """
 
-        @returns: a list of point coordinates where the line is clipped
-        by the window.
+        # THEN reroute all lines
+        self._route_lines(self.canvas.getObjectsOfClass(DeVIDECanvasLine))
+            
+        # redraw all
+        self.canvas.redraw()
 
-        @todo: should be moved out into utility module.
+    def _route_affected_lines(self, glyphs, old_bounds=()):
+        """Call _route_line on the lines affected by changes to glyphs,
+        see L{_get_affected_lines}.  Refresh canvas afterwards.
         """
 
-        def outCode(x, y, xmin, ymin, xmax, ymax):
-            """Determine Cohen-Sutherland bitcode for a point (x,y) with
-            respect to a window (xmin, ymin, xmax, ymax).
+        self._route_lines(self._get_affected_lines(glyphs, old_bounds))
+        self.canvas.redraw()
 
-            point left of window (x < xmin): bit 1
-            point right of window (x > xmax): bit 2
-            point below window (y < ymin): bit 3
-            point above window (y > ymax): bit 4
-            
-            """
+    def _route_lines(self, lines):
+        """Call _route_line on each line in lines.  This does not
+        refresh the canvas.
+        """
 
+        for line in lines:
+            self._route_line(line)
 
-            a,b,c,d = (0,0,0,0)
+    def _get_affected_lines(self, glyphs, old_bounds=()):
+        """Return list of the lines that have to be rerouted after
+        glyphs have been added, moved or resized.
 
-            if y > ymax:
-                a = 1
-            if y < ymin:
-                b = 1
-                
-            if x > xmax:
-                c = 1
-            elif x < xmin:
-                d = 1
+        These are the lines connected to glyphs, the lines that glyphs
+        could now be in the way of, and the lines that were routed
+        around glyphs at their old bounds.
+
+        @param old_bounds: list with the world bounds that glyphs had
+        before they were moved or resized.
+        """
 
-            return (a << 3) | (b << 2) | (c << 1) | d
+        lines = {}
+        for glyph in glyphs:
+            for line in glyph.inputLines:
+                if line is not None:
+                    lines[line] = 1
+
+            for glyph_lines in glyph.outputLines:
+                for line in glyph_lines:
+                    lines[line] = 1
+
+        m = DeVIDECanvasLine.routingOvershoot
+        all_bounds = [glyph.get_world_bounds() for glyph in glyphs] + \
+                     list(old_bounds)
+        for b in all_bounds:
+            for cobj in self.canvas.get_objects_in_bounds(
+                (b[0] - m, b[1] - m, b[2] + m, b[3] + m)):
+                if isinstance(cobj, DeVIDECanvasLine):
+                    lines[cobj] = 1
+
+        return lines.keys()
+
+    def _get_glyph_bounds_in(self, bounds):
+        """Return list with the world bounds of all glyphs intersecting
+        bounds.  This is where the line router finds its obstacles.
+        """
 
-        # determine bitcodes / outcodes for line endpoints
-        oc0 = outCode(x0, y0, xmin, ymin, xmax, ymax)
-        oc1 = outCode(x1, y1, xmin, ymin, xmax, ymax)
+        return [cobj.get_world_bounds() for cobj in
+                self.canvas.get_objects_in_bounds(bounds)
+                if isinstance(cobj, DeVIDECanvasGlyph)]
 
-        clipped = False # true when the whole line has been clipped
-        accepted = False # trivial accept (line is inside)
-        
-        while not clipped:
-            if oc0 == 0 and oc1 == 0:
-                # the line is completely inside
-                clipped = True
-                accepted = True
-                
-            elif oc0 & oc1 != 0:
-                # trivial reject, the line is nowhere near
-                clipped = True
-                
-            else:
-                dx = float(x1 - x0)
-                dy = float(y1 - y0)
-                if dx != 0.0:
-                    m = dy / dx
-                else:
-                    # if dx == 0.0, we won't need m in anycase (m is only
-                    # needed to calc intersection with a vertical edge)
-                    m = 0.0
-                if dy != 0.0:
-                    mi = dx / dy
-                else:
-                    # same logic here
-                    mi = 0.0
-                    
-                # this means there COULD be a clip
-
-                # pick "outside" point
-                oc = [oc1, oc0][bool(oc0)]
-
-                if oc & 8: # y is above (numerically)
-                    x = x0 + mi * (ymax - y0)
-                    y = ymax
-                elif oc & 4: # y is below (numerically)
-                    x = x0 + mi * (ymin - y0)
-                    y = ymin
-                elif oc & 2: # x is right
-                    x = xmax
-                    y = y0 + m * (xmax - x0)
-                else:
-                    x = xmin
-                    y = y0 + m * (xmin - x0)
-
-                if oc == oc0:
-                    # we're clipping off the line start
-                    x0 = x
-                    y0 = y
-                    oc0 = outCode(x0, y0, xmin, ymin, xmax, ymax)
-                else:
-                    # we're clipping off the line end
-                    x1 = x
-                    y1 = y
-                    oc1 = outCode(x1, y1, xmin, ymin, xmax, ymax)
-
-        clipPoints = []
-        if accepted:
-            if x0 == xmin or x0 == xmax or y0 == ymin or y0 == ymax:
-                clipPoints.append((x0, y0))
-            if x1 == xmin or x1 == xmax or y1 == ymin or y1 == ymax:
-                clipPoints.append((x1, y1))
-
-        return clipPoints
-                
-    def _route_all_lines(self):
-        """Call _route_line on each and every line on the canvas.
-        Refresh canvas afterwards.
+    def _get_dragged_glyphs(self, glyph):
+        """Return list of glyphs that move when glyph is dragged.
         """
 
-        # THEN reroute all lines
-        allLines = self.canvas.getObjectsOfClass(DeVIDECanvasLine)
-                    
-        for line in allLines:
-            self._route_line(line)
-            
-        # redraw all
-        self.canvas.redraw()
+        if glyph in self._selected_glyphs.getSelectedGlyphs():
+            return self._selected_glyphs.getSelectedGlyphs()
+        else:
+            return [glyph]
 
     def _route_all_glyph_lines_fast(self, glyph):
         """Fast route all lines going into and originating from glyph.
@@ -2872,142 +2805,26 @@ class GraphEditor:
         
 
     def _route_line(self, line):
-        """Route line around all glyphs on canvas.
+        """Route line around the glyphs on the canvas.
 
-        Line is routed by inserting a number of control points to make
-        it go around all glyphs the canvas.  This is not terribly
-        efficient: it's routing a line around ALL glyphs, instead of
-        making use of some space partitioning scheme.  However, in the
-        worst practical case, this comes down to about 40 glyphs
-        
-        If you have some time on your hands, feel free to improve.
+        The part of the line between the points just outside of its
+        ports is routed by the L{LineRouter}, which only looks at the
+        glyphs near the line.  A line that is not obstructed by any
+        glyph stays straight, other lines are routed orthogonally
+        around the glyphs.
 
         @param line: DeVIDECanvasLine instance representing the line
         that has to be routed.
         """
-        
-        # we have to get a list of all coGlyphs
-        allGlyphs = self.canvas.getObjectsOfClass(DeVIDECanvasGlyph)
 
         # make sure the line is back to 4 points
         line.updateEndPoints()
 
-        # this should be 5 for straight line drawing
-        # at least 10 for spline drawing; also remember to change
-        # the DrawLines -> DrawSplines in coLine as well as
-        # coLine.updateEndPoints() (at the moment they use port height
-        # to get that bit out of the glyph)
-        overshoot = DeVIDECanvasLine.routingOvershoot
-        # sometimes, for instance for spline routing, we need something
-        # extra... for straight line drawing, this should be = overshoot
-        #moreOvershoot = 2 * overshoot
-        moreOvershoot = overshoot
-
-        successfulInsert = True
-        numInserts = 0
-        while successfulInsert and numInserts < 30:
-            
-            (x0, y0), (x1, y1) = line.getThirdLastSecondLast()
-
-            clips = {}
-            for glyph in allGlyphs:
-                (xmin, ymin), (xmax, ymax) = glyph.get_bottom_left_top_right()
-
-                clipPoints = self._cohenSutherLandClip(x0, y0, x1, y1,
-                                                       xmin, ymin, xmax, ymax)
-                if clipPoints:
-                    clips[glyph] = clipPoints
-
-            # now look for the clip point closest to the start of the current
-            # line segment!
-            currentSd = sys.maxint
-            nearestGlyph = None
-            nearestClipPoint = None
-            for clip in clips.items():
-                for clipPoint in clip[1]:
-                    xdif = clipPoint[0] - x0
-                    ydif = clipPoint[1] - y0
-                    sd = xdif * xdif + ydif * ydif
-                    if sd < currentSd:
-                        currentSd = sd
-                        nearestGlyph = clip[0]
-                        nearestClipPoint = clipPoint
-
-            successfulInsert = False
-            # we have the nearest clip point
-            if nearestGlyph:
-                (xmin, ymin), (xmax, ymax) = \
-                       nearestGlyph.get_bottom_left_top_right()
-
-                # does it clip the horizontal bar
-                if nearestClipPoint[1] == ymin or nearestClipPoint[1] == ymax:
-                    midPointX = xmin + (xmax - xmin) / 2.0
-                    if x1 < midPointX:
-                        newX = xmin - moreOvershoot
-                    else:
-                        newX = xmax + moreOvershoot
-                    
-                    newY = nearestClipPoint[1]
-                    if newY == ymin:
-                        newY -= overshoot
-
-                    else:
-                        newY += overshoot
-                        
-                    # if there are clips on the new segment, add an extra
-                    # node to avoid those clips!
-                    for glyph in allGlyphs:
-                        (xmin2, ymin2), (xmax2, ymax2) = \
-                                glyph.get_bottom_left_top_right()
-                        cp2 = self._cohenSutherLandClip(x0,y0,newX,newY,
-                                                        xmin2, ymin2,
-                                                        xmax2, ymax2)
-                        if cp2:
-                            break
-                     
-                    if cp2:
-                        line.insertRoutingPoint(nearestClipPoint[0], newY)
-                        numInserts += 1
-                        
-                    successfulInsert = line.insertRoutingPoint(newX, newY)
-                    numInserts += 1
-                    
-                # or does it clip the vertical bar
-                elif nearestClipPoint[0] == xmin or \
-                         nearestClipPoint[0] == xmax:
-                    midPointY = ymin + (ymax - ymin) / 2.0
-                    if y1 < midPointY:
-                        newY = ymin - moreOvershoot
-                    else:
-                        newY = ymax + moreOvershoot
-
-                    newX = nearestClipPoint[0]
-                    if newX == xmin:
-                        newX -= overshoot
-                    else:
-                        newX += overshoot
-
-                    # if there are clips on the new segment, add an extra
-                    # node to avoid those clips!
-                    for glyph in allGlyphs:
-                        (xmin2, ymin2), (xmax2, ymax2) = \
-                                glyph.get_bottom_left_top_right()
-                        cp2 = self._cohenSutherLandClip(x0,y0,newX,newY,
-                                                        xmin2, ymin2,
-                                                        xmax2, ymax2)
-                        if cp2:
-                            break
-                     
-                    if cp2:
-                        line.insertRoutingPoint(newX, nearestClipPoint[1])
-                        numInserts += 1
-
-                    successfulInsert = line.insertRoutingPoint(newX, newY)
-                    numInserts += 1
-
-                else:
-                    print "HEEEEEEEEEEEEEEEEEEEELP!!  This shouldn't happen."
-                    raise Exception
+        # the line leaves its output port downwards and enters its
+        # input port from above
+        start, end = line.getThirdLastSecondLast()
+        for x, y in self._line_router.route(start, end, (0, -1), (0, -1)):
+            line.insertRoutingPoint(x, y)
 
         line.set_normal()
         line.update_geometry()
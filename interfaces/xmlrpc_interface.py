@@ -1,10 +1,25 @@
 from logging_mixin import LoggingMixin
+from remote_api import JobServer, RemoteAPI
 from SimpleXMLRPCServer import SimpleXMLRPCServer
-import time
+import SocketServer
 
-class ServerProxy:
-    def test_function(self):
-        return "Hello World!"
+# client example:
+# import xmlrpclib
+# s = xmlrpclib.ServerProxy('http://localhost:8000', allow_none=True)
+# s.system.listMethods()
+# see remote_api.py for the complete API
+
+class ThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    """XML-RPC server that handles every request in its own thread, so
+    that clients can poll job status while other clients are waiting for
+    their calls.
+    """
+
+    # don't let waiting clients keep DeVIDE from shutting down
+    daemon_threads = True
+
+class ServerProxy(RemoteAPI):
+    pass
 
 class XMLRPCInterface(LoggingMixin):
 
@@ -12,32 +27,52 @@ class XMLRPCInterface(LoggingMixin):
         self._devide_app = devide_app
 
         # initialise logging mixin
-        LoggingMixin.__init__(self)
+        LoggingMixin.__init__(self, devide_app.main_config.log_file)
 
         print "Initialising XMLRPC..."
+        self.job_server = JobServer(devide_app)
+
         # without real IP number, this is only available via localhost
-        self.server = SimpleXMLRPCServer(('localhost', 8000))
-        self.server.register_instance(ServerProxy())
-        #server.register_function()
-        
+        main_config = devide_app.main_config
+        self.address = (main_config.rpc_host, main_config.rpc_port or 8000)
+        self.server = ThreadedXMLRPCServer(self.address, logRequests=False,
+                                           allow_none=True)
+        self.server.register_introspection_functions()
+        self.server.register_instance(ServerProxy(self.job_server))
+
     def handler_post_app_init(self):
         """DeVIDE-required method for interfaces."""
 
-        pass
+        self.job_server.start()
+
+        # a network given with --load-network is loaded before the first
+        # request, so that the process is warm
+        load_network = self._devide_app.main_config.load_network
+        if load_network:
+            self.job_server.submit('load_network',
+                                   self.job_server.load_network,
+                                   load_network)
 
     def quit(self):
         self.server.server_close()
+        self.job_server.stop()
+
+    def set_progress(self, progress, message, noTime=False):
+        LoggingMixin.set_progress(self, progress, message, noTime)
+        self.job_server.set_progress(progress, message)
 
     def start_main_loop(self):
-        self.log_message('DeVIDE available at %s' % ('localhost:8000',))
+        self.log_message('DeVIDE available at %s:%d' % self.address)
         self.log_message('Starting XMLRPC request loop.')
+        self.log_message('Output handoff directory is %s' %
+                         (self.job_server.get_handoff_dir(),))
         try:
             self.server.serve_forever()
-            
+
         except KeyboardInterrupt:
             self.log_message('Got keyboard interrupt.')
-            
+
         self.log_message('Shutting down.')
         self.quit()
 
-    
+
@@ -6,6 +6,7 @@ import vtk
 from module_kits.misc_kit.mixins import SubjectMixin
 from devide_canvas_object import DeVIDECanvasGlyph
 import operator
+from spatial_index import SpatialGrid
 
 import wx # we're going to use this for event handling
 
@@ -65,8 +66,9 @@ class DeVIDECanvas(SubjectMixin):
         SubjectMixin.__init__(self)
 
         self._cobjects = []
-        # dict for mapping from prop back to cobject
-        self.prop_to_glyph = {}
+        # world space bounds of all glyphs and connections, so that we
+        # can do hit tests without a VTK pick pass.
+        self._spatial_index = SpatialGrid()
         self._previousRealCoords = None
         self._potentiallyDraggedObject = None
         self._draggedObject = None
@@ -318,43 +320,18 @@ class DeVIDECanvas(SubjectMixin):
 
     def _pick_glyph(self, ex, ey):
         """Give current VTK display position.
-        """
-        p = vtk.vtkPicker()
-        p.SetTolerance(0.00001) # this is perhaps still too large
-
-       
-        for i in self._cobjects:
-            if isinstance(i, DeVIDECanvasGlyph):
-                for prop in i.props:
-                    p.AddPickList(prop)
 
-        p.PickFromListOn()
-
-        ret = p.Pick((ex, ey, 0), self._ren)
-        
-        if ret:
-            #pc = p.GetProp3Ds()
-            #pc.InitTraversal()
-            #prop = pc.GetNextItemAsObject()
-            prop = p.GetAssembly() # for now we only want this.
-            try:
-                picked_cobject = self.prop_to_glyph[prop]
-            except KeyError:
-                dprint("_pick_glyph:: couldn't find prop in p2g dict")
-                return None
-            else:
-                # need to find out WHICH sub-actor was picked.
-                if p.GetPath().GetNumberOfItems() == 2:
-                    sub_prop = \
-                        p.GetPath().GetItemAsObject(1).GetViewProp()
-
-                else:
-                    sub_prop = None
+        @return: (glyph, sub_prop) tuple for the topmost glyph at the
+        given position, where sub_prop is the port or body actor, or
+        None if there is no glyph.
+        """
 
-                # our assembly is one level deep, so 1 is the one we
-                # want (actor at leaf node)
+        # we have a parallel projection, so depth doesn't matter
+        wx, wy, wz = self.display_to_world((ex, ey))
 
-                return (picked_cobject, sub_prop)
+        for cobj in self._spatial_index.query_point(wx, wy):
+            if isinstance(cobj, DeVIDECanvasGlyph):
+                return (cobj, cobj.get_sub_prop_at(wx, wy))
 
         return None
 
@@ -554,11 +531,10 @@ class DeVIDECanvas(SubjectMixin):
             self._cobjects.append(cobj)
             for prop in cobj.props:
                 self._ren.AddViewProp(prop)
-                # we only add prop to cobject if it's a glyph
-                if isinstance(cobj, DeVIDECanvasGlyph):
-                    self.prop_to_glyph[prop] = cobj
 
-            cobj.__hasMouse = False
+            bounds = cobj.get_world_bounds()
+            if bounds is not None:
+                self._spatial_index.insert(cobj, bounds)
 
     def redraw(self):
         """Redraw the whole scene.
@@ -600,9 +576,7 @@ class DeVIDECanvas(SubjectMixin):
             for prop in cobj.props:
                 self._ren.RemoveViewProp(prop)
             
-                # it's only in here if it's a glyph
-                if isinstance(cobj, DeVIDECanvasGlyph):
-                    del self.prop_to_glyph[prop]
+            self._spatial_index.remove(cobj)
 
             cobj.canvas = None
             if self._draggedObject == cobj:
@@ -628,11 +602,28 @@ class DeVIDECanvas(SubjectMixin):
         the mouse.
         """
 
-        for cobject in self._cobjects:
-            if cobject.__hasMouse:
-                return cobject
+        # this is kept up to date by the motion handler
+        return self.event.picked_cobject
 
-        return None
+    def get_objects_in_bounds(self, bounds):
+        """Return all glyphs and connections with world space bounds
+        intersecting bounds (xmin, ymin, xmax, ymax), topmost first.
+        """
+
+        return self._spatial_index.query_rect(bounds)
+
+    def update_object_bounds(self, cobj):
+        """Update the bounds of cobj in the spatial index.
+
+        Canvas objects call this themselves from their update_geometry.
+        """
+
+        if cobj in self._spatial_index:
+            bounds = cobj.get_world_bounds()
+            if bounds is None:
+                self._spatial_index.remove(cobj)
+            else:
+                self._spatial_index.insert(cobj, bounds)
 
     def drag_object(self, cobj, delta):
         """Move object with delta in world space.
@@ -641,6 +632,7 @@ class DeVIDECanvas(SubjectMixin):
         cpos = cobj.get_position() # this gives us 2D in world space
         npos = (cpos[0] + delta[0], cpos[1] + delta[1])
         cobj.set_position(npos)
+        # this also updates the bounds of cobj in the spatial index
         cobj.update_geometry()
 
     def pan_canvas_world(self, delta_x, delta_y):
@@ -203,6 +203,18 @@ class DeVIDECanvasObject(SubjectMixin):
     def get_bounds(self):
         raise NotImplementedError
 
+    def get_world_bounds(self):
+        """Return (xmin, ymin, xmax, ymax) bounds of this object in world
+        space, or None if the canvas should not index this object.
+        """
+
+        return None
+
+    def _update_canvas_index(self):
+        # objects call this whenever their bounds could have changed
+        if self.canvas is not None:
+            self.canvas.update_object_bounds(self)
+
     def get_position(self):
         return self._position
 
@@ -387,6 +399,8 @@ class DeVIDECanvasLine(DeVIDECanvasObject):
         self._spline_source.GetParametricFunction().SetPoints(pts)
 
         self._spline_source.Update()
+
+        self._update_canvas_index()
                           
     def get_bounds(self):
         # totally hokey: for now we just return the bounding box surrounding
@@ -395,6 +409,11 @@ class DeVIDECanvasLine(DeVIDECanvasObject):
         return (self._line_points[-1][0] - self._line_points[0][0],
                 self._line_points[-1][1] - self._line_points[0][1])
 
+    def get_world_bounds(self):
+        xs = [p[0] for p in self._line_points]
+        ys = [p[1] for p in self._line_points]
+        return (min(xs), min(ys), max(xs), max(ys))
+
     def getUpperLeftWidthHeight(self):
         """This returns the upperLeft coordinate and the width and height of
         the bounding box enclosing the third-last and second-last points.
@@ -740,6 +759,8 @@ class DeVIDECanvasGlyph(DeVIDECanvasObject):
                     (horizOffset + i * horizStep + 0.5 * self._pWidth, 
                         0, self._port_z))
 
+        self._update_canvas_index()
+
     def get_port_containing_mouse(self):
         """Given the current has_mouse and has_mouse_sub_prop
         information in canvas.event, determine the port side (input,
@@ -774,6 +795,29 @@ class DeVIDECanvasGlyph(DeVIDECanvasObject):
     def get_bounds(self):
         return self._size
 
+    def get_world_bounds(self):
+        # the ports stick out half their height above and below the
+        # glyph body
+        return (self._position[0],
+                self._position[1] - self._pHeight / 2.0,
+                self._position[0] + self._size[0],
+                self._position[1] + self._size[1] + self._pHeight / 2.0)
+
+    def get_sub_prop_at(self, x, y):
+        """Return the actor of the glyph part at world position x,y,
+        i.e. the port actor if x,y is on a port, else the actor of the
+        glyph body.  This is what the canvas reports as picked_sub_prop.
+        """
+
+        for inout, portssa in ((0, self._iportssa), (1, self._oportssa)):
+            for i in range(len(portssa)):
+                cx, cy, cz = self.get_centre_of_port(inout, i)
+                if abs(x - cx) <= self._pWidth / 2.0 and \
+                   abs(y - cy) <= self._pHeight / 2.0:
+                    return portssa[i][1]
+
+        return self._rbsa
+
 
     def get_centre_of_port(self, inOrOut, idx):
         """Given the side of the module and the index of the port,
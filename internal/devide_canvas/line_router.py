@@ -0,0 +1,270 @@
+# Copyright (c) Charl P. Botha, TU Delft
+# All rights reserved.
+# See COPYRIGHT for details.
+
+import heapq
+
+# directions of route segments
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+# tolerance for points that lie on the border of an obstacle
+EPSILON = 1e-6
+
+class LineRouter:
+    """Routes lines around axis-aligned rectangular obstacles.
+
+    Obstacles are looked up with the get_obstacles function, which is
+    typically answered from a spatial index, so that routing a line
+    only considers the obstacles in its neighbourhood.  A line that is
+    not obstructed stays a straight line.  An obstructed line is routed
+    orthogonally over the visibility graph of the obstacles, i.e. along
+    the borders of the obstacles grown by margin and through the end
+    points of the line, with A* finding the route with the smallest
+    length plus bend penalty.
+
+    The search is limited to a window around the end points of the
+    line.  If the best route in the window turns out to be obstructed
+    by obstacles outside of it, the window is grown and the search
+    repeated.
+    """
+
+    def __init__(self, get_obstacles, margin=5.0, bend_penalty=20.0,
+                 search_margin=100.0, max_searches=4):
+        """
+        @param get_obstacles: function that is called with bounds
+        (xmin, ymin, xmax, ymax) and returns a list with the bounds of
+        all obstacles intersecting them.
+        @param margin: minimum distance between routes and obstacles.
+        @param bend_penalty: extra cost of every bend in a route, in
+        world units.
+        @param search_margin: initial margin of the search window
+        around the end points of a line.  It doubles with every
+        repeated search.
+        """
+
+        self._get_obstacles = get_obstacles
+        self._margin = float(margin)
+        self._bend_penalty = float(bend_penalty)
+        self._search_margin = float(search_margin)
+        self._max_searches = max_searches
+
+    def _get_grown_obstacles(self, bounds, points=()):
+        """Return the obstacles intersecting bounds, grown by margin.
+        Obstacles that contain any of points are left out, we could
+        never route around them.
+        """
+
+        m = self._margin
+        query = (bounds[0] - m, bounds[1] - m, bounds[2] + m, bounds[3] + m)
+
+        grown = []
+        for b in self._get_obstacles(query):
+            r = (b[0] - m, b[1] - m, b[2] + m, b[3] + m)
+            for p in points:
+                if _strictly_inside(p, r):
+                    break
+            else:
+                grown.append(r)
+
+        return grown
+
+    def is_obstructed(self, p0, p1, ignore=()):
+        """Return True if the straight segment between points p0 and p1
+        passes through any grown obstacle that does not contain a point
+        in ignore.
+        """
+
+        bounds = (min(p0[0], p1[0]), min(p0[1], p1[1]),
+                  max(p0[0], p1[0]), max(p0[1], p1[1]))
+        for r in self._get_grown_obstacles(bounds, ignore):
+            if _segment_crosses(p0, p1, r):
+                return True
+
+        return False
+
+    def route(self, start, end, start_dir=None, end_dir=None):
+        """Return the list of routing points for a line from start to
+        end, without start and end themselves.
+
+        @param start_dir: direction (dx, dy) in which the line arrives
+        at start, so that changing it counts as a bend.  None if there
+        is no preference.
+        @param end_dir: direction in which the line should leave end,
+        idem.
+        @return: empty list if the straight line is not obstructed, or
+        if no route could be found.
+        """
+
+        ends = (start, end)
+        if not self.is_obstructed(start, end, ends):
+            return []
+
+        search_margin = self._search_margin
+        for i in range(self._max_searches):
+            window = (min(start[0], end[0]) - search_margin,
+                      min(start[1], end[1]) - search_margin,
+                      max(start[0], end[0]) + search_margin,
+                      max(start[1], end[1]) + search_margin)
+
+            path = self._find_path(start, end, start_dir, end_dir,
+                                   self._get_grown_obstacles(window, ends),
+                                   window)
+
+            if path is not None:
+                # the route can pass obstacles outside of the window
+                # only along the border of the window
+                for j in range(len(path) - 1):
+                    if self.is_obstructed(path[j], path[j + 1], ends):
+                        break
+                else:
+                    return path[1:-1]
+
+            search_margin *= 2
+
+        return []
+
+    def _find_path(self, start, end, start_dir, end_dir, obstacles,
+                   window):
+        # the visibility graph is the grid formed by the borders of the
+        # obstacles, the end points and the window.  All borders are
+        # grid lines, so every grid edge is either completely inside or
+        # completely outside of each obstacle.
+        xs = {start[0] : 1, end[0] : 1, window[0] : 1, window[2] : 1}
+        ys = {start[1] : 1, end[1] : 1, window[1] : 1, window[3] : 1}
+        for r in obstacles:
+            xs[r[0]] = xs[r[2]] = 1
+            ys[r[1]] = ys[r[3]] = 1
+
+        xs = xs.keys()
+        xs.sort()
+        ys = ys.keys()
+        ys.sort()
+        xi = dict([(x, i) for i, x in enumerate(xs)])
+        yi = dict([(y, i) for i, y in enumerate(ys)])
+
+        # horizontal edge (i,j) runs from node (i,j) to (i+1,j), vertical
+        # edge (i,j) from node (i,j) to (i,j+1).  Edges along the border
+        # of an obstacle are not blocked by it.
+        h_blocked = {}
+        v_blocked = {}
+        for r in obstacles:
+            i0, i1 = xi[r[0]], xi[r[2]]
+            j0, j1 = yi[r[1]], yi[r[3]]
+            for i in range(i0, i1):
+                for j in range(j0 + 1, j1):
+                    h_blocked[(i, j)] = 1
+
+            for i in range(i0 + 1, i1):
+                for j in range(j0, j1):
+                    v_blocked[(i, j)] = 1
+
+        def edge_is_free(node, d):
+            i, j = node
+            if d[1] == 0:
+                return (min(i, i + d[0]), j) not in h_blocked
+            else:
+                return (i, min(j, j + d[1])) not in v_blocked
+
+        start_node = (xi[start[0]], yi[start[1]])
+        end_node = (xi[end[0]], yi[end[1]])
+
+        def heuristic(node):
+            return abs(xs[node[0]] - end[0]) + abs(ys[node[1]] - end[1])
+
+        # A* over (node, direction of arrival) states
+        start_state = (start_node, start_dir)
+        best = {start_state : 0.0}
+        parents = {start_state : None}
+        heap = [(heuristic(start_node), 0.0, start_state)]
+        while heap:
+            f, g, state = heapq.heappop(heap)
+            if g > best[state]:
+                # we've already been here along a cheaper route
+                continue
+
+            node, arrival_dir = state
+            if node == end_node:
+                break
+
+            for d in DIRECTIONS:
+                ni, nj = node[0] + d[0], node[1] + d[1]
+                if not (0 <= ni < len(xs) and 0 <= nj < len(ys)):
+                    continue
+
+                if arrival_dir is not None and \
+                   d == (-arrival_dir[0], -arrival_dir[1]):
+                    # never double back
+                    continue
+
+                if not edge_is_free(node, d):
+                    continue
+
+                nnode = (ni, nj)
+                ng = g + abs(xs[ni] - xs[node[0]]) + \
+                     abs(ys[nj] - ys[node[1]])
+                if arrival_dir is not None and d != arrival_dir:
+                    ng += self._bend_penalty
+
+                if nnode == end_node and end_dir is not None and \
+                   d != end_dir:
+                    ng += self._bend_penalty
+
+                nstate = (nnode, d)
+                if ng < best.get(nstate, ng + 1.0):
+                    best[nstate] = ng
+                    parents[nstate] = state
+                    heapq.heappush(heap, (ng + heuristic(nnode), ng, nstate))
+
+        else:
+            return None
+
+        # walk back, keeping only the points where the route bends
+        path = [end]
+        prev_dir = None
+        while parents[state] is not None:
+            node, d = state
+            if prev_dir is not None and d != prev_dir:
+                path.append((xs[node[0]], ys[node[1]]))
+
+            prev_dir = d
+            state = parents[state]
+
+        path.append(start)
+        path.reverse()
+        return path
+
+def _strictly_inside(p, r):
+    return r[0] + EPSILON < p[0] < r[2] - EPSILON and \
+           r[1] + EPSILON < p[1] < r[3] - EPSILON
+
+def _segment_crosses(p0, p1, r):
+    """Return True if the segment between points p0 and p1 runs
+    through the interior of rectangle r (xmin, ymin, xmax, ymax).
+
+    This is Liang-Barsky clipping against r, shrunk by EPSILON so that
+    segments along the border of r don't count.
+    """
+
+    t0, t1 = 0.0, 1.0
+    dx = p1[0] - p0[0]
+    dy = p1[1] - p0[1]
+    for p, q in ((-dx, p0[0] - (r[0] + EPSILON)),
+                 (dx, (r[2] - EPSILON) - p0[0]),
+                 (-dy, p0[1] - (r[1] + EPSILON)),
+                 (dy, (r[3] - EPSILON) - p0[1])):
+        if p == 0:
+            if q <= 0:
+                # parallel to and outside of this border
+                return False
+
+        else:
+            t = float(q) / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+
+            if t0 >= t1:
+                return False
+
+    return True
@@ -0,0 +1,116 @@
+# Copyright (c) Charl P. Botha, TU Delft
+# All rights reserved.
+# See COPYRIGHT for details.
+
+class SpatialGrid:
+    """Uniform grid over 2D world space that indexes objects by their
+    axis-aligned bounds (xmin, ymin, xmax, ymax).
+
+    Every object is registered in all grid cells that its bounds
+    overlap, so that point and rectangle queries only have to look at
+    the objects in a few cells.  Objects are stacked in the order in
+    which they were first inserted: later objects are on top.
+    """
+
+    def __init__(self, cell_size=128.0):
+        self._cell_size = float(cell_size)
+        # maps from (i,j) cell index to dict with objects as keys
+        self._cells = {}
+        # maps from object to its bounds
+        self._bounds = {}
+        # maps from object to its stacking order
+        self._order = {}
+        self._next_order = 0
+
+    def __contains__(self, obj):
+        return obj in self._bounds
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def _get_cells(self, bounds):
+        cs = self._cell_size
+        i0, i1 = int(bounds[0] // cs), int(bounds[2] // cs)
+        j0, j1 = int(bounds[1] // cs), int(bounds[3] // cs)
+        return [(i, j) for i in range(i0, i1 + 1)
+                for j in range(j0, j1 + 1)]
+
+    def clear(self):
+        self._cells.clear()
+        self._bounds.clear()
+        self._order.clear()
+
+    def get_bounds(self, obj):
+        return self._bounds.get(obj)
+
+    def insert(self, obj, bounds):
+        """Insert obj with the given bounds, or update its bounds if it
+        has already been inserted.
+        """
+
+        bounds = tuple(bounds)
+        if obj in self._bounds:
+            if self._bounds[obj] == bounds:
+                return
+
+            self._remove_from_cells(obj)
+
+        else:
+            self._order[obj] = self._next_order
+            self._next_order += 1
+
+        self._bounds[obj] = bounds
+        for cell in self._get_cells(bounds):
+            self._cells.setdefault(cell, {})[obj] = 1
+
+    def _remove_from_cells(self, obj):
+        for cell in self._get_cells(self._bounds[obj]):
+            objs = self._cells[cell]
+            del objs[obj]
+            if not objs:
+                del self._cells[cell]
+
+    def remove(self, obj):
+        if obj in self._bounds:
+            self._remove_from_cells(obj)
+            del self._bounds[obj]
+            del self._order[obj]
+
+    def _sort_top_first(self, objs):
+        decorated = [(self._order[o], o) for o in objs]
+        decorated.sort()
+        decorated.reverse()
+        return [o for order, o in decorated]
+
+    def query_point(self, x, y):
+        """Return list of objects with bounds containing x,y, topmost
+        object first.
+        """
+
+        cs = self._cell_size
+        objs = self._cells.get((int(x // cs), int(y // cs)), {})
+        hits = []
+        for obj in objs:
+            b = self._bounds[obj]
+            if b[0] <= x <= b[2] and b[1] <= y <= b[3]:
+                hits.append(obj)
+
+        return self._sort_top_first(hits)
+
+    def query_rect(self, bounds):
+        """Return list of objects with bounds intersecting the rectangle
+        bounds (xmin, ymin, xmax, ymax), topmost object first.
+        """
+
+        found = {}
+        for cell in self._get_cells(bounds):
+            for obj in self._cells.get(cell, {}):
+                if obj in found:
+                    continue
+
+                b = self._bounds[obj]
+                if b[0] <= bounds[2] and bounds[0] <= b[2] and \
+                   b[1] <= bounds[3] and bounds[1] <= b[3]:
+                    found[obj] = 1
+
+        return self._sort_top_first(found.keys())
@@ -0,0 +1,286 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Memory-budgeted release of intermediate module outputs.
+
+See the documentation of L{OutputMemoryBudget} for details.
+"""
+
+import re
+
+# bytes per component for the ITK type strings returned by
+# misc_kit.misc_utils.get_itk_img_type_and_dim
+ITK_TYPE_SIZES = {
+        'char' : 1,
+        'short' : 2,
+        'long' : 8,
+        'float' : 4,
+        'double' : 8
+        }
+
+def get_output_type(od):
+    """Return 'vtk', 'itk' or 'npy' for the output types of which we
+    can determine the size, None otherwise.
+    """
+
+    if od is None:
+        return None
+
+    elif hasattr(od, 'GetActualMemorySize') and hasattr(od, 'ReleaseData'):
+        return 'vtk'
+
+    elif re.search('^<itkImagePython.itkImage', repr(od)):
+        return 'itk'
+
+    elif hasattr(od, 'nbytes') and hasattr(od, '__array_interface__'):
+        return 'npy'
+
+    return None
+
+def get_output_size(od):
+    """Return estimated size in bytes of the data held by module output
+    od, or 0 if this can't be determined.
+    """
+
+    otype = get_output_type(od)
+
+    if otype == 'vtk':
+        # GetActualMemorySize() is in kilobytes
+        return od.GetActualMemorySize() * 1024
+
+    elif otype == 'itk':
+        from module_kits.misc_kit.misc_utils import get_itk_img_type_and_dim
+        tstr, dim, qualifier = get_itk_img_type_and_dim(od)
+        bytes_per_component = ITK_TYPE_SIZES.get(tstr.split()[-1], 4)
+        if qualifier in ('vector', 'covariant vector'):
+            num_components = int(dim)
+        elif qualifier == 'complex':
+            num_components = 2
+        else:
+            num_components = 1
+
+        num_pixels = od.GetBufferedRegion().GetNumberOfPixels()
+        return num_pixels * num_components * bytes_per_component
+
+    elif otype == 'npy':
+        return od.nbytes
+
+    return 0
+
+def estimate_full_output_size(od):
+    """Return estimated size in bytes of module output od when it is
+    computed in one piece, i.e. not streamed, or 0 if this can't be
+    determined.
+
+    For VTK image data, this is determined from the pipeline information
+    of the whole extent, so it does not require execution.  For all
+    other outputs, the size of the data that is currently held is used,
+    see L{get_output_size}.
+    """
+
+    if hasattr(od, 'IsA') and od.IsA('vtkImageData'):
+        od.UpdateInformation()
+        x0, x1, y0, y1, z0, z1 = od.GetWholeExtent()
+        num_voxels = max(0, x1 - x0 + 1) * max(0, y1 - y0 + 1) * \
+                     max(0, z1 - z0 + 1)
+        return num_voxels * od.GetNumberOfScalarComponents() * \
+               od.GetScalarSize()
+
+    return get_output_size(od)
+
+#########################################################################
+class OutputMemoryBudget:
+    """Keeps the total size of module outputs held in memory under a
+    given budget by releasing intermediate outputs.
+
+    After every module execution, the scheduler calls L{track_outputs}.
+    This records the sizes of the module's outputs and, if the total
+    size of all tracked outputs exceeds the budget, releases the largest
+    outputs of which all consumers have already executed and are up to
+    date.  Releasing an output calls ReleaseData() on the producer's
+    output as well as on all copies that have been transferred to the
+    consumers, so that the memory is really freed.  Only VTK and ITK
+    outputs can be released, numpy arrays are only tracked.
+
+    Outputs connected to consumers without outputs of their own (sinks
+    such as viewers and writers) are never released, as sinks may keep
+    using their inputs after execution.
+
+    Before a module is executed, the scheduler calls
+    L{ensure_inputs_available}.  If any of the module's inputs has been
+    released, its producer is transparently re-executed (recursively
+    recomputing its own released inputs) and the output is transferred
+    again.
+
+    @author: Charl P. Botha <http://cpbotha.net/>
+    """
+
+    def __init__(self, module_manager, budget):
+        """
+        @param budget: maximum total size of outputs in bytes.
+        """
+
+        self._module_manager = module_manager
+        self.budget = budget
+
+        # (meta_module, output_idx) -> size in bytes
+        self._output_sizes = {}
+
+    def close(self):
+        self._output_sizes.clear()
+        del self._module_manager
+
+    def get_total_size(self):
+        return sum(self._output_sizes.values())
+
+    def forget_module(self, meta_module):
+        """Stop tracking all outputs of meta_module, e.g. when it is
+        deleted.
+        """
+
+        for k in self._output_sizes.keys():
+            if k[0] is meta_module:
+                del self._output_sizes[k]
+
+    def track_outputs(self, meta_module, part=0):
+        """Record the sizes of all outputs of the given part that has just
+        been executed, then release intermediate outputs until we are
+        back under budget or nothing more can be released.
+        """
+
+        self._record_sizes(meta_module, part)
+
+        total = self.get_total_size()
+        if total <= self.budget:
+            return
+
+        candidates = [(size, k) for k, size in self._output_sizes.items()
+                      if size > 0 and self._can_release(k[0], k[1])]
+        candidates.sort()
+
+        while candidates and total > self.budget:
+            size, (p_meta_module, output_idx) = candidates.pop()
+            self.release_output(p_meta_module, output_idx)
+            total -= size
+
+    def _record_sizes(self, meta_module, part):
+        for output_idx in range(len(meta_module.outputs)):
+            if meta_module.getPartForOutput(output_idx) == part:
+                try:
+                    od = meta_module.get_output(output_idx)
+                    size = get_output_size(od)
+                except Exception:
+                    size = 0
+
+                self._output_sizes[(meta_module, output_idx)] = size
+                meta_module.released_outputs.pop(output_idx, None)
+
+    def _can_release(self, meta_module, output_idx):
+        mm = self._module_manager
+
+        od = meta_module.get_output(output_idx)
+        if get_output_type(od) not in ('vtk', 'itk'):
+            return False
+
+        consumers = meta_module.outputs[output_idx]
+        if not consumers:
+            # final outputs are kept
+            return False
+
+        for consumer_instance, consumer_input_idx in consumers:
+            c_meta_module = mm.get_meta_module(consumer_instance)
+            if not c_meta_module.outputs:
+                # sinks keep using their inputs
+                return False
+
+            c_part = c_meta_module.getPartForInput(consumer_input_idx)
+            if c_meta_module.shouldExecute(c_part) or \
+               meta_module.should_transfer_output(
+                   output_idx, c_meta_module, consumer_input_idx):
+                # consumer has yet to use the data
+                return False
+
+        return True
+
+    def release_output(self, meta_module, output_idx):
+        """Release the data on the given output of meta_module as well as
+        all copies that have been transferred to its consumers.
+        """
+
+        if output_idx in meta_module.cached_outputs:
+            # this is the output cache's own copy, so we only let go of
+            # it.  Recomputation will restore it from the cache.
+            od = meta_module.cached_outputs.pop(output_idx)
+        else:
+            od = meta_module.get_output(output_idx)
+            od.ReleaseData()
+
+        for consumer_instance, consumer_input_idx in \
+                meta_module.outputs[output_idx]:
+            conn = (output_idx, consumer_instance, consumer_input_idx)
+            tod = meta_module.transferred_outputs.get(conn)
+            if tod is not None and tod is not od:
+                tod.ReleaseData()
+
+            meta_module.released_transfers[conn] = 1
+
+        meta_module.released_outputs[output_idx] = 1
+        self._output_sizes.pop((meta_module, output_idx), None)
+
+        print "released output %d of %s" % \
+              (output_idx, meta_module.instance.__class__.__name__)
+
+    def ensure_inputs_available(self, meta_module, part=0):
+        """Make sure that none of the inputs of the given part have been
+        released, recomputing and re-transferring them where necessary.
+        """
+
+        mm = self._module_manager
+
+        for p_meta_module, output_idx, input_idx in \
+                mm.get_producers(meta_module):
+            if meta_module.getPartForInput(input_idx) != part:
+                continue
+
+            conn = (output_idx, meta_module.instance, input_idx)
+            if conn not in p_meta_module.released_transfers:
+                continue
+
+            if output_idx in p_meta_module.released_outputs:
+                self._recompute(p_meta_module, output_idx)
+
+            # this will also remove conn from released_transfers
+            mm.transfer_output(p_meta_module, output_idx,
+                               meta_module, input_idx)
+
+    def _recompute(self, meta_module, output_idx):
+        """Re-execute the part of meta_module that produces output_idx.
+
+        The other consumers of the recomputed outputs already have
+        (released copies of) the same data, so their transfer times are
+        stamped to prevent them from being re-executed.  Should they
+        ever need that data again, ensure_inputs_available() will
+        transfer it.
+        """
+
+        mm = self._module_manager
+        part = meta_module.getPartForOutput(output_idx)
+
+        print "recomputing output %d of %s" % \
+              (output_idx, meta_module.instance.__class__.__name__)
+
+        self.ensure_inputs_available(meta_module, part)
+        mm.execute_module(meta_module, part)
+
+        for oidx in range(len(meta_module.outputs)):
+            if meta_module.getPartForOutput(oidx) == part:
+                for consumer_instance, consumer_input_idx in \
+                        meta_module.outputs[oidx]:
+                    meta_module.timeStampTransferTime(
+                        oidx, consumer_instance, consumer_input_idx)
+
+        # we don't release anything here, the output we've just
+        # recomputed is about to be transferred.
+        self._record_sizes(meta_module, part)
+
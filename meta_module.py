@@ -66,6 +66,11 @@ class MetaModule:
         # we compare touch time to output transfer time
         self.streaming_touch_times = self.numParts * [0]
 
+        # number of pieces in which the hybrid scheduler has decided
+        # this module should stream when it's streaming_executed, 0 if
+        # it hasn't decided.  See ModuleManager.get_streaming_pieces()
+        self.streaming_pieces = 0
+
         # time when module was last invalidated (through parameter changes)
         # default is current time.  Along with 0.0 executeTime, this will
         # guarantee initial execution.
@@ -96,7 +101,36 @@ class MetaModule:
         # this will create self.inputs, self.outputs
         self.reset_inputsOutputs()
 
+        # outputs restored from the output cache, keyed on output index.
+        # These take precedence over the outputs of the instance until
+        # the part producing them is executed again.
+        self.cached_outputs = {}
+
+        # output index -> fingerprint of the data currently on that
+        # output, as determined by the output cache.  Outputs without a
+        # known fingerprint are not in this dict.
+        self.output_fingerprints = {}
+
+        # data objects that have been transferred to each consumer
+        # connection, keyed on (output_idx, consumer_instance,
+        # consumer_input_idx).  The memory budget uses these to release
+        # the consumers' copies of an output.
+        self.transferred_outputs = {}
+
+        # output indices and consumer connections of which the data has
+        # been released by the memory budget, with 1 as value
+        self.released_outputs = {}
+        self.released_transfers = {}
+
+        # callable(meta_module, part) that is invoked every time a part
+        # is modified.  The ModuleManager uses this to maintain its set
+        # of dirty module parts.
+        self.modified_callback = None
+
     def close(self):
+        self.modified_callback = None
+        self.cached_outputs.clear()
+        self.transferred_outputs.clear()
         del self.instance
         del self.inputs
         del self.outputs
@@ -205,6 +239,22 @@ class MetaModule:
         else:
             return -1
 
+    def get_output(self, output_idx):
+        """Return data on the given output of the encapsulated module.
+
+        If the output has been restored from the output cache, the cached
+        data is returned instead of calling the instance's get_output().
+        """
+
+        if output_idx in self.cached_outputs:
+            return self.cached_outputs[output_idx]
+
+        return self.instance.get_output(output_idx)
+
+    def _get_outputs_for_part(self, part):
+        return [i for i in range(len(self.outputs))
+                if self.getPartForOutput(i) == part]
+
     def getPartForInput(self, input_idx):
         """Return module part that takes input input_idx.
         """
@@ -307,6 +357,10 @@ class MetaModule:
             del self.streaming_transfer_times[
                 (output_idx, consumerInstance, consumerInputIdx)]
 
+            conn = (output_idx, consumerInstance, consumerInputIdx)
+            self.transferred_outputs.pop(conn, None)
+            self.released_transfers.pop(conn, None)
+
         else:
             # consumer not found, the connection didn't exist
             raise Exception, \
@@ -341,6 +395,12 @@ class MetaModule:
         """
 
         if self.instance:
+            # after this execution, the instance's own outputs are
+            # current again and of unknown fingerprint
+            for output_idx in self._get_outputs_for_part(part):
+                self.cached_outputs.pop(output_idx, None)
+                self.output_fingerprints.pop(output_idx, None)
+
             # this is the actual user function.
             # if something goes wrong, an exception will be thrown and
             # correctly handled by the invoking module manager
@@ -365,6 +425,45 @@ class MetaModule:
                 print "exec stamped:", self.execute_times[part]
 
 
+    def streaming_connect_module(self, part=0):
+        """Used by ModuleManager to let a streamable module that is not
+        going to be executed connect its pipeline, see the documentation
+        of hybrid scheduling in the Scheduler class.
+
+        Modules without a streaming_connect_module() are left alone.
+        """
+
+        if self.instance and \
+           hasattr(self.instance, 'streaming_connect_module'):
+            # the instance's own outputs are live pipeline outputs again
+            for output_idx in self._get_outputs_for_part(part):
+                self.cached_outputs.pop(output_idx, None)
+                self.output_fingerprints.pop(output_idx, None)
+
+            if part == 0:
+                self.instance.streaming_connect_module()
+            else:
+                self.instance.streaming_connect_module(part)
+
+    def restore_outputs(self, part, outputs, fingerprints):
+        """Used by the output cache to restore outputs of the given part
+        instead of executing it.
+
+        The execution time is stamped just as if the part had been
+        executed, so that the scheduler transfers the restored outputs
+        to all consumers.
+
+        @param outputs: dict mapping from output index to data.
+        @param fingerprints: dict mapping from output index to output
+        fingerprint.
+        """
+
+        self.cached_outputs.update(outputs)
+        self.output_fingerprints.update(fingerprints)
+
+        self.execute_times[part] = counter.counter()
+        print "cache restore stamped:", self.execute_times[part]
+
     def modify(self, part=0):
         """Used by the ModuleManager to timestamp the modified time.
 
@@ -378,6 +477,9 @@ class MetaModule:
 
         self.modifiedTimes[part] = counter.counter()
 
+        if self.modified_callback is not None:
+            self.modified_callback(self, part)
+
     def shouldExecute(self, part=0):
         """Determine whether the encapsulated module needs to be executed.
         """
@@ -0,0 +1,212 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Indexed representation of the module network topology, used by the
+scheduler for cycle detection and topological sorting.
+"""
+
+import collections
+
+class ModuleGraph:
+    """Index of the dependencies between module parts.
+
+    Every vertex is a (meta_module, part) tuple.  An edge from vertex
+    P to vertex C exists if an output of part P is connected to an
+    input of part C.  Because more than one connection can exist
+    between the same two parts, edges are reference counted.
+
+    The ModuleManager keeps this index up to date incrementally in
+    create_module, delete_module, connect_modules and
+    disconnect_modules, so that the scheduler does not have to
+    reconstruct the topology every time the network is executed.
+
+    All query methods can be restricted to a subset of vertices; edges
+    leading out of this subset are then ignored.
+
+    @author: Charl P. Botha <http://cpbotha.net/>
+    """
+
+    def __init__(self):
+        # maps from vertex to dict mapping from consumer vertex to
+        # number of connections
+        self._consumers = {}
+        # maps from vertex to dict mapping from producer vertex to
+        # number of connections
+        self._producers = {}
+
+    def add_module(self, meta_module):
+        """Add vertices for all parts of meta_module.
+        """
+
+        for part in range(meta_module.numParts):
+            v = (meta_module, part)
+            self._consumers.setdefault(v, {})
+            self._producers.setdefault(v, {})
+
+    def remove_module(self, meta_module):
+        """Remove all vertices of meta_module and all edges that touch
+        them.
+        """
+
+        for part in range(meta_module.numParts):
+            v = (meta_module, part)
+            for c in self._consumers.pop(v, {}):
+                if c in self._producers:
+                    self._producers[c].pop(v, None)
+
+            for p in self._producers.pop(v, {}):
+                if p in self._consumers:
+                    self._consumers[p].pop(v, None)
+
+    def add_connection(self, producer_meta_module, output_idx,
+                       consumer_meta_module, input_idx):
+        """Record connection from output_idx of producer_meta_module to
+        input_idx of consumer_meta_module.
+        """
+
+        p = (producer_meta_module,
+             producer_meta_module.getPartForOutput(output_idx))
+        c = (consumer_meta_module,
+             consumer_meta_module.getPartForInput(input_idx))
+
+        pc = self._consumers.setdefault(p, {})
+        pc[c] = pc.get(c, 0) + 1
+        cp = self._producers.setdefault(c, {})
+        cp[p] = cp.get(p, 0) + 1
+
+    def remove_connection(self, producer_meta_module, output_idx,
+                          consumer_meta_module, input_idx):
+        """Remove a connection previously recorded with
+        L{add_connection}.
+        """
+
+        p = (producer_meta_module,
+             producer_meta_module.getPartForOutput(output_idx))
+        c = (consumer_meta_module,
+             consumer_meta_module.getPartForInput(input_idx))
+
+        for edges, key in ((self._consumers.get(p), c),
+                           (self._producers.get(c), p)):
+            if edges is not None and key in edges:
+                edges[key] -= 1
+                if edges[key] <= 0:
+                    del edges[key]
+
+    def get_consumers(self, vertex):
+        """Return list of vertices that are directly dependent on vertex.
+        """
+        return self._consumers.get(vertex, {}).keys()
+
+    def get_producers(self, vertex):
+        """Return list of vertices that vertex is directly dependent on.
+        """
+        return self._producers.get(vertex, {}).keys()
+
+    def get_downstream_closure(self, vertices):
+        """Return all vertices that can be reached from vertices,
+        including vertices themselves.
+
+        @param vertices: sequence of (meta_module, part) tuples.
+        @return: dictionary with the reachable vertices as keys.
+        """
+
+        closure = dict.fromkeys(vertices, 1)
+        todo = list(closure.keys())
+        while todo:
+            v = todo.pop()
+            for c in self.get_consumers(v):
+                if c not in closure:
+                    closure[c] = 1
+                    todo.append(c)
+
+        return closure
+
+    def find_cycle(self, vertices):
+        """Find a cycle in the subgraph induced by vertices.
+
+        This is an iterative depth-first search with the usual white /
+        grey / black colouring: encountering a grey vertex means that
+        we have found a back edge, i.e. a cycle.  Every vertex and edge
+        is visited only once, so this is linear in the size of the
+        subgraph.
+
+        @param vertices: sequence of (meta_module, part) tuples.
+        @return: list of vertices making up the first cycle that was
+        found, or None if the subgraph is acyclic.
+        """
+
+        WHITE, GREY, BLACK = 0, 1, 2
+        colour = dict.fromkeys(vertices, WHITE)
+
+        for start in vertices:
+            if colour[start] != WHITE:
+                continue
+
+            colour[start] = GREY
+            # stack of (vertex, iterator over its consumers); the
+            # vertices on the stack form the current grey path
+            stack = [(start, iter(self.get_consumers(start)))]
+
+            while stack:
+                v, consumers = stack[-1]
+                for c in consumers:
+                    cc = colour.get(c)
+                    if cc == WHITE:
+                        colour[c] = GREY
+                        stack.append((c, iter(self.get_consumers(c))))
+                        break
+
+                    elif cc == GREY:
+                        # back edge: the cycle is the grey path from c
+                        path = [s[0] for s in stack]
+                        return path[path.index(c):]
+
+                    # BLACK or not in subgraph: nothing to do
+
+                else:
+                    # all consumers of v have been handled
+                    colour[v] = BLACK
+                    stack.pop()
+
+        return None
+
+    def has_cycles(self, vertices):
+        """Return True if the subgraph induced by vertices contains
+        cycles.
+        """
+        return self.find_cycle(vertices) is not None
+
+    def topological_sort(self, vertices):
+        """Sort vertices topologically with Kahn's algorithm.
+
+        Vertices are emitted in the order in which they become ready,
+        starting with the sources in the order in which they occur in
+        vertices, so that the resulting order is deterministic.
+
+        @param vertices: sequence of (meta_module, part) tuples.
+        @return: list of vertices in topological order.  If the subgraph
+        contains cycles, the vertices taking part in or depending on
+        these cycles are missing from the list.
+        """
+
+        vertex_set = dict.fromkeys(vertices)
+        in_degree = {}
+        for v in vertices:
+            in_degree[v] = len([p for p in self.get_producers(v)
+                                if p in vertex_set])
+
+        ready = collections.deque([v for v in vertices if in_degree[v] == 0])
+        sorted_vertices = []
+
+        while ready:
+            v = ready.popleft()
+            sorted_vertices.append(v)
+            for c in self.get_consumers(v):
+                if c in vertex_set:
+                    in_degree[c] -= 1
+                    if in_degree[c] == 0:
+                        ready.append(c)
+
+        return sorted_vertices
+
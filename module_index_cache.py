@@ -0,0 +1,279 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Persistent cache of module_index scan results.
+
+See the documentation of L{ModuleIndexCache} for details.
+"""
+
+import hashlib
+import os
+import tempfile
+import types
+
+try:
+    from ast import literal_eval
+except ImportError:
+    literal_eval = None
+
+# bump this when the format of the cache changes
+CACHE_FORMAT = 'devide-module-index-cache-2'
+
+# only class attributes of these types are cached
+CACHEABLE_TYPES = (types.StringType, types.UnicodeType, types.ListType,
+                   types.TupleType, types.DictType, types.IntType,
+                   types.FloatType, types.BooleanType, types.NoneType)
+
+def _is_literal(v):
+    """Return True if v consists only of CACHEABLE_TYPES, so that its
+    repr() can be read back with literal_eval.
+    """
+
+    if isinstance(v, (types.ListType, types.TupleType)):
+        for i in v:
+            if not _is_literal(i):
+                return False
+
+        return True
+
+    elif isinstance(v, types.DictType):
+        for k, i in v.items():
+            if not (_is_literal(k) and _is_literal(i)):
+                return False
+
+        return True
+
+    elif isinstance(v, types.FloatType):
+        # inf and nan have no literal
+        return v == v and v not in (float('inf'), float('-inf'))
+
+    return isinstance(v, CACHEABLE_TYPES)
+
+#########################################################################
+class ModuleIndexCache:
+    """Cache of the directory structure of the module paths and of the
+    module description classes in all module_index.py files.
+
+    The ModuleManager uses this in scan_modules in two ways:
+     - L{find_module_indices} walks a module path, but only lists the
+       contents of directories whose modification time has changed since
+       the previous scan.  For all other directories, the cached list of
+       subdirectories is used.
+     - L{get_classes} returns the module description classes of a
+       module_index.py from the cache if that file has not changed.  A
+       file is unchanged if its modification time and size are the same,
+       or, if they are not, if its contents have the same hash.  Only
+       changed files have to be imported.
+
+    The cache is kept in memory, so that rescans in a running DeVIDE only
+    process changes, and is written to cache_filename by L{save}, so
+    that it survives the process.  The cached classes are reconstructed
+    with only those class attributes of simple types (strings, lists,
+    numbers and the like), which is everything module_index.py classes
+    are supposed to contain.
+
+    The cache file is the repr() of these simple types, which is read
+    back with ast.literal_eval, so a tampered cache file can at worst
+    give wrong module descriptions, never run code.
+
+    @author: Charl P. Botha <http://cpbotha.net/>
+    """
+
+    def __init__(self, cache_filename=None):
+        """
+        @param cache_filename: file to which the cache is written, or
+        None if it should only be kept in memory.
+        """
+
+        self.cache_filename = cache_filename
+
+        # maps from directory to (mtime, list of subdirectory names,
+        # True if it contains module_index.py)
+        self._dirs = {}
+        # maps from module_index.py filename to (mtime, size, md5,
+        # list of (class_name, attribute dict))
+        self._indices = {}
+        self._modified = False
+
+        self.hits = 0
+        self.misses = 0
+
+        if cache_filename:
+            self.load()
+
+    def load(self):
+        """Read cache from cache_filename.  A missing, outdated or corrupt
+        cache file is silently ignored, as is the cache on Pythons without
+        ast.literal_eval.
+        """
+
+        if literal_eval is None:
+            return
+
+        try:
+            f = open(self.cache_filename, 'rb')
+        except IOError:
+            return
+
+        try:
+            try:
+                cache_format, dirs, indices = literal_eval(f.read())
+            except Exception:
+                return
+        finally:
+            f.close()
+
+        if cache_format == CACHE_FORMAT and isinstance(dirs, dict) and \
+           isinstance(indices, dict):
+            self._dirs = dirs
+            self._indices = indices
+
+    def save(self):
+        """Write cache to cache_filename if it has changed.
+
+        The cache is first written to a temporary file which is then
+        renamed, so that concurrent DeVIDE processes never read partial
+        cache files.
+
+        @raise IOError, OSError: if the cache can't be written.
+        """
+
+        if not self.cache_filename or not self._modified:
+            return
+
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_filename))
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+
+        fd, temp_filename = tempfile.mkstemp(dir=cache_dir)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(repr((CACHE_FORMAT, self._dirs, self._indices)))
+        finally:
+            f.close()
+
+        try:
+            os.rename(temp_filename, self.cache_filename)
+        except OSError:
+            # on Windows, rename does not replace existing files
+            os.remove(self.cache_filename)
+            os.rename(temp_filename, self.cache_filename)
+
+        self._modified = False
+
+    def find_module_indices(self, top_dir):
+        """Return list of all directories below and including top_dir
+        that contain a module_index.py.
+        """
+
+        found_dirs = []
+        todo = [top_dir]
+        while todo:
+            dirname = todo.pop()
+
+            try:
+                mtime = os.stat(dirname).st_mtime
+            except OSError:
+                self._dirs.pop(dirname, None)
+                continue
+
+            cached = self._dirs.get(dirname)
+            if cached is not None and cached[0] == mtime:
+                subdirs, has_index = cached[1], cached[2]
+
+            else:
+                try:
+                    fnames = os.listdir(dirname)
+                except OSError:
+                    continue
+
+                subdirs = [fname for fname in fnames
+                           if os.path.isdir(os.path.join(dirname, fname))]
+                has_index = 'module_index.py' in fnames
+                self._dirs[dirname] = (mtime, subdirs, has_index)
+                self._modified = True
+
+            if has_index:
+                found_dirs.append(dirname)
+
+            # same order as os.path.walk
+            subdirs = list(subdirs)
+            subdirs.reverse()
+            todo.extend([os.path.join(dirname, s) for s in subdirs])
+
+        return found_dirs
+
+    def get_classes(self, mi_filename, mim):
+        """Return module description classes of module_index file
+        mi_filename, which can be imported as mim, if it has not changed
+        since it was cached.
+
+        @return: list of classes, or None if the file has to be imported.
+        """
+
+        try:
+            st = os.stat(mi_filename)
+        except OSError:
+            return None
+
+        cached = self._indices.get(mi_filename)
+        if cached is None:
+            self.misses += 1
+            return None
+
+        mtime, size, md5, class_list = cached
+        if (mtime, size) != (st.st_mtime, st.st_size):
+            # touched, e.g. by a fresh checkout: check the contents
+            if size != st.st_size or md5 != self._get_md5(mi_filename):
+                self.misses += 1
+                return None
+
+            self._indices[mi_filename] = \
+                    (st.st_mtime, st.st_size, md5, class_list)
+            self._modified = True
+
+        self.hits += 1
+
+        classes = []
+        for class_name, attrs in class_list:
+            attrs = attrs.copy()
+            attrs['__module__'] = mim
+            classes.append(types.ClassType(class_name, (), attrs))
+
+        return classes
+
+    def store_classes(self, mi_filename, classes):
+        """Cache the module description classes of the module_index file
+        mi_filename that has just been imported.
+        """
+
+        try:
+            st = os.stat(mi_filename)
+            md5 = self._get_md5(mi_filename)
+        except (OSError, IOError):
+            return
+
+        class_list = []
+        for c in classes:
+            attrs = {}
+            for a in dir(c):
+                if a.startswith('__') and a != '__doc__':
+                    continue
+
+                v = getattr(c, a)
+                if _is_literal(v):
+                    attrs[a] = v
+
+            class_list.append((c.__name__, attrs))
+
+        self._indices[mi_filename] = (st.st_mtime, st.st_size, md5,
+                                      class_list)
+        self._modified = True
+
+    def _get_md5(self, filename):
+        f = open(filename, 'rb')
+        try:
+            return hashlib.md5(f.read()).hexdigest()
+        finally:
+            f.close()
@@ -11,14 +11,30 @@ import time
 
 """Top-level __init__ of the module_kits.
 
-All .mkd files in the module_kits directory are parsed and their
-corresponding module_kits are loaded.  MKD specify the priority (order
-of loading), the dependencies and whether they are crucial kits or
-not.  Error on loading a crucial kit terminates the application, error
-on loading a non-crucial kit simply notifies the user.
+All .mkd files in the module_kits directory are parsed.  MKD specify
+the priority (order of loading), the dependencies and whether they are
+crucial kits or not.  Error on loading a crucial kit terminates the
+application, error on loading a non-crucial kit simply notifies the
+user.
+
+Crucial kits and kits listed in the preload_kits configuration option
+are loaded at startup.  All other kits are loaded on first use, i.e.
+when a module that requires them is created, via L{load_kit}.  If the
+lazy_kits configuration option is off, all kits are loaded at startup.
 """
 
+# names of kits that have been loaded successfully
 module_kit_list = []
+# names of kits that can be loaded: they are not in nokits and neither
+# are any of their dependencies
+available_kit_list = []
+# maps from kit name to seconds it took to load that kit
+module_kit_load_times = {}
+
+# maps from kit name to MKDef of all available kits
+_mkd_dict = {}
+# names of kits that failed to load, so we don't try again
+_failed_kits = {}
 
 class MKDef:
     def __init__(self):
@@ -71,6 +87,10 @@ def get_sorted_mkds(module_kits_dir):
 
 
 def load(module_manager):
+    """Determine which module_kits are available and load those that are
+    required at startup.
+    """
+
     tot_start_time = time.time()
 
     module_kits_dir = os.path.join(
@@ -79,70 +99,101 @@ def load(module_manager):
     mkds = get_sorted_mkds(module_kits_dir) 
     
     # then remove the nokits
-    nokits = module_manager.get_app_main_config().nokits
+    main_config = module_manager.get_app_main_config()
+    nokits = main_config.nokits
     mkds = [mkd for mkd in mkds
             if mkd.name not in nokits]
 
-    loaded_kit_names = []
+    # a kit is only available if all its dependencies are.  mkds are
+    # sorted according to priority, and dependencies have higher
+    # priority than the kits that depend on them.
+    global available_kit_list
+    available_kit_list = []
+    _mkd_dict.clear()
+    _failed_kits.clear()
+    module_kit_load_times.clear()
 
-    # load the remaining kits
     for mkd in mkds:
-        # first check that all dependencies are satisfied
         deps_satisfied = True
         for d in mkd.dependencies:
-            if d not in loaded_kit_names:
+            if d not in available_kit_list:
                 deps_satisfied = False
-                # break out of the for loop
                 break
-                
-        if not deps_satisfied:
-            # skip this iteration of the for, go to the next iteration
-            # (we don't want to try loading this module)
-            continue
-
-        start_time = time.time()
-        try:
-            # import module_kit into module_kits namespace
-            exec('import module_kits.%s' % (mkd.name,))
-            # call module_kit.init()
-            getattr(module_kits, mkd.name).init(module_manager)
-            # add it to the loaded_kits for dependency checking
-            loaded_kit_names.append(mkd.name)
-
-        except Exception, e:
-            # if it's a crucial module_kit, we re-raise with our own
-            # message added using th three argument raise form
-            # see: http://docs.python.org/ref/raise.html
-            if mkd.crucial:
-                es = 'Error loading required module_kit %s: %s.' \
-                     % (mkd.name, str(e))
-                raise Exception, es, sys.exc_info()[2]
-            
-            
-            # if not we can report the error and continue
-            else:
-                module_manager.log_error_with_exception(
-                    'Unable to load non-critical module_kit %s: '
-                    '%s.  Continuing with startup.' %
-                    (mkd.name, str(e)))
-
-        end_time = time.time()
-        module_manager.log_info('Loaded %s in %.2f seconds.' %
-                (mkd.name, end_time - start_time))
-
-    # if we got this far, startup was successful, but not all kits
-    # were loaded: some not due to failure, and some not due to
-    # unsatisfied dependencies.  set the current list to the list of
-    # module_kits that did actually load.
+
+        if deps_satisfied:
+            available_kit_list.append(mkd.name)
+            _mkd_dict[mkd.name] = mkd
+
+    # the current list of module_kits that did actually load
     global module_kit_list
-    module_kit_list = loaded_kit_names
+    module_kit_list = []
+
+    # load crucial and preloaded kits, or everything if we're not lazy
+    for kit_name in available_kit_list:
+        if not main_config.lazy_kits or _mkd_dict[kit_name].crucial or \
+           kit_name in main_config.preload_kits:
+            load_kit(module_manager, kit_name)
 
     tot_end_time = time.time()
     module_manager.log_info(
-            'Loaded ALL module_kits in %.2f seconds.' %
-            (tot_end_time - tot_start_time))
-       
-   
+            'Loaded %d of %d available module_kits in %.2f seconds.' %
+            (len(module_kit_list), len(available_kit_list),
+             tot_end_time - tot_start_time))
+
+def load_kit(module_manager, kit_name):
+    """Load the given module_kit and all its dependencies, if they have
+    not been loaded yet.
+
+    @return: True if the kit is loaded, False if it is not available or
+    could not be loaded.
+    @raise Exception: if a crucial kit could not be loaded.
+    """
+
+    if kit_name in module_kit_list:
+        return True
+
+    if kit_name not in _mkd_dict or kit_name in _failed_kits:
+        return False
+
+    mkd = _mkd_dict[kit_name]
+
+    for d in mkd.dependencies:
+        if not load_kit(module_manager, d):
+            _failed_kits[kit_name] = 1
+            return False
+
+    start_time = time.time()
+    try:
+        # import module_kit into module_kits namespace
+        exec('import module_kits.%s' % (mkd.name,))
+        # call module_kit.init()
+        getattr(module_kits, mkd.name).init(module_manager)
+        # add it to the loaded_kits for dependency checking
+        module_kit_list.append(mkd.name)
+
+    except Exception, e:
+        _failed_kits[kit_name] = 1
+
+        # if it's a crucial module_kit, we re-raise with our own
+        # message added using th three argument raise form
+        # see: http://docs.python.org/ref/raise.html
+        if mkd.crucial:
+            es = 'Error loading required module_kit %s: %s.' \
+                 % (mkd.name, str(e))
+            raise Exception, es, sys.exc_info()[2]
+        
+        # if not we can report the error and continue
+        else:
+            module_manager.log_error_with_exception(
+                'Unable to load non-critical module_kit %s: '
+                '%s.  Continuing.' %
+                (mkd.name, str(e)))
 
+            return False
 
+    end_time = time.time()
+    module_kit_load_times[mkd.name] = end_time - start_time
+    module_manager.log_info('Loaded %s in %.2f seconds.' %
+            (mkd.name, end_time - start_time))
 
+    return True
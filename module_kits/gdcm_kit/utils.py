@@ -3,36 +3,158 @@
 # See COPYRIGHT for details.
 
 import gdcm
+import hashlib
+import os
 
-def sort_ipp(filenames):
-    """STOP PRESS.  This is currently incomplete.  I'm waiting to see
-    what's going to happen with the IPPSorter in GDCM.
-    
-    Given a list of filenames, make use of the gdcm scanner to sort
-    them all according to IPP.
+# maximum number of sorted file-sets that sort_ipp remembers
+SORT_CACHE_SIZE = 32
 
-    @param filenames: list of full pathnames that you want to have
-    sorted.
-    @returns: tuple with (average z space, 
+# maps from file-set fingerprint to sort_ipp result
+_sort_cache = {}
+# fingerprints in order of use, least recently used first
+_sort_cache_order = []
+
+def get_fingerprint(filenames):
+    """Return fingerprint of the list of filenames that changes if the
+    list or any of the files (modification time or size) changes.
+
+    @raise OSError: if one of the files can't be stat'ed.
     """
 
+    m = hashlib.md5()
+    for f in filenames:
+        st = os.stat(f)
+        m.update('%s\0%r\0%d\0' % (f, st.st_mtime, st.st_size))
+
+    return m.hexdigest()
+
+def _parse_ds(value, n):
+    # parse DICOM DS multi-value string into a tuple of n floats
+    try:
+        values = tuple([float(v) for v in value.split('\\')])
+    except ValueError:
+        return None
+
+    if len(values) != n:
+        return None
+
+    return values
+
+def _sort_ipp(filenames, z_spacing_tolerance):
     s = gdcm.Scanner()
-    
-    # we need the IOP and the IPP tags
+
+    # we only need the IOP and the IPP tags, so the scanner can stop
+    # reading every file long before the pixel data
     iop_tag = gdcm.Tag(0x0020, 0x0037)
     s.AddTag(iop_tag)
-    ipp_tag = gdcm.Tag(0x0020, 0x0032) 
+    ipp_tag = gdcm.Tag(0x0020, 0x0032)
     s.AddTag(ipp_tag)
 
     ret = s.Scan(filenames)
     if not ret:
-        return (0, [])
+        return None
 
+    iop = None
+    positions = []
     for f in filenames:
-        mapping = s.GetMapping(f)
+        if not s.IsKey(f):
+            return None
 
+        mapping = s.GetMapping(f)
+        file_tags = {}
         pttv = gdcm.PythonTagToValue(mapping)
         pttv.Start()
         while not pttv.IsAtEnd():
             tag = pttv.GetCurrentTag()
-            val = pttv.GetCurrentValue()
+            file_tags[(tag.GetGroup(), tag.GetElement())] = \
+                    pttv.GetCurrentValue()
+            pttv.Next()
+
+        f_iop = _parse_ds(file_tags.get((0x0020, 0x0037), ''), 6)
+        ipp = _parse_ds(file_tags.get((0x0020, 0x0032), ''), 3)
+        if f_iop is None or ipp is None:
+            return None
+
+        if iop is None:
+            iop = f_iop
+
+        elif [1 for a, b in zip(iop, f_iop) if abs(a - b) > 1e-5]:
+            # all slices have to have the same orientation
+            return None
+
+        positions.append(ipp)
+
+    # the slice normal is the cross product of the row and column
+    # cosines; slices are sorted on their distance along the normal
+    r, c = iop[:3], iop[3:]
+    normal = (r[1] * c[2] - r[2] * c[1],
+              r[2] * c[0] - r[0] * c[2],
+              r[0] * c[1] - r[1] * c[0])
+
+    dists = [(p[0] * normal[0] + p[1] * normal[1] + p[2] * normal[2], f)
+             for p, f in zip(positions, filenames)]
+    dists.sort()
+
+    deltas = [dists[i + 1][0] - dists[i][0]
+              for i in range(len(dists) - 1)]
+    if [1 for d in deltas if d < z_spacing_tolerance]:
+        # more than one slice at the same position
+        return None
+
+    z_spacing = 0.0
+    if deltas:
+        mean_delta = sum(deltas) / len(deltas)
+        if not [1 for d in deltas
+                if abs(d - mean_delta) > z_spacing_tolerance]:
+            z_spacing = mean_delta
+
+    return [f for d, f in dists], z_spacing, iop
+
+def sort_ipp(filenames, z_spacing_tolerance=1e-2):
+    """Given a list of filenames, make use of the gdcm scanner to sort
+    them all according to IPP.
+
+    Only the Image Orientation (Patient) and Image Position (Patient)
+    tags of the files are read.  Results are cached per set of files,
+    identified by L{get_fingerprint}, so that sorting the same unchanged
+    files again is practically free.
+
+    @param filenames: list of full pathnames that you want to have
+    sorted.
+    @param z_spacing_tolerance: maximum deviation of the distance
+    between slices from the average distance.
+    @returns: tuple with (sorted list of filenames, z spacing, direction
+    cosines (IOP) as 6-tuple), or None if the files can't be sorted
+    (e.g. because some are not DICOM, don't have the same orientation
+    or have the same position).  The z spacing is 0.0 if the slices are
+    not equidistant.
+    """
+
+    if len(filenames) == 0:
+        return None
+
+    try:
+        fingerprint = get_fingerprint(filenames)
+    except OSError:
+        return None
+
+    key = (fingerprint, z_spacing_tolerance)
+
+    try:
+        result = _sort_cache[key]
+    except KeyError:
+        result = _sort_ipp(filenames, z_spacing_tolerance)
+        _sort_cache[key] = result
+        if len(_sort_cache_order) >= SORT_CACHE_SIZE:
+            del _sort_cache[_sort_cache_order.pop(0)]
+
+    else:
+        _sort_cache_order.remove(key)
+
+    _sort_cache_order.append(key)
+
+    if result is None:
+        return None
+
+    # copy, so that the caller can't change the cached list
+    return list(result[0]), result[1], result[2]
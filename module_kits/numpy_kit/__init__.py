@@ -8,6 +8,9 @@
 
 Inserts the following modules in sys.modules: numpy.
 
+After init, module_kits.numpy_kit.bridge converts images between VTK,
+ITK and numpy without copying where possible.
+
 @author: Charl P. Botha <http://cpbotha.net/>
 """
 
@@ -33,6 +36,10 @@ def init(theModuleManager, pre_import=True):
 
     theModuleManager.setProgress(95, 'Initialising numpy_kit: import done')
 
+    # user can address this as module_kits.numpy_kit.bridge.ImageBridge()
+    global bridge
+    import module_kits.numpy_kit.bridge as bridge
+
     # build up VERSION
     global VERSION
     VERSION = '%s' % (numpy.version.version,)
@@ -0,0 +1,433 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Conversion between vtkImageData, itk.Image and numpy arrays.
+
+Wherever the types allow, converted images share their buffer with the
+original: numpy arrays are views on the VTK scalars, VTK scalars wrap
+numpy arrays, and the ITK glue filters pass buffer pointers between VTK
+and ITK.  Conversions that can't share the buffer (type casts,
+non-contiguous arrays) copy it into a buffer owned by VTK and report
+this, see L{ImageBridge}.
+
+Keep in mind that a shared buffer is only valid for as long as the
+image or array that owns it is not re-executed or destroyed.  Whoever
+needs the data for longer should make a copy.  In particular, VTK
+scalars that wrap a numpy array do not keep a reference to the array:
+L{numpy_to_vtk} leaves this to the caller, and L{ImageBridge} keeps
+the arrays alive until it is closed.
+
+The connect_ methods of L{ImageBridge} only connect the VTK and ITK
+pipelines without computing anything, so that the sub-extents (or
+regions) requested downstream, including the padding that filters need
+for their neighbourhoods, propagate through the bridge.  This is what
+makes VTK-ITK-VTK chains streamable.  L{process_in_pieces} does the
+same for numpy code.
+
+Use as module_kits.numpy_kit.bridge after the numpy_kit has been
+initialised.  The ITK conversions also need the itk_kit.
+"""
+
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+from module_kits.misc_kit.misc_utils import \
+        get_itk_img_type_and_dim_shortstring
+
+# VTK scalar types and the short strings of their ITK pixel types,
+# e.g. the ITK type of a 3D unsigned short image is itk.Image.US3
+VTK_TO_ITK_TYPE = {
+        vtk.VTK_FLOAT : 'F',
+        vtk.VTK_DOUBLE : 'D',
+        vtk.VTK_CHAR : 'SC',
+        vtk.VTK_SIGNED_CHAR : 'SC',
+        vtk.VTK_UNSIGNED_CHAR : 'UC',
+        vtk.VTK_SHORT : 'SS',
+        vtk.VTK_UNSIGNED_SHORT : 'US',
+        vtk.VTK_INT : 'SI',
+        vtk.VTK_UNSIGNED_INT : 'UI',
+        vtk.VTK_LONG : 'SL',
+        vtk.VTK_UNSIGNED_LONG : 'UL'
+        }
+
+ITK_TO_VTK_TYPE = dict([(v, k) for k, v in VTK_TO_ITK_TYPE.items()])
+ITK_TO_VTK_TYPE['SC'] = vtk.VTK_SIGNED_CHAR
+
+def get_itk_shortstring(vtk_type, dims, num_components=1):
+    """Return the short string of the ITK image type that corresponds
+    to the given VTK scalar type, e.g. US3 or VF33.
+
+    @raise TypeError: if ITK has no corresponding pixel type.
+    """
+
+    try:
+        pixel = VTK_TO_ITK_TYPE[vtk_type]
+    except KeyError:
+        raise TypeError('VTK scalar type %d has no ITK equivalent.' %
+                        (vtk_type,))
+
+    if num_components == 1:
+        return '%s%d' % (pixel, dims)
+
+    else:
+        return 'V%s%d%d' % (pixel, num_components, dims)
+
+def vtk_to_numpy(image):
+    """Return numpy view on the scalars of vtkImageData image.
+
+    The array has shape (z,y,x), or (z,y,x,c) for images with more than
+    one scalar component.
+    """
+
+    image.Update()
+    x0, x1, y0, y1, z0, z1 = image.GetExtent()
+    shape = (z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1)
+
+    nc = image.GetNumberOfScalarComponents()
+    if nc > 1:
+        shape = shape + (nc,)
+
+    scalars = numpy_support.vtk_to_numpy(
+        image.GetPointData().GetScalars())
+    return scalars.reshape(shape)
+
+def _get_vtk_type(dtype):
+    # VTK has no boolean type and only native byte order
+    if dtype == numpy.bool_:
+        return vtk.VTK_UNSIGNED_CHAR
+
+    return numpy_support.get_vtk_array_type(dtype.newbyteorder('='))
+
+def _create_image(extent, vtk_type, num_components, spacing, origin):
+    image = vtk.vtkImageData()
+    image.SetExtent(extent)
+    image.SetWholeExtent(extent)
+    image.SetSpacing(spacing)
+    image.SetOrigin(origin)
+    image.SetScalarType(vtk_type)
+    image.SetNumberOfScalarComponents(num_components)
+    return image
+
+def get_data_dimension(image):
+    """Return the dimension of vtkImageData image, based on its whole
+    extent, so that this works before the image has been updated.
+    """
+
+    we = image.GetWholeExtent()
+    return len([i for i in range(3) if we[2 * i + 1] > we[2 * i]])
+
+def numpy_to_vtk(array, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0),
+                 copy_callback=None):
+    """Return vtkImageData with array as scalars.
+
+    If possible, the image uses the array's buffer, so changes to the
+    array show up in the image.  The image does not keep a reference to
+    the array, so the caller has to keep the array alive for as long as
+    the image is in use.  Otherwise the array is copied into scalars
+    allocated by VTK and copy_callback is called with the reason.
+
+    @param array: numpy array with shape (y,x), (z,y,x) or (z,y,x,c).
+    @raise TypeError: if VTK has no type for the array's dtype.
+    """
+
+    if array.ndim == 2:
+        array = array[numpy.newaxis]
+
+    if array.ndim == 3:
+        nc = 1
+    elif array.ndim == 4:
+        nc = array.shape[3]
+    else:
+        raise TypeError('Arrays of %d dimensions are not images.' %
+                        (array.ndim,))
+
+    if array.dtype == numpy.bool_:
+        copy_reason = 'VTK has no boolean type, converting to ' \
+                      'unsigned char.'
+    elif not array.dtype.isnative:
+        copy_reason = 'Swapping bytes of non-native array.'
+    elif not array.flags.c_contiguous:
+        copy_reason = 'Array is not C-contiguous.'
+    else:
+        copy_reason = None
+
+    vtk_type = _get_vtk_type(array.dtype)
+
+    nz, ny, nx = array.shape[:3]
+    image = _create_image((0, nx - 1, 0, ny - 1, 0, nz - 1), vtk_type, nc,
+                          spacing, origin)
+
+    if copy_reason is None:
+        # with deep=0, numpy_to_vtk only hands the array's buffer to
+        # the scalars (SetVoidArray), without keeping a reference to
+        # the array
+        scalars = numpy_support.numpy_to_vtk(
+            array.reshape((-1, nc)), 0, vtk_type)
+        image.GetPointData().SetScalars(scalars)
+
+    else:
+        if copy_callback:
+            copy_callback(copy_reason)
+
+        # VTK owns these scalars; numpy converts while copying
+        image.AllocateScalars()
+        vtk_to_numpy(image)[...] = array
+
+    return image
+
+def process_in_pieces(image, function, num_pieces, ghost_slices=0,
+                      progress_callback=None):
+    """Apply function to vtkImageData image in num_pieces slabs of z
+    slices, and return the complete result as a new vtkImageData.
+
+    Only one slab of image, padded with up to ghost_slices neighbouring
+    slices on either side, is requested from its pipeline at a time, so
+    that streamable upstream modules stream.  This is how numpy-based
+    modules take part in hybrid streaming: they compute their complete
+    output in their streaming_execute_module() with this function, and
+    set streaming_terminates, see the hybrid scheduling documentation
+    in the Scheduler class.
+
+    @param function: called with a numpy view (see L{vtk_to_numpy}) of
+    every padded slab, returns an array of which the first three
+    dimensions are the same as those of the view.  The padding is
+    discarded from this array.
+    @param ghost_slices: number of slices of padding that function needs
+    to compute the slices of a slab correctly, e.g. the radius of a
+    neighbourhood operation.
+    @param progress_callback: called with the percentage of processed
+    slabs.
+    @return: vtkImageData with the whole extent, spacing and origin of
+    image.
+    @raise ValueError: if image is empty.
+    """
+
+    image.UpdateInformation()
+    we = image.GetWholeExtent()
+    nz = we[5] - we[4] + 1
+    if nz <= 0 or we[1] < we[0] or we[3] < we[2]:
+        raise ValueError('Unable to process an empty image.')
+
+    num_pieces = max(1, min(num_pieces, nz))
+    out_image = None
+    for piece in range(num_pieces):
+        z0 = we[4] + piece * nz / num_pieces
+        z1 = we[4] + (piece + 1) * nz / num_pieces - 1
+        pz0 = max(we[4], z0 - ghost_slices)
+        pz1 = min(we[5], z1 + ghost_slices)
+
+        image.SetUpdateExtent(we[0], we[1], we[2], we[3], pz0, pz1)
+        image.Update()
+
+        # the pipeline is allowed to give us more than we asked for
+        e = image.GetExtent()
+        padded = vtk_to_numpy(image)[
+            pz0 - e[4]:pz1 - e[4] + 1,
+            we[2] - e[2]:we[3] - e[2] + 1,
+            we[0] - e[0]:we[1] - e[0] + 1]
+
+        result = numpy.asarray(function(padded))
+        if out_image is None:
+            # the output scalars are allocated by VTK, so that they
+            # live as long as out_image, and filled through a numpy view
+            if result.ndim == 4:
+                nc = result.shape[3]
+            else:
+                nc = 1
+
+            out_image = _create_image(
+                we, _get_vtk_type(result.dtype), nc, image.GetSpacing(),
+                image.GetOrigin())
+            out_image.AllocateScalars()
+            output = vtk_to_numpy(out_image)
+
+        output[z0 - we[4]:z1 - we[4] + 1] = \
+                result[z0 - pz0:z1 - pz0 + 1]
+
+        if progress_callback:
+            progress_callback(100.0 * (piece + 1) / num_pieces)
+
+    # don't leave the last slab as the update extent of our input
+    image.SetUpdateExtentToWholeExtent()
+
+    return out_image
+
+#########################################################################
+class ImageBridge:
+    """Converts images between VTK, ITK and numpy, sharing buffers
+    wherever possible.
+
+    Every instance caches its conversion filters per ITK image type, so
+    that its outputs stay the same objects between conversions of
+    images of the same type.  For that reason, every module should use
+    its own ImageBridge: the outputs of the cached filters change with
+    every conversion.
+
+    Copies that can't be avoided are counted in num_copies and reported
+    by calling copy_callback with a description.
+
+    The numpy arrays that images from L{numpy_to_vtk} and
+    L{numpy_to_itk} share their buffers with are kept alive until
+    L{close} is called.
+    """
+
+    def __init__(self, copy_callback=None):
+        self.num_copies = 0
+        self._copy_callback = copy_callback
+        # maps from (filter template name, ITK type short string) to
+        # conversion filter
+        self._filters = {}
+        self._image_cast = None
+        # maps from vtkImageData to the numpy array that holds its
+        # scalars, which the vtkImageData does not keep alive itself
+        self._shared_arrays = {}
+
+    def close(self):
+        self._filters.clear()
+        self._image_cast = None
+        self._shared_arrays.clear()
+
+    def _report_copy(self, reason):
+        self.num_copies += 1
+        if self._copy_callback:
+            self._copy_callback(reason)
+
+    def _get_filter(self, template_name, shortstring):
+        key = (template_name, shortstring)
+        try:
+            return self._filters[key]
+        except KeyError:
+            pass
+
+        import itk
+        try:
+            f = getattr(itk, template_name)[
+                getattr(itk.Image, shortstring)].New()
+        except (AttributeError, KeyError):
+            raise TypeError('Unable to instantiate %s for ITK image '
+                            'type %s.' % (template_name, shortstring))
+
+        self._filters[key] = f
+        return f
+
+    def vtk_to_numpy(self, image):
+        """See L{vtk_to_numpy}.  This never copies.
+        """
+
+        return vtk_to_numpy(image)
+
+    def numpy_to_vtk(self, array, spacing=(1.0, 1.0, 1.0),
+                     origin=(0.0, 0.0, 0.0)):
+        """See L{numpy_to_vtk}.  If the image shares the buffer of
+        array, the array is kept alive until L{close} is called.
+        """
+
+        num_copies = self.num_copies
+        image = numpy_to_vtk(array, spacing, origin, self._report_copy)
+        if self.num_copies == num_copies:
+            # no copy was made, so image uses the buffer of array
+            self._shared_arrays[image] = array
+
+        return image
+
+    def connect_vtk_to_itk(self, image, vtk_type=None):
+        """Connect vtkImageData image to the ITK pipeline and return the
+        itk.Image output, without updating any data.
+
+        Only the pipeline information of image is updated, to determine
+        its type.  See L{vtk_to_itk} for the parameters.
+        """
+
+        image.UpdateInformation()
+
+        if vtk_type is None or vtk_type == image.GetScalarType():
+            source = image
+
+        else:
+            self._report_copy('Casting %s image to VTK scalar type %d.' %
+                              (image.GetScalarTypeAsString(), vtk_type))
+            if self._image_cast is None:
+                self._image_cast = vtk.vtkImageCast()
+
+            self._image_cast.SetInput(image)
+            self._image_cast.SetOutputScalarType(vtk_type)
+            source = self._image_cast.GetOutput()
+            source.UpdateInformation()
+
+        shortstring = get_itk_shortstring(
+            source.GetScalarType(), get_data_dimension(source),
+            source.GetNumberOfScalarComponents())
+
+        f = self._get_filter('VTKImageToImageFilter', shortstring)
+        f.SetInput(source)
+
+        return f.GetOutput()
+
+    def vtk_to_itk(self, image, vtk_type=None):
+        """Return itk.Image that shares the buffer of vtkImageData image.
+
+        @param vtk_type: VTK scalar type of the ITK image.  If this is
+        given and differs from the type of image, the image is cast,
+        which copies it.
+        @raise TypeError: if ITK has no wrapped type for the image.
+        """
+
+        output = self.connect_vtk_to_itk(image, vtk_type)
+
+        # the extent of the input can change while its type stays the
+        # same, and a previous streaming update could have requested
+        # only a piece, so we always request the largest possible region
+        output.UpdateOutputInformation()
+        output.SetRequestedRegionToLargestPossibleRegion()
+        output.Update()
+
+        return output
+
+    def connect_itk_to_vtk(self, itk_image):
+        """Connect itk_image to the VTK pipeline and return the
+        vtkImageData output, without updating any data.  See
+        L{itk_to_vtk}.
+        """
+
+        shortstring = get_itk_img_type_and_dim_shortstring(itk_image)
+
+        f = self._get_filter('ImageToVTKImageFilter', shortstring)
+        f.SetInput(itk_image)
+
+        return f.GetOutput()
+
+    def itk_to_vtk(self, itk_image):
+        """Return vtkImageData that shares the buffer of itk_image.
+
+        @raise TypeError: if itk_image is not an ITK image, or if there
+        is no wrapped conversion filter for its type.
+        """
+
+        output = self.connect_itk_to_vtk(itk_image)
+
+        itk_image.UpdateOutputInformation()
+        itk_image.SetRequestedRegionToLargestPossibleRegion()
+        itk_image.Update()
+
+        output.UpdateInformation()
+        output.SetUpdateExtentToWholeExtent()
+        output.Update()
+
+        return output
+
+    def numpy_to_itk(self, array, spacing=(1.0, 1.0, 1.0),
+                     origin=(0.0, 0.0, 0.0)):
+        """Return itk.Image that shares the buffer of numpy array, which
+        has the same layout as for L{numpy_to_vtk}.
+        """
+
+        return self.vtk_to_itk(self.numpy_to_vtk(array, spacing, origin))
+
+    def itk_to_numpy(self, itk_image):
+        """Return numpy view on the buffer of itk_image, with the same
+        layout as L{vtk_to_numpy}.
+        """
+
+        return vtk_to_numpy(self.itk_to_vtk(itk_image))
@@ -257,7 +257,8 @@ class PythonShellMixin:
 
         import module_kits
 
-        if 'matplotlib_kit' not in module_kits.module_kit_list:
+        # matplotlib_kit is only loaded on first use
+        if not self.module_manager.load_module_kits(['matplotlib_kit']):
             self.output_text('No matplotlib support.')
             return
 
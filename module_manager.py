@@ -9,6 +9,11 @@ import copy
 import gen_utils
 import glob
 from meta_module import MetaModule
+from module_graph import ModuleGraph
+from output_cache import OutputCache
+from memory_budget import OutputMemoryBudget
+from execution_profiler import ExecutionProfiler
+from module_index_cache import ModuleIndexCache
 import modules
 import mutex
 from random import choice
@@ -38,16 +43,40 @@ class ModuleManagerException(Exception):
 class ModuleSearch:
     """Class for doing relative fast searches through module metadata.
 
+    All distinct words in the module names, keywords and help texts are
+    indexed on their n-grams (all substrings of up to NGRAM_LENGTH
+    characters).  The words containing a search word are found by
+    intersecting the index entries of the search word's n-grams, so
+    that only a handful of words have to be checked with a containment
+    test.  When a search word extends a word of the previous search, as
+    happens when the user types, only the words that matched that
+    previous word are checked.
+
     @author Charl P. Botha <http://cpbotha.net/>
     """
+
+    # words are indexed on all their substrings of up to this length
+    NGRAM_LENGTH = 3
+
+    # match qualities used for ranking, see get_match_score()
+    MATCH_SUBSTRING = 1
+    MATCH_PREFIX = 2
+    MATCH_EXACT = 3
     
     def __init__(self):
         # dict of dicts of tuple, e.g.:
         # {'isosurface' : {('contour', 'keywords') : 1,
         #                  ('marching', 'help') : 1} ...
         self.search_dict = {}
+        # maps from n-gram to set of words in search_dict containing it
+        self.ngram_index = {}
         self.previous_partial_text = ''
         self.previous_results = None
+        # maps from (index_name, where_found) to score of previous search
+        self.previous_scores = {}
+        # maps from each word of the previous search to the set of
+        # words in search_dict that contain it
+        self._previous_word_matches = {}
 
     def build_search_index(self, available_modules, available_segments):
         """Build search index given a list of available modules and segments.
@@ -58,6 +87,11 @@ class ModuleSearch:
         """
         
         self.search_dict.clear()
+        self.ngram_index.clear()
+        self.previous_partial_text = ''
+        self.previous_results = None
+        self.previous_scores = {}
+        self._previous_word_matches = {}
 
         def index_field(index_name, mi_class, field_name, split=False):
             try:
@@ -101,12 +135,58 @@ class ModuleSearch:
             # segment name's are unique by definition (complete file names)
             self.search_dict[segment_name] = {(index_name, 'name') : 1}
 
+        n = self.NGRAM_LENGTH
+        for w in self.search_dict:
+            for i in range(len(w)):
+                for j in range(i + 1, min(i + n, len(w)) + 1):
+                    self.ngram_index.setdefault(w[i:j], set()).add(w)
+
+    def _find_words(self, search_word):
+        """Return set of all words in search_dict that contain
+        search_word.
+        """
+
+        # if the user has extended a word of the previous search, only
+        # the words that contained that previous word can match
+        previous_word = None
+        for pw in self._previous_word_matches:
+            if search_word.find(pw) >= 0 and \
+               (previous_word is None or len(pw) > len(previous_word)):
+                previous_word = pw
+
+        if previous_word == search_word:
+            return self._previous_word_matches[previous_word]
+
+        elif previous_word is not None:
+            candidates = self._previous_word_matches[previous_word]
+
+        else:
+            n = self.NGRAM_LENGTH
+            if len(search_word) <= n:
+                # all substrings up to n characters are indexed, so this
+                # is exactly the set of words containing search_word
+                return self.ngram_index.get(search_word, set())
+
+            # all n-grams of search_word have to occur in a matching
+            # word; start with the rarest
+            postings = [self.ngram_index.get(search_word[i:i+n], set())
+                        for i in range(len(search_word) - n + 1)]
+            postings.sort(key=len)
+            candidates = postings[0]
+            for p in postings[1:]:
+                if not candidates:
+                    break
+                candidates = candidates & p
+
+        return set([w for w in candidates if w.find(search_word) >= 0])
+
     def find_matches(self, partial_text):
         """Do partial text (containment) search through all module names,
         help and keywords.
 
         Simple caching is currently done.  Each space-separated word in
-        partial_text is searched for and results are 'AND'ed.
+        partial_text is searched for and results are 'AND'ed.  After
+        this, L{get_match_score} can be used to rank the results.
 
         @returns: a list of unique tuples consisting of (modulename,
         where_found) where where_found is 'name', 'keywords' or 'help'
@@ -117,11 +197,18 @@ class ModuleSearch:
             return self.previous_results
 
         partial_words = partial_text.lower().split()
+        if not partial_words:
+            return {}
 
         # dict mapping from full.module.name -> {'where_found' : 1, 'wf2' : 1}
         # think about optimising this with a bit mask rather; less flexible
         # but saves space and is at least as fast.
 
+        # maps from (module name, where_found) to match quality summed
+        # over all search words
+        scores = {}
+        word_matches = {}
+
         def find_one_word(search_word):
             """Searches for all partial / containment matches with
             search_word.
@@ -130,19 +217,35 @@ class ModuleSearch:
             dictionary with where froms as keys and 1s as values.
             
             """
+            words = self._find_words(search_word)
+            word_matches[search_word] = words
+
+            # best match quality of search_word per location
+            qualities = {}
+            for w in words:
+                if w == search_word:
+                    quality = self.MATCH_EXACT
+                elif w.startswith(search_word):
+                    quality = self.MATCH_PREFIX
+                else:
+                    quality = self.MATCH_SUBSTRING
+
+                # we can have partial matches with more than one key
+                # returning the same location, so we consolidate them
+                # in a dict too.  k[0] is module_name, k[1] is
+                # where_found
+                for k in self.search_dict[w]:
+                    if quality > qualities.get(k, 0):
+                        qualities[k] = quality
+
             search_results = {}
-            for w in self.search_dict:
-                if w.find(search_word) >= 0:
-                    # we can have partial matches with more than one key
-                    # returning the same location, so we stuff results in a 
-                    # dict too to consolidate results
-                    for k in self.search_dict[w].keys():
-                        # k[1] is where_found, k[0] is module_name
-                        if k[0] not in search_results:
-                            search_results[k[0]] = {k[1] : 1}
-                                
-                        else:
-                            search_results[k[0]][k[1]] = 1
+            for k, quality in qualities.iteritems():
+                if k[0] not in search_results:
+                    search_results[k[0]] = {k[1] : 1}
+                else:
+                    search_results[k[0]][k[1]] = 1
+
+                scores[k] = scores.get(k, 0) + quality
 
             return search_results
 
@@ -202,7 +305,20 @@ class ModuleSearch:
         self.previous_partial_text = partial_text
         rl = search_results
         self.previous_results = rl
+        self.previous_scores = scores
+        self._previous_word_matches = word_matches
         return rl
+
+    def get_match_score(self, index_name, where_found):
+        """Return relevance of a result of the previous find_matches().
+
+        For each search word, the best match in that location counts: an
+        exact word match scores MATCH_EXACT, a word that starts with the
+        search word MATCH_PREFIX and a word that only contains it
+        MATCH_SUBSTRING.  The score is the sum over all search words.
+        """
+
+        return self.previous_scores.get((index_name, where_found), 0)
         
 
 #########################################################################
@@ -248,6 +364,14 @@ class ModuleManager:
         # module dictionary, keyed on instance... cool.
         # values are MetaModules
         self._module_dict = {}
+        # index of the connections between module parts, kept up to date
+        # as modules are created, deleted, connected and disconnected
+        self._module_graph = ModuleGraph()
+        # (meta_module, part) tuples that might require a transfer or
+        # an execution, and hence have to be visited during the next
+        # network execution.  Only their downstream closure is handed
+        # to the scheduler.
+        self._dirty_parts = {}
 
         appdir = self._devide_app.get_appdir()
         self._modules_dir = os.path.join(appdir, 'modules')
@@ -270,6 +394,41 @@ class ModuleManager:
         ##############################################################
 
         self.module_search = ModuleSearch()
+
+        # optional content-addressed cache of module outputs
+        main_config = self.get_app_main_config()
+        if main_config.output_cache in ('memory', 'disk'):
+            self.output_cache = OutputCache(
+                self, main_config.output_cache,
+                main_config.output_cache_dir,
+                main_config.output_cache_entries)
+            self.log_info('Using %s output cache.' %
+                          (main_config.output_cache,))
+        else:
+            self.output_cache = None
+
+        # optional release of intermediate outputs, budget is in KB
+        if main_config.output_memory_budget > 0:
+            self.memory_budget = OutputMemoryBudget(
+                self, main_config.output_memory_budget * 1024)
+            self.log_info('Using output memory budget of %d KB.' %
+                          (main_config.output_memory_budget,))
+        else:
+            self.memory_budget = None
+
+        # per-module execution statistics, reported at the end of every
+        # network execution
+        self.profiler = ExecutionProfiler(
+            self, main_config.profile, main_config.profile_dir)
+        
+        # scan results of unchanged module_index files and directories
+        # are reused, also by subsequent DeVIDE processes
+        if main_config.module_index_cache == 'off':
+            mic_filename = None
+        else:
+            mic_filename = main_config.module_index_cache
+            
+        self._module_index_cache = ModuleIndexCache(mic_filename)
         
         # make first scan of available modules
         self.scan_modules()
@@ -291,6 +450,24 @@ class ModuleManager:
         # callback... (there SHOULD only be ONE ModuleManager instance)
         self._inProgressCallback = mutex.mutex()
 
+    def load_module_kits(self, kit_names):
+        """Load the given module_kits, and the kits they depend on, if
+        this has not been done yet.
+
+        Non-crucial kits are loaded on first use, so this has to be called
+        before using a kit that might not have been loaded.
+
+        @return: True if all kits are loaded, False if any of them is not
+        available or failed to load.
+        """
+
+        all_loaded = True
+        for kit_name in kit_names:
+            if not self.module_kits.load_kit(self, kit_name):
+                all_loaded = False
+
+        return all_loaded
+
     def refresh_module_kits(self):
         """Go through list of imported module kits, reload each one, and
         also call its refresh() method if available.
@@ -325,6 +502,14 @@ class ModuleManager:
         """
         self.delete_all_modules()
 
+        if self.output_cache is not None:
+            self.output_cache.close()
+
+        if self.memory_budget is not None:
+            self.memory_budget.close()
+
+        self.profiler.close()
+
     def delete_all_modules(self):
         """Deletes all modules.
 
@@ -465,6 +650,9 @@ class ModuleManager:
     def scan_modules(self):
         """(Re)Check the modules directory for *.py files and put them in
         the list self.module_files.
+
+        Only directories and module_index files that have changed since
+        they were last scanned are processed, see L{ModuleIndexCache}.
         """
 
         # this is a dict mapping from full module name to the classes as
@@ -477,16 +665,18 @@ class ModuleManager:
         # search through modules hierarchy and pick up all module_index files
         ####################################################################
 
+        # list of (importable module_index spec, module_index filename)
         module_indices = []
 
-        def miwFunc(arg, dirname, fnames):
-            """arg is top-level module path.
+        def add_module_indices(module_path):
+            """module_path is top-level module path.
             """
-            module_path = arg
-            for fname in fnames:
-                mi_full_name = os.path.join(dirname, fname)
-                if not fnmatch.fnmatch(fname, 'module_index.py'):
-                    continue
+
+            # only directories that have changed since the previous scan
+            # are listed again
+            for dirname in \
+                    self._module_index_cache.find_module_indices(module_path):
+                mi_full_name = os.path.join(dirname, 'module_index.py')
 
                 # e.g. /viewers/module_index
                 mi2 = os.path.splitext(
@@ -503,9 +693,9 @@ class ModuleManager:
                 if module_path == modulePath:
                     mim = 'modules.%s' % (mim)
 
-                module_indices.append(mim)
+                module_indices.append((mim, mi_full_name))
 
-        os.path.walk(modulePath, miwFunc, arg=modulePath)
+        add_module_indices(modulePath)
 
         for emp in self.get_app_main_config().extra_module_paths:
             # make sure there are no extra spaces at the ends, as well
@@ -518,68 +708,49 @@ class ModuleManager:
                 if emp not in sys.path:
                     sys.path.insert(0,emp)
 
-                os.path.walk(emp, miwFunc, arg=emp)
+                add_module_indices(emp)
 
         # iterate through the moduleIndices, building up the available
         # modules list.
         import module_kits # we'll need this to check available kits
         failed_mis = {}
-        for mim in module_indices:
+        imported_mis = []
+        for mim, mi_full_name in module_indices:
             # mim is importable module_index spec, e.g.
             # modules.viewers.module_index
 
-            # if this thing was imported before, we have to remove it, else
-            # classes that have been removed from the module_index file
-            # will still appear after the reload.
-            if mim in sys.modules:
-                del sys.modules[mim]
-
-            try:
-                # now we can import
-                __import__(mim, globals(), locals())
-                
-            except Exception, e:
-                # make a list of all failed moduleIndices
-                failed_mis[mim] = sys.exc_info()
-                msgs = gen_utils.exceptionToMsgs()
-
-                # and log them as mesages
-                self._devide_app.log_info(
-                    'Error loading %s: %s.' % (mim, str(e)))
-
-                for m in msgs:
-                    self._devide_app.log_info(m.strip(), timeStamp=False)
+            # module_index files that have not changed since they were
+            # cached don't have to be imported at all
+            cs = self._module_index_cache.get_classes(mi_full_name, mim)
 
-                # we don't want to throw an exception here, as that would
-                # mean that a singe misconfigured module_index file can
-                # prevent the whole scan_modules process from completing
-                # so we'll report on errors here and at the end
-
-            else:
-                # reload, as this could be a run-time rescan
-                m = sys.modules[mim]
-                reload(m)
-            
-                # find all classes in the imported module
-                cs = [a for a in dir(m)
-                      if type(getattr(m,a)) == types.ClassType]
-
-                # stuff these classes, keyed on the module name that they
-                # represent, into the modules list.
-                for a in cs:
-                    # a is the name of the class
-                    c = getattr(m,a)
+            if cs is None:
+                imported_mis.append(mim)
+                cs = self._import_module_index(mim, failed_mis)
+                if cs is None:
+                    continue
 
-                    module_deps = True
-                    for kit in c.kits:
-                        if kit not in module_kits.module_kit_list:
-                            module_deps = False
-                            break
+                self._module_index_cache.store_classes(mi_full_name, cs)
+
+            # stuff these classes, keyed on the module name that they
+            # represent, into the modules list.
+            for c in cs:
+                # kits are loaded when the module is created, so
+                # here we only check that they could be
+                module_deps = True
+                for kit in c.kits:
+                    if kit not in module_kits.available_kit_list:
+                        module_deps = False
+                        break
 
-                    if module_deps:
-                        module_name = mim.replace('module_index', a)
-                        self._available_modules[module_name] = c
+                if module_deps:
+                    module_name = mim.replace('module_index', c.__name__)
+                    self._available_modules[module_name] = c
 
+        try:
+            self._module_index_cache.save()
+        except (IOError, OSError), e:
+            self._devide_app.log_warning(
+                'Could not write module index cache: %s' % (str(e),))
 
         # we should move this functionality to the graphEditor.  "segments"
         # are _probably_ only valid there... alternatively, we should move
@@ -611,8 +782,53 @@ class ModuleManager:
                 % (failed_indices,))
 
         self._devide_app.log_info(
-            '%d modules and %d segments scanned.' %
-            (len(self._available_modules), len(self.availableSegmentsList)))
+            '%d modules and %d segments scanned, %d of %d module indices '
+            'unchanged.' %
+            (len(self._available_modules), len(self.availableSegmentsList),
+             len(module_indices) - len(imported_mis), len(module_indices)))
+
+    def _import_module_index(self, mim, failed_mis):
+        """Import module_index mim and return list of the classes in it.
+
+        If the import fails, the error is logged and recorded in
+        failed_mis and None is returned.
+        """
+
+        # if this thing was imported before, we have to remove it, else
+        # classes that have been removed from the module_index file
+        # will still appear after the reload.
+        if mim in sys.modules:
+            del sys.modules[mim]
+
+        try:
+            # now we can import
+            __import__(mim, globals(), locals())
+            
+        except Exception, e:
+            # make a list of all failed moduleIndices
+            failed_mis[mim] = sys.exc_info()
+            msgs = gen_utils.exceptionToMsgs()
+
+            # and log them as mesages
+            self._devide_app.log_info(
+                'Error loading %s: %s.' % (mim, str(e)))
+
+            for m in msgs:
+                self._devide_app.log_info(m.strip(), timeStamp=False)
+
+            # we don't want to throw an exception here, as that would
+            # mean that a singe misconfigured module_index file can
+            # prevent the whole scan_modules process from completing
+            # so we'll report on errors here and at the end
+            return None
+
+        # reload, as this could be a run-time rescan
+        m = sys.modules[mim]
+        reload(m)
+    
+        # find all classes in the imported module
+        return [getattr(m, a) for a in dir(m)
+                if type(getattr(m, a)) == types.ClassType]
         
     ########################################################################
 
@@ -621,6 +837,25 @@ class ModuleManager:
 
     def get_app_main_config(self):
         return self._devide_app.main_config
+
+    def get_streaming_pieces(self, instance):
+        """Return number of pieces in which module instance should
+        stream during its streaming_execute_module().
+
+        This is the number chosen by the hybrid scheduler based on the
+        streaming_memory budget, or the configured streaming_pieces if
+        the scheduler could not make an estimate.
+        """
+
+        try:
+            pieces = self.get_meta_module(instance).streaming_pieces
+        except KeyError:
+            pieces = 0
+
+        if pieces > 0:
+            return pieces
+
+        return self.get_app_main_config().streaming_pieces
 	
     def get_available_modules(self):
         """Return the available_modules, a dictionary keyed on fully qualified
@@ -668,6 +903,12 @@ class ModuleManager:
         """
         return self._module_dict[instance]
 
+    def get_module_graph(self):
+        """Return the ModuleGraph that indexes the connections between
+        all module parts.  This is used by the scheduler.
+        """
+        return self._module_graph
+
     def get_modules_dir(self):
         return self._modules_dir
 
@@ -711,6 +952,13 @@ class ModuleManager:
                 '%s is not available in the current Module Manager / '
                 'Kit configuration.' % (fullName,))
 
+        # make sure that all kits this module requires have been loaded
+        kits = self._available_modules[fullName].kits
+        if not self.load_module_kits(kits):
+            raise ModuleManagerException(
+                'Unable to load module_kits %s required by module %s.' %
+                (', '.join(kits), fullName))
+
         try:
             # think up name for this module (we have to think this up now
             # as the module might want to know about it whilst it's being
@@ -751,8 +999,15 @@ class ModuleManager:
                 pto = None
             
             # and store it in our internal structures
-            self._module_dict[module_instance] = MetaModule(
+            meta_module = MetaModule(
                 module_instance, instance_name, fullName, pti, pto)
+            self._module_dict[module_instance] = meta_module
+            self._module_graph.add_module(meta_module)
+
+            # new modules always have to be executed
+            meta_module.modified_callback = self._handler_meta_module_modified
+            for part in range(meta_module.numParts):
+                self._dirty_parts[(meta_module, part)] = 1
 
             # it's now fully born ;)
             self._halfBornInstanceName = None
@@ -842,13 +1097,31 @@ class ModuleManager:
         @return: Nothing.
         """
 
+        profile_token = self.profiler.start_execution(
+            meta_module, part, streaming)
+
         try:
+            # if the output cache has the outputs of this exact execution,
+            # we restore them instead of executing.  Streaming execution
+            # only produces partial outputs, so it is never cached.
+            cache_key = None
+            if self.output_cache is not None and not streaming:
+                cache_key = self.output_cache.get_key(meta_module, part)
+                if cache_key is not None and \
+                   self.output_cache.restore(cache_key, meta_module, part):
+                    self.profiler.finish_execution(profile_token, 'cached')
+                    return
+
             # this goes via the MetaModule so that time stamps and the
             # like are correctly reported
             meta_module.execute_module(part, streaming)
 
+            if cache_key is not None:
+                self.output_cache.store(cache_key, meta_module, part)
             
         except Exception, e:
+            self.profiler.finish_execution(profile_token, 'failed')
+
             # get details about the errored module
             instance_name = meta_module.instance_name
             module_name = meta_module.instance.__class__.__name__
@@ -861,7 +1134,27 @@ class ModuleManager:
             # message to the exception but we get to see the old traceback
             # see: http://docs.python.org/ref/raise.html
             raise ModuleManagerException, es, sys.exc_info()[2]
-        
+
+        self.profiler.finish_execution(profile_token)
+
+    def streaming_connect_module(self, meta_module, part=0):
+        """Let a non-terminating streamable module connect its pipeline
+        instead of executing.  This is called by the hybrid scheduler.
+
+        @raise ModuleManagerException: this exception is raised with an
+        informative error string if the module fails to connect.
+        """
+
+        try:
+            meta_module.streaming_connect_module(part)
+
+        except Exception, e:
+            instance_name = meta_module.instance_name
+            module_name = meta_module.instance.__class__.__name__
+
+            es = 'Unable to connect part %d of module %s (%s) for ' \
+                 'streaming: %s' % (part, instance_name, module_name, str(e))
+            raise ModuleManagerException, es, sys.exc_info()[2]
             
     def execute_network(self, startingModule=None):
         """Execute local network in order, starting from startingModule.
@@ -955,8 +1248,13 @@ class ModuleManager:
 
             finally:
                 # do the following in all cases:
-                # 1. remove module from our dict
+                # 1. remove module from our dict and graph
                 del self._module_dict[instance]
+                self._module_graph.remove_module(meta_module)
+                for part in range(meta_module.numParts):
+                    self._dirty_parts.pop((meta_module, part), None)
+                if self.memory_budget is not None:
+                    self.memory_budget.forget_module(meta_module)
                 # 2. reset auto_execute mode
                 self.auto_execute = ae
                 # the exception will now be re-raised if there was one
@@ -995,6 +1293,16 @@ class ModuleManager:
         self._module_dict[output_module].connectOutput(
             output_idx, input_module, input_idx)
 
+        self._module_graph.add_connection(
+            self._module_dict[output_module], output_idx,
+            self._module_dict[input_module], input_idx)
+
+        # a new connection always results in a transfer, so the consumer
+        # part has to be visited during the next execution
+        consumer_meta_module = self._module_dict[input_module]
+        self._dirty_parts[(consumer_meta_module,
+            consumer_meta_module.getPartForInput(input_idx))] = 1
+
 	
     def disconnect_modules(self, input_module, input_idx):
         """Disconnect a consumer module from its provider.
@@ -1038,6 +1346,10 @@ class ModuleManager:
             self._module_dict[supp].disconnectOutput(
                 suppOutIdx, input_module, input_idx)
 
+            self._module_graph.remove_connection(
+                self._module_dict[supp], suppOutIdx,
+                meta_module, input_idx)
+
         # indicate to the meta data that this module doesn't have an input
         # anymore
         self._module_dict[input_module].disconnectInput(input_idx)
@@ -1165,6 +1477,91 @@ class ModuleManager:
         # the newly created module-instance and a list with the connections
         return (newModulesDict, newConnections)
 
+    def _handler_meta_module_modified(self, meta_module, part):
+        self._dirty_parts[(meta_module, part)] = 1
+
+    def mark_all_dirty(self):
+        """Mark all module parts as dirty, so that the next network
+        execution visits all modules.
+
+        This is required for example when switching between schedulers,
+        as these use different sets of transfer timestamps.
+        """
+
+        for meta_module in self._module_dict.values():
+            for part in range(meta_module.numParts):
+                self._dirty_parts[(meta_module, part)] = 1
+
+    def get_dirty_closure(self):
+        """Return the downstream closure of all dirty module parts.
+
+        Only the modules in this closure can require transfers or
+        execution during the next network execution.
+
+        @return: dictionary with (meta_module, part) tuples as keys.
+        """
+
+        return self._module_graph.get_downstream_closure(
+            self._dirty_parts.keys())
+
+    def update_dirty_parts(self, vertices):
+        """Re-evaluate the dirty state of the given module parts after
+        network execution.
+
+        A part stays dirty if it still has to be executed or if any of
+        its input transfers is still outstanding, for example because
+        execution was aborted or the part was blocked or not selected.
+        All other given parts are removed from the dirty set.
+
+        Streamable parts that do not terminate their streamable subset
+        are only touched by the hybrid scheduler, never executed, and
+        the transfers between streamable parts are streaming transfers.
+        For these, being up to date in either of the two modes is
+        enough, otherwise they would be rescheduled on every run.
+
+        @param vertices: sequence of (meta_module, part) tuples, usually
+        as returned by L{get_dirty_closure}.
+        """
+
+        for meta_module, part in vertices:
+            if meta_module.instance not in self._module_dict:
+                # deleted during execution
+                self._dirty_parts.pop((meta_module, part), None)
+                continue
+
+            streamable = self._is_streamable(meta_module)
+
+            pending = self.should_execute_module(meta_module, part)
+            if pending and streamable:
+                pending = meta_module.should_touch(part)
+
+            if not pending:
+                for p_meta_module, output_idx, input_idx in \
+                        self.get_producers(meta_module):
+                    if meta_module.getPartForInput(input_idx) != part:
+                        continue
+
+                    outstanding = self.should_transfer_output(
+                        p_meta_module, output_idx, meta_module, input_idx)
+                    if outstanding and streamable and \
+                            self._is_streamable(p_meta_module):
+                        outstanding = self.should_transfer_output(
+                            p_meta_module, output_idx, meta_module,
+                            input_idx, streaming=True)
+
+                    if outstanding:
+                        pending = True
+                        break
+
+            if pending:
+                self._dirty_parts[(meta_module, part)] = 1
+            else:
+                self._dirty_parts.pop((meta_module, part), None)
+
+    def _is_streamable(self, meta_module):
+        # same criterion as the hybrid scheduler
+        return hasattr(meta_module.instance, 'streaming_execute_module')
+
     def request_auto_execute_network(self, module_instance):
         """Method that can be called by an interaction/view module to
         indicate that some action by the user should result in a network
@@ -1544,6 +1941,28 @@ class ModuleManager:
         return meta_module
         
 
+    def prepare_module_execution(self, meta_module, part=0):
+        """Called by the scheduler right before it executes a module part
+        that requires execution.
+
+        If a memory budget is active, this makes sure that inputs that
+        have been released are recomputed and transferred again.
+        """
+
+        if self.memory_budget is not None:
+            self.memory_budget.ensure_inputs_available(meta_module, part)
+
+    def finish_module_execution(self, meta_module, part=0):
+        """Called by the scheduler right after it has executed a module
+        part.
+
+        If a memory budget is active, this records the sizes of the new
+        outputs and releases intermediate outputs when over budget.
+        """
+
+        if self.memory_budget is not None:
+            self.memory_budget.track_outputs(meta_module, part)
+
     def should_execute_module(self, meta_module, part=0):
 
         """Determine whether module_instance requires execution to become
@@ -1620,6 +2039,8 @@ class ModuleManager:
         # double check that this connection already exists
 
         consumer_instance = consumer_meta_module.instance
+        profile_token = self.profiler.start_transfer()
+
         if meta_module.findConsumerInOutputConnections(
             output_idx, consumer_instance, consumer_input_idx) == -1:
 
@@ -1627,8 +2048,10 @@ class ModuleManager:
                   'connection that does not exist.'
         
         try:
-            # get data from producerModule output
-            od = meta_module.instance.get_output(output_idx)
+            # get data from producerModule output; this goes via the
+            # MetaModule so that outputs restored from the output cache
+            # are used
+            od = meta_module.get_output(output_idx)
 
         except Exception, e:
             # get details about the errored module
@@ -1681,6 +2104,16 @@ class ModuleManager:
             output_idx, consumer_instance, consumer_input_idx,
             streaming)
 
+        # keep track of what the consumer has, so that the memory budget
+        # can release it
+        conn = (output_idx, consumer_instance, consumer_input_idx)
+        meta_module.transferred_outputs[conn] = od
+        meta_module.released_transfers.pop(conn, None)
+
+        self.profiler.finish_transfer(
+            profile_token, meta_module, output_idx,
+            consumer_meta_module, consumer_input_idx)
+
         # also invalidate the consumerModule: it should re-execute when
         # a transfer has been made.  We only invalidate the part that
         # takes responsibility for that input.
@@ -3,12 +3,20 @@
 # See COPYRIGHT for details.
 
 from module_base import ModuleBase
-from module_mixins import NoConfigModuleMixin
+from module_mixins import ScriptedConfigModuleMixin
 import module_utils
 import vtk
+from vtk.util import numpy_support
 import numpy
 
-class FitEllipsoidToMask(NoConfigModuleMixin, ModuleBase):
+# number of voxels that is processed at once
+SLAB_VOXELS = 2**22
+
+SUBSAMPLE_NONE = 0
+SUBSAMPLE_STRIDED = 1
+SUBSAMPLE_RANDOM = 2
+
+class FitEllipsoidToMask(ScriptedConfigModuleMixin, ModuleBase):
     def __init__(self, module_manager):
         # initialise our base class
         ModuleBase.__init__(self, module_manager)
@@ -16,17 +24,32 @@ class FitEllipsoidToMask(NoConfigModuleMixin, ModuleBase):
         self._input_data = None
         self._output_dict = {}
 
-        # polydata pipeline to make crosshairs
-        self._ls1 = vtk.vtkLineSource()
-        self._ls2 = vtk.vtkLineSource()
-        self._ls3 = vtk.vtkLineSource()
-        self._append_pd = vtk.vtkAppendPolyData()
-        self._append_pd.AddInput(self._ls1.GetOutput())
-        self._append_pd.AddInput(self._ls2.GetOutput())
-        self._append_pd.AddInput(self._ls3.GetOutput())
+        self._config.subsample_mode = SUBSAMPLE_NONE
+        self._config.subsample_stride = 2
+        self._config.subsample_fraction = 0.1
+        self._config.per_label = False
+
+        config_list = [
+            ('Subsampling:', 'subsample_mode', 'base:int', 'choice',
+             'Use only a subset of the mask points for the fit.  Strided '
+             'takes every n-th voxel along each axis, random takes a '
+             'random (but reproducible) fraction of the mask points.',
+             ('none', 'strided', 'random')),
+            ('Stride:', 'subsample_stride', 'base:int', 'text',
+             'Voxel stride along each axis for strided subsampling.'),
+            ('Random fraction:', 'subsample_fraction', 'base:float', 'text',
+             'Fraction of mask points used for random subsampling.'),
+            ('Fit per label', 'per_label', 'base:bool', 'checkbox',
+             'Fit a separate ellipsoid to every distinct value in the '
+             'mask.  The results are stored per label under the labels '
+             'key of the output dictionary.')]
+
+        # polydata with crosshairs
+        self._crosshairs = vtk.vtkPolyData()
 
-        NoConfigModuleMixin.__init__(
-            self, {'Module (self)' : self})
+        ScriptedConfigModuleMixin.__init__(
+            self, config_list,
+            {'Module (self)' : self})
 
         self.sync_module_logic_with_config()
 
@@ -37,7 +60,10 @@ class FitEllipsoidToMask(NoConfigModuleMixin, ModuleBase):
             self.set_input(input_idx, None)
 
         # this will take care of all display thingies
-        NoConfigModuleMixin.close(self)
+        ScriptedConfigModuleMixin.close(self)
+        ModuleBase.close(self)
+
+        del self._crosshairs
         
     def get_input_descriptions(self):
         return ('VTK image data',)
@@ -52,73 +78,211 @@ class FitEllipsoidToMask(NoConfigModuleMixin, ModuleBase):
         if idx == 0:
             return self._output_dict
         else:
-            return self._append_pd.GetOutput()
+            return self._crosshairs
+
+    def config_to_logic(self):
+        self._config.subsample_stride = max(1, self._config.subsample_stride)
+        self._config.subsample_fraction = min(
+            max(self._config.subsample_fraction, 0.0), 1.0)
+
+    def logic_to_config(self):
+        pass
 
     def execute_module(self):
         ii = self._input_data
         if not ii:
             return
 
-        # now we need to iterate through the whole input data
         ii.Update()
 
-        iorigin = ii.GetOrigin()
-        ispacing = ii.GetSpacing()
-        maxx, maxy, maxz = ii.GetDimensions()
-
-        numpoints = 0
-        points = []
-        for z in range(maxz):
-            wz = z * ispacing[2] + iorigin[2]
-            for y in range(maxy):
-                wy = y * ispacing[1] + iorigin[1]
-                for x in range(maxx):
-                    v = ii.GetScalarComponentAsDouble(x,y,z,0)
-                    if v > 0.0:
-                        wx = x * ispacing[0] + iorigin[0]
-                        points.append((wx,wy,wz))
-                
-        # covariance matrix ##############################
-
-        if len(points) == 0:
-            self._output_dict.update({'u' : None, 'v' : None, 'c' : None,
-                                      'axis_lengths' : None,
-                                      'radius_vectors' : None})
-            return
+        labels, moments = self._get_moments(ii)
 
-        # determine centre (x,y,z)
-        points2 = numpy.array(points)
-        centre = numpy.average(points2, 0)
-        cx,cy,cz = centre
-        
-        # subtract centre from all points
-        points_c = points2 - centre
-        
-        covariance = numpy.cov(points_c.transpose())
-
-        # eigen-analysis (u eigenvalues, v eigenvectors)
-        u,v = numpy.linalg.eig(covariance)
-
-        # estimate length at 2.0 * standard deviation in both directions
-        axis_lengths = [4.0 * numpy.sqrt(eigval) for eigval in u]
-
-        radius_vectors = numpy.zeros((3,3), float)
-        for i in range(3):
-            radius_vectors[i] = v[i] * axis_lengths[i] / 2.0
-            
-        self._output_dict.update({'u' :u, 'v' : v, 'c' : (cx,cy,cz),
-                                  'axis_lengths' : tuple(axis_lengths),
-                                  'radius_vectors' : radius_vectors})
-
-        # now modify output polydata #########################
-        lss = [self._ls1, self._ls2, self._ls3]
-        for i in range(len(lss)):
-            half_axis = radius_vectors[i] #axis_lengths[i] / 2.0 * v[i]
-            ca = numpy.array((cx,cy,cz))
-            lss[i].SetPoint1(ca - half_axis)
-            lss[i].SetPoint2(ca + half_axis)
-
-        self._append_pd.Update()
+        # moments are in voxel index space, fit_ellipsoid converts to world
+        # space: w = origin + spacing * (extent_min + i)
+        spacing = numpy.array(ii.GetSpacing(), float)
+        offset = numpy.array(ii.GetOrigin(), float) + \
+                 spacing * numpy.array(ii.GetExtent()[0::2], float)
+
+        # the fit to all 'on' points is the fit to the sum of the moments
+        # of all labels
+        fit = fit_ellipsoid(moments.sum(0), spacing, offset)
+        self._output_dict.clear()
+        self._output_dict.update(fit)
+
+        fits = [fit]
+        if self._config.per_label:
+            self._output_dict['labels'] = label_fits = {}
+            fits = []
+            for label, label_moments in zip(labels, moments):
+                label_fits[label] = fit_ellipsoid(
+                    label_moments, spacing, offset)
+                fits.append(label_fits[label])
+
+        self._update_crosshairs(fits)
+
+    def _get_moments(self, ii):
+        """Scan mask ii for 'on' (> 0) voxels and accumulate the moments
+        of their voxel index coordinates.
+
+        The scalars are accessed as a numpy view and processed in slabs
+        of z slices, so that memory use does not depend on the size of
+        the mask.  Moments are accumulated per distinct label, or for all
+        'on' voxels together if per_label is off.
+
+        @return: list of labels and array with a row of moments (see
+        L{fit_ellipsoid}) per label.
+        """
+
+        x0, x1, y0, y1, z0, z1 = ii.GetExtent()
+        shape = (z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1)
+        scalars = ii.GetPointData().GetScalars()
+        if scalars is None or shape[0] <= 0 or shape[1] <= 0 or \
+           shape[2] <= 0:
+            return [], numpy.zeros((1, 10))
+
+        volume = numpy_support.vtk_to_numpy(scalars)
+        if volume.ndim == 2:
+            # only the first component is used
+            volume = volume[:,0]
+
+        volume = volume.reshape(shape)
+
+        stride = 1
+        if self._config.subsample_mode == SUBSAMPLE_STRIDED:
+            stride = self._config.subsample_stride
+            volume = volume[::stride,::stride,::stride]
+
+        random_state = None
+        if self._config.subsample_mode == SUBSAMPLE_RANDOM:
+            # fixed seed, so that fits are reproducible
+            random_state = numpy.random.RandomState(0)
+
+        ny, nx = volume.shape[1:]
+        slab = max(1, SLAB_VOXELS / (ny * nx))
+
+        label_index = {}
+        moments = []
+        for k0 in range(0, volume.shape[0], slab):
+            vslab = volume[k0:k0+slab]
+            on = numpy.flatnonzero(vslab > 0)
+            if random_state is not None:
+                on = on[random_state.random_sample(len(on)) <
+                        self._config.subsample_fraction]
+
+            if len(on) == 0:
+                continue
+
+            # index coordinates of the 'on' voxels in this slab
+            z, yx = divmod(on, ny * nx)
+            y, x = divmod(yx, nx)
+            coords = numpy.array((x, y, z + k0), float) * stride
+
+            if self._config.per_label:
+                slab_labels, inverse = numpy.unique(
+                    vslab.ravel()[on], return_inverse=True)
+                slab_labels = slab_labels.tolist()
+            else:
+                slab_labels, inverse = [1], numpy.zeros(len(on), int)
+
+            slab_moments = numpy.zeros((len(slab_labels), 10))
+            slab_moments[:,0] = numpy.bincount(inverse)
+            mi = 1
+            for a in range(3):
+                slab_moments[:,mi] = numpy.bincount(inverse, coords[a])
+                mi += 1
+
+            for a in range(3):
+                for b in range(a, 3):
+                    slab_moments[:,mi] = numpy.bincount(
+                        inverse, coords[a] * coords[b])
+                    mi += 1
+
+            for label, m in zip(slab_labels, slab_moments):
+                if label not in label_index:
+                    label_index[label] = len(moments)
+                    moments.append(numpy.zeros(10))
+
+                moments[label_index[label]] += m
+
+            self._module_manager.set_progress(
+                100.0 * min(k0 + slab, volume.shape[0]) / volume.shape[0],
+                'Scanning mask.')
+
+        labels = label_index.keys()
+        labels.sort()
+        if not labels:
+            return [], numpy.zeros((1, 10))
+
+        moments = numpy.array([moments[label_index[l]] for l in labels])
+        return labels, moments
+
+    def _update_crosshairs(self, fits):
+        points = vtk.vtkPoints()
+        lines = vtk.vtkCellArray()
+        for fit in fits:
+            if fit['c'] is None:
+                continue
+
+            ca = numpy.array(fit['c'])
+            for half_axis in fit['radius_vectors']:
+                lines.InsertNextCell(2)
+                lines.InsertCellPoint(points.InsertNextPoint(ca - half_axis))
+                lines.InsertCellPoint(points.InsertNextPoint(ca + half_axis))
+
+        self._crosshairs.Initialize()
+        self._crosshairs.SetPoints(points)
+        self._crosshairs.SetLines(lines)
+        self._crosshairs.Modified()
+
+def fit_ellipsoid(moments, spacing=(1.0,1.0,1.0), offset=(0.0,0.0,0.0)):
+    """Fit ellipsoid to points with the given moments by eigen-analysis
+    of their covariance matrix.
+
+    The moments are of voxel index coordinates i.  The fit is done in
+    world coordinates offset + spacing * i.
+
+    @param moments: sequence with number of points, the sums of x, y and
+    z and the sums of xx, xy, xz, yy, yz and zz.
+    @return: dictionary with eigenvalues (u), eigenvectors (v), centre
+    (c), axis_lengths and radius_vectors.  All are None if there are no
+    points.
+    """
+
+    n = moments[0]
+    if n == 0:
+        return {'u' : None, 'v' : None, 'c' : None,
+                'axis_lengths' : None, 'radius_vectors' : None}
+
+    centre = numpy.array(moments[1:4], float) / n
+    sums = numpy.zeros((3,3), float)
+    mi = 4
+    for a in range(3):
+        for b in range(a, 3):
+            sums[a,b] = sums[b,a] = moments[mi]
+            mi += 1
+
+    # unbiased estimate, same as numpy.cov
+    covariance = (sums - n * numpy.outer(centre, centre)) / max(n - 1, 1)
+
+    # to world space
+    spacing = numpy.asarray(spacing, float)
+    centre = numpy.asarray(offset, float) + spacing * centre
+    covariance *= numpy.outer(spacing, spacing)
+
+    # eigen-analysis (u eigenvalues, v eigenvectors)
+    u,v = numpy.linalg.eig(covariance)
+
+    # estimate length at 2.0 * standard deviation in both directions;
+    # rounding can make eigenvalues of flat point sets slightly negative
+    axis_lengths = [4.0 * numpy.sqrt(max(eigval, 0.0)) for eigval in u]
+
+    radius_vectors = numpy.zeros((3,3), float)
+    for i in range(3):
+        radius_vectors[i] = v[i] * axis_lengths[i] / 2.0
+
+    return {'u' :u, 'v' : v, 'c' : tuple(centre),
+            'axis_lengths' : tuple(axis_lengths),
+            'radius_vectors' : radius_vectors}
         
 def pca(points):
     """PCA factored out of execute_module and made N-D.  not being used yet.
@@ -50,7 +50,7 @@ class decimate:
     """
 
 class DICOMAligner:
-    kits = ['vtk_kit', 'wx_kit']
+    kits = ['vtk_kit', 'wx_kit', 'itk_kit']
     cats = ['DICOM','Filters']
     keywords = ['align','reslice','rotate','orientation','dicom']
     help = """Aligns a vtkImageData volume (as read from DICOM) to the 
@@ -141,6 +141,12 @@ class FitEllipsoidToMask:
 
     Returns dictionary with eigen values in 'u', eigen vectors in 'v' and
     world coordinates centroid of 'on' points.
+
+    The mask is scanned as a NumPy array in slabs.  Optionally, only a
+    strided or random subset of the 'on' points is used, which is
+    usually accurate enough for large masks.  With 'Fit per label', an
+    ellipsoid is fitted to every distinct mask value in the same pass;
+    these fits are available per label under the 'labels' key.
     """
 
 class glyphs:
@@ -500,7 +506,7 @@ class transformVolumeData:
     """
 
 class ExpVolumeRender:
-    kits = ['vtk_kit']
+    kits = ['vtk_kit', 'vtktudoss_kit']
     cats = ['Volume Rendering']
     help = """EXPERIMENTAL Volume Render.
 
@@ -2,10 +2,10 @@
 # All rights reserved.
 # See COPYRIGHT for details.
 
-import itk
 import module_kits.itk_kit as itk_kit
 from module_base import ModuleBase
 from module_mixins import NoConfigModuleMixin
+from module_kits.numpy_kit import bridge
 import vtk
 
 class ITKtoVTK(NoConfigModuleMixin, ModuleBase):
@@ -19,12 +19,14 @@ class ITKtoVTK(NoConfigModuleMixin, ModuleBase):
 
 
         self._input = None
-        self._itk2vtk = None
+        # the VTK output shares the buffer of the ITK image, the bridge
+        # caches a converter per ITK image type.
+        self._bridge = bridge.ImageBridge()
+        self._output = None
 
         NoConfigModuleMixin.__init__(
             self,
-            {'Module (self)' : self,
-             'ImageToVTKImageFilter' : self._itk2vtk})
+            {'Module (self)' : self})
 
         self.sync_module_logic_with_config()
 
@@ -39,42 +41,40 @@ class ITKtoVTK(NoConfigModuleMixin, ModuleBase):
 
         ModuleBase.close(self)
 
-        del self._itk2vtk
+        self._bridge.close()
+        del self._bridge
+        del self._output
+
+    def _convert(self, convert_function):
+        try:
+            itk_kit.utils.get_img_type_and_dim_shortstring(
+                self._input)
+
+        except TypeError:
+            raise TypeError, 'ITKtoVTK requires an ITK image as input.'
+
+        try:
+            self._output = convert_function(self._input)
+
+        except TypeError, e:
+            raise RuntimeError, 'Unable to convert to VTK: %s' % \
+                  (str(e),)
 
     def execute_module(self):
         if self._input:
+            self._convert(self._bridge.itk_to_vtk)
 
-            try:
-                shortstring = itk_kit.utils.get_img_type_and_dim_shortstring(
-                    self._input)
-                
-            except TypeError:
-                raise TypeError, 'ITKtoVTK requires an ITK image as input.'
-            
-            witk_template = getattr(itk, 'ImageToVTKImageFilter')
-            witk_type = getattr(itk.Image, shortstring)
-
-            try:
-                self._itk2vtk = witk_template[witk_type].New()
-                
-            except KeyError, e:
-                raise RuntimeError, 'Unable to instantiate ITK to VTK ' \
-                      'converter with type %s.' % \
-                      (shortstring,)
-            
-            else:
-                self._input.UpdateOutputInformation()
-                self._input.SetBufferedRegion(
-                    self._input.GetLargestPossibleRegion())
-                self._input.Update()
-
-                itk_kit.utils.setupITKObjectProgress(
-                    self, self._itk2vtk,
-                    'ImageToVTKImageFilter',
-                    'Converting ITK image to VTK image.')
-                
-                self._itk2vtk.SetInput(self._input)
-                self._itk2vtk.Update()
+    def streaming_connect_module(self):
+        # we're in the middle of a streamable subset: only connect, so
+        # that the update extents requested by our VTK consumers become
+        # requested regions of our ITK input
+        if self._input:
+            self._convert(self._bridge.connect_itk_to_vtk)
+
+    def streaming_execute_module(self):
+        # we terminate a streamable subset, so our consumers need the
+        # complete image
+        self.execute_module()
 
     def get_input_descriptions(self):
         return ('ITK Image',)
@@ -86,10 +86,7 @@ class ITKtoVTK(NoConfigModuleMixin, ModuleBase):
         return ('VTK Image Data',)
 
     def get_output(self, idx):
-        if self._itk2vtk is not None:
-            return self._itk2vtk.GetOutput()
-        else:
-            return None
+        return self._output
 
     def logic_to_config(self):
         # important so that ModuleManager doesn't think our state has changed
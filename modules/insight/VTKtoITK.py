@@ -2,12 +2,21 @@
 # All rights reserved.
 # See COPYRIGHT for details.
 
-import itk
 import module_kits.itk_kit as itk_kit
 from module_base import ModuleBase
 from module_mixins import ScriptedConfigModuleMixin
+from module_kits.numpy_kit import bridge
 import vtk
 
+# maps from the data type choices to VTK scalar types
+TYPE_TO_VTK_TYPE = {
+        'float' : vtk.VTK_FLOAT,
+        'signed short' : vtk.VTK_SHORT,
+        'unsigned short' : vtk.VTK_UNSIGNED_SHORT,
+        'unsigned char' : vtk.VTK_UNSIGNED_CHAR,
+        'unsigned long' : vtk.VTK_UNSIGNED_LONG
+        }
+
 class VTKtoITK(ScriptedConfigModuleMixin, ModuleBase):
 
     def __init__(self, module_manager):
@@ -15,11 +24,10 @@ class VTKtoITK(ScriptedConfigModuleMixin, ModuleBase):
 
         self._input = None
 
-        self._image_cast = vtk.vtkImageCast()
-        self._vtk2itk = None
-        # this stores the short_string of the current converter, e.g.
-        # F3 or US3, etc.
-        self._vtk2itk_short_string = None
+        # the bridge shares the VTK buffer with the ITK image, unless
+        # we have to cast.  It caches a converter per ITK image type.
+        self._bridge = bridge.ImageBridge(self._handler_copy)
+        self._output = None
 
         self._config.autotype = False
         # this will store the current type as full text, e.g. "unsigned char"
@@ -50,86 +58,51 @@ class VTKtoITK(ScriptedConfigModuleMixin, ModuleBase):
         # and the baseclass close
         ModuleBase.close(self)
             
-        del self._image_cast
-        del self._vtk2itk
+        self._bridge.close()
+        del self._bridge
+        del self._output
+
+    def _convert(self, convert_function):
+        try:
+            is_image = self._input.IsA('vtkImageData')
+        except AttributeError:
+            is_image = False
+
+        if not is_image:
+            raise TypeError, 'VTKtoITK requires VTK image data as input.'
+
+        if self._config.autotype:
+            # no cast, output type is input type
+            output_type = None
+
+        else:
+            output_type = TYPE_TO_VTK_TYPE[self._config.type]
+
+        try:
+            self._output = convert_function(self._input, output_type)
+        except TypeError, e:
+            raise RuntimeError, 'Unable to convert to ITK: %s' % \
+                  (str(e),)
 
     def execute_module(self):
         if self._input:
+            self._convert(self._bridge.vtk_to_itk)
+
+    def streaming_connect_module(self):
+        # we're in the middle of a streamable subset: only connect, so
+        # that the regions requested by our ITK consumers are pulled
+        # through our VTK input
+        if self._input:
+            self._convert(self._bridge.connect_vtk_to_itk)
 
-            # calculate input type
-            try:
-                self._input.Update()                
-                if self._input.IsA('vtkImageData'):
-                    input_type = self._input.GetScalarTypeAsString()
-            except AttributeError:
-                raise TypeError, 'VTKtoITK requires VTK image data as input.'
-
-            # input_type is a text repr, e.g. 'float' or 'unsigned char'
-
-            # now calculate output type
-            if self._config.autotype:
-                output_type = input_type
-
-            else:
-                # this is also just a text description
-                output_type = self._config.type
-
-            dims = self._input.GetDataDimension()
-
-            # create shortstring (e.g. US3, SS2)
-            short_string_type = ''.join([i[0].upper()
-                                         for i in output_type.split()])
-            if short_string_type == 'S':
-                short_string_type = 'SS'
-
-
-            if short_string_type.startswith('V'):
-                short_string = '%s%s%s' % (short_string_type, dims,
-                        dims)
-            else:
-                short_string = '%s%s' % (short_string_type, dims)
-
-
-            # we could cache this as shown below, but experience shows
-            # that the connection module often gets confused when its
-            # input data remains the same w.r.t. type, but changes in
-            # extent for instance.
-            #if short_string != self._vtk2itk_short_string:
-            self._vtk2itk = itk.VTKImageToImageFilter[
-                getattr(itk.Image, short_string)].New()
-            self._vtk2itk_short_string = short_string
-                
-            if output_type == input_type:
-                # we don't need the cast
-                self._vtk2itk.SetInput(self._input)
-                
-            else:
-                # we do need the cast
-                self._image_cast.SetInput(self._input)
-
-                # turn unsigned char into UnsignedChar, but signed
-                # short into Short.
-                # output_type is e.g. "signed short"
-                # first break the list up, capitalise first letters
-                captsl = ['%s%s' % (i[0].upper(), i[1:]) 
-                         for i in output_type.split()]
-                # however, VTK doesn't have the Signed bit! (so we
-                # just want "Short")
-                if captsl[0] == "Signed":
-                    del captsl[0]
-                # then join them together
-                vtk_type_string = ''.join(captsl)
-                # cast function
-                cast_function = getattr(
-                    self._image_cast,
-                    'SetOutputScalarTypeTo%s' % (vtk_type_string,))
-                
-                cast_function()
-
-                # and connect it up
-                self._vtk2itk.SetInput(self._image_cast.GetOutput())
-
-        self._vtk2itk.Update()
+    def streaming_execute_module(self):
+        # we terminate a streamable subset, so our consumers need the
+        # complete image
+        self.execute_module()
+
+    def _handler_copy(self, reason):
+        self._module_manager.log_info(
+            'VTKtoITK has to copy its input: %s' % (reason,))
 
     def get_input_descriptions(self):
         return ('VTK Image Data',)
@@ -141,10 +114,7 @@ class VTKtoITK(ScriptedConfigModuleMixin, ModuleBase):
         return ('ITK Image (3D',)
 
     def get_output(self, idx):
-        if self._vtk2itk:
-            return self._vtk2itk.GetOutput()
-        else:
-            return None
+        return self._output
 
     def logic_to_config(self):
         return False
@@ -57,9 +57,17 @@ class curvatureFlowDenoising(ScriptedConfigModuleMixin, ModuleBase):
         del self._cfif
 
     def execute_module(self):
-        self._cfif.Update()
+        # after streaming, the requested region could still be the
+        # last piece
+        self._cfif.UpdateLargestPossibleRegion()
         self._module_manager.setProgress(100, "Denoising data [DONE]")
 
+    def streaming_execute_module(self):
+        # we only get here if we terminate a streamable subset.  In the
+        # middle of a subset, the filter requests input regions padded
+        # by its stencil radius times the number of iterations.
+        self.execute_module()
+
     def get_input_descriptions(self):
         return ('ITK Image (3D, float)',)
 
@@ -65,7 +65,16 @@ class gaussianConvolve(ScriptedConfigModuleMixin, ModuleBase):
         del self._gaussian
 
     def execute_module(self):
-        self._gaussian.Update()
+        # after streaming, the requested region could still be the
+        # last piece
+        self._gaussian.UpdateLargestPossibleRegion()
+
+    def streaming_execute_module(self):
+        # we only get here if we terminate a streamable subset.  In the
+        # middle of a subset, the recursive filter requests the whole
+        # extent along its direction for each piece, so this only saves
+        # memory when the pieces are split along the other axes.
+        self.execute_module()
 
     def get_input_descriptions(self):
         return ('ITK Image (3D, float)',)
@@ -50,8 +50,15 @@ class gradientMagnitudeGaussian(ScriptedConfigModuleMixin, ModuleBase):
         # remove all bindings
         del self._gradientMagnitude
 
+    # There is deliberately no streaming_execute_module: the recursive
+    # (IIR) Gaussian runs along every axis, so ITK enlarges the requested
+    # region of every piece to the whole image.  Streaming would pull the
+    # complete volume once per piece without saving any memory.
+
     def execute_module(self):
-        self._gradientMagnitude.Update()
+        # after streaming upstream, the requested region could still be
+        # the last piece
+        self._gradientMagnitude.UpdateLargestPossibleRegion()
 
     def get_input_descriptions(self):
         return ('ITK Image (3D, float)',)
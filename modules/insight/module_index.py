@@ -3,20 +3,29 @@
 # See COPYRIGHT for details.
 
 class ITKtoVTK:
-    kits = ['itk_kit']
+    kits = ['itk_kit', 'numpy_kit']
     cats = ['Insight']
     help = """Use this module to convert from any ITK image type to
     the corresponding VTK type.
+
+    The VTK image shares its buffer with the ITK image, so the
+    conversion does not copy any data.  In hybrid scheduling mode, this
+    module streams, so that VTK-ITK-VTK chains of streamable modules can
+    process large images piece by piece.
     """
 
 class VTKtoITK:
-    kits = ['itk_kit']
+    kits = ['itk_kit', 'numpy_kit']
     cats = ['Insight']
     help = """Convert from a VTK image to an ITK image.
 
     By default (AutoType active), the output ITK image has the same pixel
     type as the input VTK image.  However, if AutoType has been unchecked
     in the configuration, the output ITK image has 'Data type' as its type.
+
+    Without a cast, the ITK image shares its buffer with the VTK image.
+    If the data has to be cast, it is copied and this is reported in the
+    log window.  In hybrid scheduling mode, this module streams.
     """
     
 class cannyEdgeDetection:
@@ -136,7 +145,9 @@ class gaussianConvolve:
     Only a single dimension is convolved (i.e. the filter is separated).
     Select which dimension in the View/Config window.
 
-    The convolution is implemented as an IIR filter.
+    The convolution is implemented as an IIR filter.  In hybrid
+    scheduling mode, this module streams, but every piece needs the
+    whole image along the convolution direction.
 
     $Revision: 1.4 $
     """
@@ -178,7 +189,8 @@ class gradientMagnitudeGaussian:
     derivative of a Gaussian.
 
     The ITK class that this is based on uses a recursive gaussian filter
-    implementation.
+    implementation.  As this needs the whole image for every output
+    voxel, the module does not stream.
     """
 
 # isn't wrapped anymore, no idea why.
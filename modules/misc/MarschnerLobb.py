@@ -5,11 +5,20 @@
 from module_base import ModuleBase
 from module_mixins import ScriptedConfigModuleMixin
 import module_utils
+import numpy
 import vtk
-import math
+from vtk.util import numpy_support
 
 
 class MarschnerLobb(ScriptedConfigModuleMixin, ModuleBase):
+    """Samples the Marschner-Lobb function on demand.
+
+    The output comes from a vtkProgrammableSource that announces the
+    whole extent of the volume, but only samples the update extent that
+    is requested downstream.  When a consumer streams, e.g. under the
+    hybrid scheduler, the full volume is never allocated.
+    """
+
     def __init__(self, module_manager):
         ModuleBase.__init__(self, module_manager)
 
@@ -23,19 +32,16 @@ class MarschnerLobb(ScriptedConfigModuleMixin, ModuleBase):
              'According to the article, should be 40 to be '
              'at Nyquist.')]
 
-        # now create the necessary VTK modules
-        self._es = vtk.vtkImageEllipsoidSource()
-        self._es.SetOutputScalarTypeToFloat()
-
-        self._ic = vtk.vtkImageChangeInformation()
-        self._ic.SetInputConnection(self._es.GetOutputPort())
-
-        self._output = vtk.vtkImageData()
+        self._source = vtk.vtkProgrammableSource()
+        self._source.SetRequestInformationMethod(
+            self._source_request_information)
+        self._source.SetExecuteMethod(self._source_execute)
 
         # mixin ctor
         ScriptedConfigModuleMixin.__init__(
             self, configList,
-            {'Module (self)' : self})
+            {'Module (self)' : self,
+             'vtkProgrammableSource' : self._source})
 
         self.sync_module_logic_with_config()
 
@@ -51,44 +57,83 @@ class MarschnerLobb(ScriptedConfigModuleMixin, ModuleBase):
         ModuleBase.close(self)
             
         # remove all bindings
-        del self._es
-        del self._ic
-        
-    def execute_module(self):
+        del self._source
+
+    def _get_spacing(self):
+        return 2.0 / (self._config.resolution - 1)
+
+    def _source_request_information(self):
         e = self._config.resolution
-        self._es.SetWholeExtent(0,e-1,0,e-1,0,e-1)
-        spc = 2.0 / (e - 1)
-        self._ic.SetOutputSpacing(spc, spc, spc)
-        self._ic.SetOutputOrigin(-1.0, -1.0, -1.0)
-        
-        self._ic.Update()
-        data = self._ic.GetOutput()
+        spc = self._get_spacing()
+
+        # structured points are output port 1 of vtkProgrammableSource
+        info = self._source.GetExecutive().GetOutputInformation(1)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT(),
+                 0, e - 1, 0, e - 1, 0, e - 1)
+        info.Set(vtk.vtkDataObject.SPACING(), spc, spc, spc)
+        info.Set(vtk.vtkDataObject.ORIGIN(), -1.0, -1.0, -1.0)
+        vtk.vtkDataObject.SetPointDataActiveScalarInfo(
+            info, vtk.VTK_FLOAT, 1)
+
+    def _source_execute(self):
+        e = self._config.resolution
+        spc = self._get_spacing()
+
+        data = self._source.GetStructuredPointsOutput()
+        x0, x1, y0, y1, z0, z1 = data.GetUpdateExtent()
+        data.SetExtent(x0, x1, y0, y1, z0, z1)
+        data.SetSpacing(spc, spc, spc)
+        data.SetOrigin(-1.0, -1.0, -1.0)
+        data.SetScalarTypeToFloat()
+        data.SetNumberOfScalarComponents(1)
+        data.AllocateScalars()
+
+        if x1 < x0 or y1 < y0 or z1 < z0:
+            # empty update extent
+            return
+
+        # numpy view on the VTK scalars, so we write the samples straight
+        # into the output without any copies.  VTK arrays are x-fastest,
+        # hence the (z,y,x) shape.
+        scalars = numpy_support.vtk_to_numpy(
+            data.GetPointData().GetScalars())
+        volume = scalars.reshape((z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1))
 
         fm = 6
         alpha = 0.25
         topa = 2.0 * (1.0 + alpha)
 
-        dimx,dimy,dimz = data.GetDimensions()
-        dx,dy,dz = data.GetSpacing()
-        ox,oy,oz = data.GetOrigin()
-        progress = 0.0
-        pinc = 100.0 / dimz 
-        for k in range(dimz):
-            z = oz + k * dz
-            for j in range(dimy):
-                y = oy + j * dy
-                for i in range(dimx):
-                    x = ox + i * dx
-                    rho_r = math.cos(2 * math.pi * fm * 
-                        math.cos(math.pi * math.hypot(x,y) / 2.0))
-                    rho = (1.0 - math.sin(math.pi * z / 2.0) + alpha * 
-                        (1.0 + rho_r)) / topa
-                    data.SetScalarComponentFromDouble(i,j,k,0,rho)
-
-            progress += pinc
-            self._module_manager.set_progress(progress, 'Sampling function.')
-
-        self._output.ShallowCopy(data)
+        # sample coordinates along each axis; all axes are the same
+        c = -1.0 + numpy.arange(e) * spc
+
+        # the function is the sum of a term depending only on z and a
+        # term depending only on x and y:
+        # rho = (1 - sin(pi z / 2) + alpha (1 + rho_r(x,y))) / topa
+        x = c[numpy.newaxis,x0:x1 + 1]
+        y = c[y0:y1 + 1,numpy.newaxis]
+        rho_r = numpy.cos(2 * numpy.pi * fm *
+                          numpy.cos(numpy.pi * numpy.hypot(x, y) / 2.0))
+        xy_term = alpha * (1.0 + rho_r) / topa
+        z_term = (1.0 - numpy.sin(numpy.pi * c[z0:z1 + 1] / 2.0)) / topa
+
+        # a single broadcast addition into the output, so the only
+        # temporaries are the terms above, whatever the extent.
+        numpy.add(z_term[:,numpy.newaxis,numpy.newaxis],
+                  xy_term[numpy.newaxis,:,:], volume)
+
+        self._module_manager.set_progress(
+            100.0 * (z1 + 1) / e, 'Sampling function.')
+
+    def execute_module(self):
+        self._source.UpdateInformation()
+        self._source.GetStructuredPointsOutput().\
+                SetUpdateExtentToWholeExtent()
+        self._source.Update()
+
+    def streaming_execute_module(self):
+        # only reached when nothing streams from us, so we also produce
+        # the whole volume
+        self.execute_module()
 
     def get_input_descriptions(self):
         return ()
@@ -100,10 +145,11 @@ class MarschnerLobb(ScriptedConfigModuleMixin, ModuleBase):
         return ('Marschner-Lobb volume',)
     
     def get_output(self, idx):
-        return self._output
+        return self._source.GetStructuredPointsOutput()
 
     def config_to_logic(self):
-        pass
+        # the whole extent depends on the resolution
+        self._source.Modified()
 
     def logic_to_config(self):
         pass
@@ -58,17 +58,20 @@ class manualTransform:
     """
 
 class MarschnerLobb:
-    kits = ['vtk_kit']
+    kits = ['vtk_kit', 'numpy_kit']
     cats = ['Sources']
-    help = """Pure Python filter to generate Marschner-Lobb test
-    volume.
+    help = """NumPy filter to generate Marschner-Lobb test volume.
 
     When resolution is left at the default value of 40, the generated
     volume should be at the Nyquist frequency of the signal (analytic
     function) that it has sampled.
 
-    Pure Python implementation: for the default resolution, takes a
-    second or two, 200 cubed takes about 20 seconds on Core2 hardware.
+    The function is sampled with whole-array NumPy operations directly
+    into the output image, so that apart from the output volume itself
+    hardly any memory is needed.  256 cubed takes well under a second.
+    Only the extent that is requested downstream is sampled, so when
+    the consumers stream, e.g. with the hybrid scheduler, volumes that
+    don't fit in memory can be generated piece by piece.
     """
 
 class PassThrough:
@@ -3,12 +3,13 @@
 # See COPYRIGHT for details.
 
 from module_base import ModuleBase
+from module_kits.gdcm_kit import utils as gdcm_utils
 from module_kits.misc_kit import misc_utils
 from module_mixins import \
      IntrospectModuleMixin
 import module_utils
 
-import gdcm
+import dicomreader_decode
 import vtk
 import vtkgdcm
 import wx
@@ -59,10 +60,23 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
 
         self._view_frame = None
         self._file_dialog = None
+        # identifies the files (and settings) that were last read
+        # successfully, so that we can skip sorting and reading if
+        # nothing has changed.
+        self._read_key = None
+        # numpy array with the scalars of the volume that was last
+        # decoded in parallel: the vtkImageData only points into it, so
+        # we have to keep it alive for as long as our output uses it.
+        self._decoded_volume = None
         self._config.dicom_filenames = []
         # if this is true, module will still try to load set even if
         # IPP sorting fails by sorting images alphabetically
         self._config.robust_spacing = False
+        # if this is true, slices are decoded in parallel by
+        # decode_processes worker processes (0 means one per CPU),
+        # which is much faster for compressed (e.g. JPEG2000) series.
+        self._config.parallel_decode = False
+        self._config.decode_processes = 0
 
         self.sync_module_logic_with_config()
 
@@ -81,6 +95,9 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
 
         del self._reader
 
+        # nothing downstream may use our output after this
+        self._decoded_volume = None
+
         ModuleBase.close(self) 
 
 
@@ -138,20 +155,36 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
         # have to  cast to normal strings (from unicode)
         filenames = [str(i) for i in self._config.dicom_filenames]
 
+        if len(filenames) == 0:
+            raise RuntimeError(
+                    'No DICOM filenames to read.')
+
+        # if we've already read exactly these files and they haven't
+        # changed, our output is still valid.
+        try:
+            read_key = (gdcm_utils.get_fingerprint(filenames),
+                        self._config.robust_spacing,
+                        self._config.parallel_decode)
+        except OSError, e:
+            raise RuntimeError('Could not read DICOM file: %s' % (str(e),))
+
+        if read_key == self._read_key:
+            return
+
+        self._read_key = None
+
         # make sure all is zeroed.
         self._reader.SetFileName(None)
         self._reader.SetFileNames(None)
 
         # we only sort and derive slice-based spacing if there are
         # more than 1 filenames
+        alpha_sorted = False
         if len(filenames) > 1:
-            sorter = gdcm.IPPSorter()
-            sorter.SetComputeZSpacing(True)
-            sorter.SetZSpacingTolerance(1e-2)
-
-            ret = sorter.Sort(filenames)
-            alpha_sorted = False
-            if not ret:
+            # this only reads the IPP and IOP tags, and the results
+            # are cached for unchanged files.
+            sort_result = gdcm_utils.sort_ipp(filenames, 1e-2)
+            if sort_result is None:
                 if self._config.robust_spacing:
                     self._module_manager.log_warning(
                         'Could not sort DICOM filenames by IPP. Doing alphabetical sorting.')
@@ -162,31 +195,44 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
                     raise RuntimeError(
                     'Could not sort DICOM filenames before loading.')
 
-            if sorter.GetZSpacing() == 0.0 and not alpha_sorted:
+            elif sort_result[1] == 0.0:
                 msg = 'DICOM IPP sorting yielded incorrect results.'
                 raise RuntimeError(msg)
 
-            # then give the reader the sorted list of files
-            sa = vtk.vtkStringArray()
             if alpha_sorted:
                 flist = filenames
             else:
-                flist = sorter.GetFilenames()
-                
-            for fn in flist: 
-                sa.InsertNextValue(fn)
+                flist, z_spacing, iop = sort_result
 
-            self._reader.SetFileNames(sa)
+        else:
+            flist = filenames
 
-        elif len(filenames) == 1:
-            self._reader.SetFileName(filenames[0])
+        decoded = None
+        if self._config.parallel_decode and len(flist) > 1:
+            decoded = self._decode_in_parallel(flist)
 
-        else:
-            raise RuntimeError(
-                    'No DICOM filenames to read.')
+        if decoded is None:
+            # then give the reader the sorted list of files
+            if len(flist) > 1:
+                sa = vtk.vtkStringArray()
+                for fn in flist: 
+                    sa.InsertNextValue(fn)
 
-        # now do the actual reading
-        self._reader.Update()
+                # parallel decoding could have set the first filename
+                self._reader.SetFileName(None)
+                self._reader.SetFileNames(sa)
+
+            else:
+                self._reader.SetFileName(flist[0])
+
+            # now do the actual reading
+            self._reader.Update()
+            self._ici.SetInputConnection(0, self._reader.GetOutputPort(0))
+
+        else:
+            # the reader has only read the first slice, but its meta
+            # data is valid for the whole series.
+            self._ici.SetInput(decoded[0])
 
         # see what the reader thinks the spacing is
         spacing = list(self._reader.GetDataSpacing())
@@ -196,7 +242,7 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
             # impose derived spacing on the vtkImageChangeInformation
             # (by default it takes the SpacingBetweenSlices, which is
             # not always correct)
-            spacing[2] = sorter.GetZSpacing()
+            spacing[2] = z_spacing
 
         # single or multiple filenames, we have to set the correct
         # output spacing on the image change information
@@ -204,6 +250,13 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
         self._ici.SetOutputSpacing(spacing)
         self._ici.Update()
 
+        # only now that our output has been updated from the new input
+        # can the previously decoded volume (if any) go.
+        if decoded is None:
+            self._decoded_volume = None
+        else:
+            self._decoded_volume = decoded[1]
+
 
         # integrate DirectionCosines into output data ###############
         # DirectionCosines: first two columns are X and Y in the LPH
@@ -244,6 +297,36 @@ class DICOMReader(IntrospectModuleMixin, ModuleBase):
 
             fd.AddArray(axis_labels_array)
 
+        self._read_key = read_key
+
+    def _decode_in_parallel(self, filenames):
+        """Decode sorted filenames into a volume with worker processes.
+
+        @return: (image, volume) tuple as returned by
+        L{dicomreader_decode.decode_slices}, or None if the slices have
+        to be read by the reader itself.
+        """
+
+        if not dicomreader_decode.can_decode_in_parallel():
+            self._module_manager.log_warning(
+                'Parallel DICOM decoding is not supported on this '
+                'platform.  Reading slices one by one.')
+            return None
+
+        def progress_callback(progress):
+            self._module_manager.set_progress(
+                progress, 'Decoding DICOM slices in parallel')
+
+        try:
+            return dicomreader_decode.decode_slices(
+                self._reader, filenames, self._config.decode_processes,
+                progress_callback)
+
+        except dicomreader_decode.DecodeException, e:
+            self._module_manager.log_warning(
+                'Could not decode DICOM slices in parallel: %s  '
+                'Reading slices one by one.' % (str(e),))
+            return None
         
 
     def _create_view_frame(self):
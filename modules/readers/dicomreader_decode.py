@@ -0,0 +1,181 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Parallel slice decoding for the DICOMReader.
+
+See the documentation of L{decode_slices}.
+"""
+
+import mmap
+import numpy
+import os
+import sys
+import vtk
+import vtkgdcm
+from vtk.util import numpy_support
+
+# shared volume buffer and its layout, set in the parent process before
+# the worker processes are forked, so that they inherit the mapping
+_volume_buffer = None
+_volume_layout = None
+
+class DecodeException(Exception):
+    pass
+
+def can_decode_in_parallel():
+    """Return True if this platform supports L{decode_slices}.
+    """
+
+    if os.name != 'posix' or hasattr(sys, 'frozen'):
+        # worker processes have to be forked to inherit the shared
+        # volume buffer
+        return False
+
+    try:
+        import multiprocessing
+    except ImportError:
+        return False
+
+    return True
+
+def _read_slice(filename):
+    # unlike the DICOMBrowser, the DICOMReader switches off the y-flip
+    r = vtkgdcm.vtkGDCMImageReader()
+    r.SetFileLowerLeft(1)
+    r.SetFileName(filename)
+    r.Update()
+    return r.GetOutput()
+
+def _decode_slices(tasks):
+    """Decode (slice index, filename) tasks into the shared volume
+    buffer.  This runs in the worker processes.
+
+    @return: number of decoded slices, or an error message.
+    """
+
+    dims, scalar_type, num_components = _volume_layout
+    dtype = numpy_support.get_numpy_array_type(scalar_type)
+    slice_len = dims[0] * dims[1] * num_components
+    slice_bytes = slice_len * numpy.dtype(dtype).itemsize
+
+    for idx, filename in tasks:
+        try:
+            image = _read_slice(filename)
+        except Exception, e:
+            return 'Could not read %s: %s' % (filename, str(e))
+
+        sdims = image.GetDimensions()
+        if (sdims[0], sdims[1], sdims[2]) != (dims[0], dims[1], 1) or \
+           image.GetScalarType() != scalar_type or \
+           image.GetNumberOfScalarComponents() != num_components:
+            return '%s does not match the first slice.' % (filename,)
+
+        target = numpy.frombuffer(_volume_buffer, dtype, slice_len,
+                                  idx * slice_bytes)
+        target[:] = numpy_support.vtk_to_numpy(
+            image.GetPointData().GetScalars()).ravel()
+
+    return len(tasks)
+
+def decode_slices(reader, filenames, num_processes=0,
+                  progress_callback=None):
+    """Decode the single-frame DICOM files in filenames, which are
+    already sorted, into one volume, using a pool of worker processes.
+
+    The first file is decoded in this process with reader, which also
+    gives the caller the meta data of the series, to determine the slice
+    layout.  The volume is preallocated in shared memory, the workers
+    decode the remaining slices with vtkGDCMImageReader and write them
+    directly into it, and the result is wrapped without copying as the
+    scalars of the output vtkImageData.
+
+    @param reader: vtkGDCMImageReader with the same settings as the
+    workers' readers, i.e. with FileLowerLeft switched on.
+    @param num_processes: number of worker processes, 0 for the number
+    of CPUs.
+    @param progress_callback: called with the percentage of decoded
+    slices.
+    @return: (image, volume) tuple with the vtkImageData and the numpy
+    array that holds its scalars.  The image does not keep the array
+    alive, so the caller has to keep a reference to volume for as long
+    as the image is in use.
+    @raise DecodeException: if the slices can't be decoded, e.g.
+    because they don't all have the same dimensions.
+    """
+
+    global _volume_buffer, _volume_layout
+
+    import multiprocessing
+
+    reader.SetFileNames(None)
+    reader.SetFileName(filenames[0])
+    reader.Update()
+    first = reader.GetOutput()
+
+    dims = first.GetDimensions()
+    if dims[2] != 1:
+        raise DecodeException(
+            'Parallel decoding only supports single-frame files.')
+
+    scalar_type = first.GetScalarType()
+    num_components = first.GetNumberOfScalarComponents()
+    dtype = numpy_support.get_numpy_array_type(scalar_type)
+    slice_len = dims[0] * dims[1] * num_components
+    num_bytes = slice_len * len(filenames) * numpy.dtype(dtype).itemsize
+
+    _volume_buffer = mmap.mmap(-1, num_bytes)
+    _volume_layout = (dims, scalar_type, num_components)
+    volume = numpy.frombuffer(_volume_buffer, dtype)
+    volume[:slice_len] = numpy_support.vtk_to_numpy(
+        first.GetPointData().GetScalars()).ravel()
+
+    if num_processes <= 0:
+        try:
+            num_processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            num_processes = 1
+
+    # chunks of consecutive slices: large enough to amortise the
+    # overhead, small enough for load balancing and progress
+    tasks = list(enumerate(filenames))[1:]
+    chunk_len = max(1, min(16, len(tasks) / (4 * num_processes)))
+    chunks = [tasks[i:i + chunk_len]
+              for i in range(0, len(tasks), chunk_len)]
+
+    pool = multiprocessing.Pool(num_processes)
+    try:
+        done = 1
+        for result in pool.imap_unordered(_decode_slices, chunks):
+            if isinstance(result, str):
+                raise DecodeException(result)
+
+            done += result
+            if progress_callback:
+                progress_callback(100.0 * done / len(filenames))
+
+    finally:
+        pool.terminate()
+        # the workers are gone, the volume array keeps the buffer
+        _volume_buffer = None
+        _volume_layout = None
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(dims[0], dims[1], len(filenames))
+    image.SetWholeExtent(image.GetExtent())
+    image.SetSpacing(first.GetSpacing())
+    image.SetOrigin(first.GetOrigin())
+    image.SetScalarType(scalar_type)
+    image.SetNumberOfScalarComponents(num_components)
+
+    if num_components > 1:
+        volume = volume.reshape((-1, num_components))
+
+    # with deep=0, numpy_to_vtk only hands volume's memory to the
+    # scalars (SetVoidArray) and keeps no reference to volume, which in
+    # turn is all that keeps the shared buffer mapped.
+    scalars = numpy_support.numpy_to_vtk(volume, 0, scalar_type)
+    scalars.SetName(first.GetPointData().GetScalars().GetName())
+    image.GetPointData().SetScalars(scalars)
+
+    return image, volume
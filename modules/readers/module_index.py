@@ -16,7 +16,7 @@ class BMPReader:
     """
 
 class DICOMReader:
-    kits = ['vtk_kit']
+    kits = ['vtk_kit', 'gdcm_kit', 'numpy_kit']
     cats = ['Readers', 'Medical', 'DICOM']
     help = """New module for reading DICOM data.
 
@@ -29,6 +29,12 @@ class DICOMReader:
     If DICOMReader fails to read your DICOM data, please also try the
     dicomRDR as its code is a few more years more mature than that of
     the more flexible but younger DICOMReader.
+
+    Set parallel_decode in the introspection to decode slices in
+    parallel with decode_processes worker processes (0 means one per
+    CPU), which is much faster for compressed series.  This is only
+    supported on POSIX systems and for single-frame files; otherwise
+    the slices are read one by one.
     """
 
 class dicomRDR:
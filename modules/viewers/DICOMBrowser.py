@@ -10,22 +10,23 @@
 # * refactoring of the code, specifically to get the dicom slice
 #   viewer out into a separate class for re-use in the rest of DeVIDE,
 #   for example by the light-table thingy I'm planning.  See issue 38.
-# * caching of DICOM searches: a scan of a set of directories will
-#   create an sqlite file with all scanned information.  Name of sql
-#   file will be stored in config, so that restarts will be REALLY
-#   quick.  One will be able to scan (recreate whole cache file) or
-#   a quick re-scan (only add new files that have appeared, remove 
-#   files that have disappeared).  See issue 39.
+# DICOM searches are cached in an sqlite index (see
+# dicombrowser_scanner.py), so that a re-scan only has to read new and
+# changed files.  See issue 39.
 
 import DICOMBrowserFrame
 reload(DICOMBrowserFrame)
+import dicombrowser_scanner
+reload(dicombrowser_scanner)
 import gdcm
+from module_kits.gdcm_kit import utils as gdcm_utils
 from module_kits.misc_kit import misc_utils
 from module_base import ModuleBase
 from module_mixins import IntrospectModuleMixin
 import module_utils
 import os
 import sys
+import time
 import traceback
 import vtk
 import vtkgdcm
@@ -97,6 +98,12 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
         # reload unnecessarily.
         self._current_filename = None
 
+        # DICOMScanner instance while a scan is running
+        self._scanner = None
+        # time at which the listctrls were last updated during the scan
+        self._scan_refresh_time = 0
+        self._scan_timer = wx.Timer(self._view_frame)
+
         self._bind_events()
 
 
@@ -104,6 +111,11 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
         self._config.lock_pz = False
         self._config.lock_wl = False
         self._config.s_study_dict = {}
+        # sqlite index of scanned files; empty for the default in the
+        # per-user DeVIDE directory.
+        self._config.scan_index_filename = ''
+        # number of scanner processes, 0 for the number of CPUs
+        self._config.scan_processes = 0
 
         self.sync_module_logic_with_config()
         self.sync_module_view_with_logic()
@@ -120,6 +132,11 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
             self._view_frame.set_default_view()
 
     def close(self):
+        # the scanner thread stops by itself after this
+        self._scan_timer.Stop()
+        if self._scanner is not None:
+            self._scanner.cancel()
+            self._scanner = None
         
         # with this complicated de-init, we make sure that VTK is 
         # properly taken care of
@@ -212,6 +229,8 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
 
         fp.scan_button.Bind(wx.EVT_BUTTON,
                 self._handler_scan_button)
+
+        vf.Bind(wx.EVT_TIMER, self._handler_scan_timer, self._scan_timer)
         
         lc = self._view_frame.studies_lc
         lc.Bind(wx.EVT_LIST_ITEM_SELECTED,
@@ -315,10 +334,27 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
 
         lc.itemDataMap = item_data_map
 
-        # select the first series
-        if lc.GetItemCount() > 0:
-            lc.SetItemState(0, wx.LIST_STATE_SELECTED,
-                    wx.LIST_STATE_SELECTED)
+        # select the previously selected series if it's still there
+        # (the list is refreshed during scanning), else the first
+        self._helper_select_item(lc, self._item_data_to_series_uid,
+                self._selected_series_uid)
+
+    def _helper_select_item(self, lc, item_data_to_uid, uid):
+        """Select the item with the given uid in listctrl lc, or the
+        first item if there is no such item.
+        """
+
+        if lc.GetItemCount() == 0:
+            return
+
+        idx = 0
+        for i in range(lc.GetItemCount()):
+            if item_data_to_uid.get(lc.GetItemData(i)) == uid:
+                idx = i
+                break
+
+        lc.SetItemState(idx, wx.LIST_STATE_SELECTED,
+                wx.LIST_STATE_SELECTED)
 
     def _fill_studies_listctrl(self):
         """Given a study dictionary, fill out the complete studies
@@ -371,8 +407,8 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
         lc.itemDataMap = item_data_map
         
         if lc.GetItemCount() > 0:
-            lc.SetItemState(0, wx.LIST_STATE_SELECTED,
-                    wx.LIST_STATE_SELECTED)
+            self._helper_select_item(lc, self._item_data_to_study_uid,
+                    self._selected_study_uid)
 
         else:
             # this means the study LC is empty, i.e. nothing was
@@ -478,10 +514,9 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
         # have to  cast to normal strings (from unicode)
         filenames = [str(i) for i in series.filenames]
 
-        sorter = gdcm.IPPSorter()
-        ret = sorter.Sort(filenames)
+        sort_result = gdcm_utils.sort_ipp(filenames)
 
-        if not ret:
+        if sort_result is None:
             self._module_manager.log_error(
                     'Could not sort DICOM filenames. ' + 
                     'It could be that this is an invalid collection.')
@@ -489,7 +524,7 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
 
         selected_idx = -1
         del series.filenames[:]
-        for idx,fn in enumerate(sorter.GetFilenames()):
+        for idx,fn in enumerate(sort_result[0]):
             series.filenames.append(fn)
             if idx >= 0 and fn == self._current_filename:
                 selected_idx = idx
@@ -788,6 +823,11 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
             self._image_viewer.Render()
 
     def _handler_scan_button(self, event):
+        if self._scanner is not None:
+            # the scan button is the cancel button during the scan
+            self._scanner.cancel()
+            return
+
         tc = self._view_frame.dirs_pane.dirs_files_tc
 
         # helper function discards empty strings and strips the rest
@@ -796,17 +836,71 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
 
         # let's put it back in the interface too
         tc.SetValue(self._helper_dicom_search_paths_to_string(paths))
-        
-        try:
-            self._study_dict = self._scan(paths)
-        except Exception, e:
-            # also print the exception
-            traceback.print_exc()
+
+        index_filename = self._config.scan_index_filename
+        if not index_filename:
+            index_filename = os.path.join(
+                    self._module_manager.get_app_main_config().user_dir,
+                    'dicom_scan_index.db')
+
+        # the study_dict is filled while the results stream in
+        self._study_dict = {}
+        self._fill_studies_listctrl()
+
+        self._scanner = dicombrowser_scanner.DICOMScanner(
+                paths, index_filename, self._config.scan_processes)
+        self._scanner.start()
+        self._scan_refresh_time = time.time()
+        self._scan_timer.Start(250)
+        self._view_frame.dirs_pane.scan_button.SetLabel('Cancel')
+
+    def _handler_scan_timer(self, event):
+        scanner = self._scanner
+        if scanner is None:
+            self._scan_timer.Stop()
+            return
+
+        # check this before getting the results, so that we don't miss
+        # any results that arrive in between.
+        finished = not scanner.is_running()
+
+        results = scanner.get_results()
+        for filename, file_tags in results:
+            self._helper_add_file_to_study_dict(filename, file_tags)
+
+        if not finished:
+            self._view_frame.dirs_pane.scan_button.SetLabel(
+                    'Cancel (%d / %d)' % (scanner.num_done,
+                                          scanner.num_files))
+
+            # refreshing the listctrls is expensive, so we do it at
+            # most once a second
+            if results and time.time() - self._scan_refresh_time > 1.0:
+                self._fill_studies_listctrl()
+                self._scan_refresh_time = time.time()
+
+            return
+
+        self._scan_timer.Stop()
+        self._scanner = None
+        self._view_frame.dirs_pane.scan_button.SetLabel('Scan')
+
+        if scanner.error is not None:
             # i don't want to use log_error_with_exception, because it
             # uses a non-standard dialogue box that pops up over the
             # main devide window instead of the module view.
             self._module_manager.log_error(
-                    'Error scanning DICOM files: %s' % (str(e)))
+                    'Error scanning DICOM files: %s' % 
+                    (str(scanner.error),))
+
+        else:
+            print 'Scanned %d files, %d from index.' % \
+                    (scanner.num_done, scanner.num_unchanged)
+
+        # results arrive in blocks in any order
+        for study in self._study_dict.values():
+            for series in study.series_dict.values():
+                series.filenames.sort()
 
         # serialise study_dict into config
         self._config.s_study_dict = self._serialise_study_dict(
@@ -913,39 +1007,6 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
         s = [str(i.strip()) for i in dicom_search_paths.split(';')]
         return [i for i in s if len(i) > 0]
 
-    def _helper_recursive_glob(self, paths):
-        """Given a combined list of files and directories, return a
-        combined list of sorted and unique fully-qualified filenames,
-        consisting of the supplied filenames and a recursive search
-        through all supplied directories.
-        """
-
-        # we'll use this to keep all filenames unique 
-        files_dict = {}
-        d = gdcm.Directory()
-
-        for path in paths:
-            if os.path.isdir(path):
-                # we have to cast path to str (it's usually unicode)
-                # else the gdcm wrappers error on "bad number of
-                # arguments to overloaded function"
-                d.Load(str(path), True)
-                # fromkeys creates a new dictionary with GetFilenames
-                # as keys; then update merges this dictionary with the
-                # existing files_dict
-                normed = [os.path.normpath(i) for i in d.GetFilenames()]
-                files_dict.update(dict.fromkeys(normed, 1))
-
-            elif os.path.isfile(path):
-                files_dict[os.path.normpath(path)] = 1
-
-
-        # now sort everything
-        filenames = files_dict.keys()
-        filenames.sort()
-
-        return filenames
-
     def _reset_image_pz(self):
         """Reset the pan/zoom of the current image.
         """
@@ -967,223 +1028,71 @@ class DICOMBrowser(IntrospectModuleMixin, ModuleBase):
             iv.SetColorWindow(r[1] - r[0])
             iv.SetColorLevel(0.5 * (r[1] + r[0]))
 
-    def _scan(self, paths):
-        """Given a list combining filenames and directories, search
-        recursively to find all valid DICOM files.  Build
-        dictionaries.
+    def _helper_add_file_to_study_dict(self, f, file_tags):
+        """Add scanned DICOM file f, with file_tags as returned by
+        dicombrowser_scanner.scan_block, to the study_dict.
         """
 
-        # UIDs are unique for their domains.  Patient ID for example
-        # is not unique.
-        # Instance UID (0008,0018)
-        # Patient ID (0010,0020)
-        # Study UID (0020,000D) - data with common procedural context
-        # Study description (0008,1030)
-        # Series UID (0020,000E)
-
-        # see http://public.kitware.com/pipermail/igstk-developers/
-        # 2006-March/000901.html for explanation w.r.t. number of
-        # frames; for now we are going to assume that this refers to
-        # the number of included slices (as is the case for the
-        # Toshiba 320 slice for example)
-
-        tag_to_symbol = {
-                (0x0008, 0x0018) : 'instance_uid',
-                (0x0010, 0x0010) : 'patient_name',
-                (0x0010, 0x0020) : 'patient_id',
-                (0x0020, 0x000d) : 'study_uid',
-                (0x0008, 0x1030) : 'study_description',
-                (0x0008, 0x0020) : 'study_date',
-                (0x0020, 0x000e) : 'series_uid',
-                (0x0008, 0x103e) : 'series_description',
-                (0x0008, 0x0060) : 'modality', # fixed per series
-                (0x0028, 0x0008) : 'number_of_frames',
-                (0x0028, 0x0010) : 'rows',
-                (0x0028, 0x0011) : 'columns'
-                }
-
-        # find list of unique and sorted filenames
-        filenames = self._helper_recursive_glob(paths)
-        
-        s = gdcm.Scanner()
-        # add the tags we want to the scanner
-        for tag_tuple in tag_to_symbol:
-            tag = gdcm.Tag(*tag_tuple)
-            s.AddTag(tag)
-
-        # maps from study_uid to instance of Study
-        study_dict = {}
-
-        # we're going to break the filenames up into 10 blocks and
-        # scan each block separately in order to be able to give
-        # proper feedback to the user, and also to give the user the
-        # opportunity to interrupt the scan
-        num_files = len(filenames)
-
-        # no filenames, we return an empty dict.
-        if num_files == 0:
-            return study_dict
-
-        num_files_per_block = 100 
-        num_blocks = num_files / num_files_per_block 
-        if num_blocks == 0:
-            num_blocks = 1
-
-        blocklen = num_files / num_blocks
-        blockmod = num_files % num_blocks
-
-        block_lens = [blocklen] * num_blocks
-        if blockmod > 0:
-            block_lens += [blockmod]
-
-        file_idx = 0 
-        progress = 0.0 
-
-        # setup progress dialog
-        dlg = wx.ProgressDialog("DICOMBrowser",
-                                "Scanning DICOM data",
-                                maximum = 100,
-                                parent=self._view_frame,
-                                style = wx.PD_CAN_ABORT
-                                | wx.PD_APP_MODAL
-                                | wx.PD_ELAPSED_TIME
-                                | wx.PD_AUTO_HIDE
-                                #| wx.PD_ESTIMATED_TIME
-                                | wx.PD_REMAINING_TIME
-                                )
-        keep_going = True
-        error_occurred = False
-
-        # and now the processing loop can start
-        for block_len in block_lens:
-            # scan the current block of files
-            try:
-                self._helper_scan_block(
-                        s, filenames[file_idx:file_idx + block_len],
-                        tag_to_symbol, study_dict)
-            except Exception:
-                # error during scan, we have to kill the dialog and
-                # then re-raise the error
-                dlg.Destroy()
-                raise
-
-
-            # update file_idx for the next block
-            file_idx += block_len
-            # update progress counter
-            progress = int(100 * file_idx / float(num_files))
-            # and tell the progress dialog about our progress
-            # by definition, progress will be 100 at the end: if you
-            # add all blocklens together, you have to get 1
-            (keep_going, skip) = dlg.Update(progress)
-
-            if not keep_going:
-                # user has clicked cancel so we zero the dictionary
-                study_dict = {}
-                # and stop the for loop
-                break
-
-        # dialog needs to be taken care of
-        dlg.Destroy()
-
-        # return all the scanned data
-        return study_dict
-
-    def _helper_scan_block(
-            self, s, filenames, tag_to_symbol, study_dict):
-        """Scan list of filenames, fill study_dict.  Used by _scan()
-        to scan list of filenames in blocks.
-        """
-
-        # d.GetFilenames simply returns a tuple with all
-        # fully-qualified filenames that it finds.
-        ret = s.Scan(filenames)
-        if not ret:
-            print "scanner failed"
-            return
-
-        # s now contains a Mapping (std::map) from filenames to stuff
-        # calling s.GetMapping(full filename) returns a TagToValue
-        # which we convert for our own use with a PythonTagToValue
-        #pttv = gdcm.PythonTagToValue(mapping)
-
         # what i want:
         # a list of studies (indexed on study id): each study object
         # contains metadata we want to list per study, plus a list of
         # series belonging to that study.
 
-        for f in filenames:
-            mapping = s.GetMapping(f)
+        study_dict = self._study_dict
 
-            # with this we can iterate through all tags for this file
-            # let's store them all...
-            file_tags = {}
-            pttv = gdcm.PythonTagToValue(mapping)
-            pttv.Start()
-            while not pttv.IsAtEnd():
-                tag = pttv.GetCurrentTag() # gdcm::Tag
-                val = pttv.GetCurrentValue() # string
+        # files that are not DICOM have no file_tags, and we need at
+        # least study and series UIDs to continue
+        if not (file_tags and 'study_uid' in file_tags and \
+                'series_uid' in file_tags):
+            return
+        
+        study_uid = file_tags['study_uid']
+        series_uid = file_tags['series_uid']
 
-                symbol = tag_to_symbol[(tag.GetGroup(), tag.GetElement())]
-                file_tags[symbol] = val
+        # create a new study if it doesn't exist yet
+        try:
+            study = study_dict[study_uid]
+        except KeyError:
+            study = Study()
+            study.uid = study_uid
 
-                pttv.Next()
+            study.description = file_tags.get(
+                    'study_description', '')
+            study.date = file_tags.get(
+                    'study_date', '')
+            study.patient_name = file_tags.get(
+                    'patient_name', '')
+            study.patient_id = file_tags.get(
+                    'patient_id', '')
 
-            # take information from file_tags, stuff into all other
-            # structures...
+            study_dict[study_uid] = study
 
-            # we need at least study and series UIDs to continue
-            if not ('study_uid' in file_tags and \
-                    'series_uid' in file_tags):
-                continue
-            
-            study_uid = file_tags['study_uid']
-            series_uid = file_tags['series_uid']
-           
-            # create a new study if it doesn't exist yet
-            try:
-                study = study_dict[study_uid]
-            except KeyError:
-                study = Study()
-                study.uid = study_uid
-
-                study.description = file_tags.get(
-                        'study_description', '')
-                study.date = file_tags.get(
-                        'study_date', '')
-                study.patient_name = file_tags.get(
-                        'patient_name', '')
-                study.patient_id = file_tags.get(
-                        'patient_id', '')
-
-                study_dict[study_uid] = study
-
-            try:
-                series = study.series_dict[series_uid]
-            except KeyError:
-                series = Series()
-                series.uid = series_uid
-                # these should be the same over the whole series
-                series.description = \
-                    file_tags.get('series_description', '')
-                series.modality = file_tags.get('modality', '')
+        try:
+            series = study.series_dict[series_uid]
+        except KeyError:
+            series = Series()
+            series.uid = series_uid
+            # these should be the same over the whole series
+            series.description = \
+                file_tags.get('series_description', '')
+            series.modality = file_tags.get('modality', '')
 
-                series.rows = int(file_tags.get('rows', 0))
-                series.columns = int(file_tags.get('columns', 0))
+            series.rows = int(file_tags.get('rows', 0))
+            series.columns = int(file_tags.get('columns', 0))
 
-                study.series_dict[series_uid] = series
+            study.series_dict[series_uid] = series
 
-            series.filenames.append(f)
+        series.filenames.append(f)
 
-            
-            try:
-                number_of_frames = int(file_tags['number_of_frames'])
-            except KeyError:
-                # means number_of_frames wasn't found
-                number_of_frames = 1
-
-            series.slices = series.slices + number_of_frames
-            study.slices = study.slices + number_of_frames
+        
+        try:
+            number_of_frames = int(file_tags['number_of_frames'])
+        except KeyError:
+            # means number_of_frames wasn't found
+            number_of_frames = 1
+
+        series.slices = series.slices + number_of_frames
+        study.slices = study.slices + number_of_frames
 
     def _deserialise_study_dict(self, s_study_dict):
         """Given a serialised study_dict, as generated by
@@ -17,6 +17,9 @@ import MaskComBinarFrame
 # module.
 reload(MaskComBinarFrame)
 
+import maskcombinar_metrics
+reload(maskcombinar_metrics)
+
 from module_base import ModuleBase
 from module_mixins import IntrospectModuleMixin
 import module_utils
@@ -25,7 +28,6 @@ import vtk
 import itk
 import wx
 import copy
-import subprocess
 #import numpy as np
 
 from OverlaySliceViewer import OverlaySliceViewer
@@ -434,6 +436,9 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
         vf.Bind(wx.EVT_MENU, self._handler_save_mask,
                 id = vf.id_save_mask)
 
+        vf.Bind(wx.EVT_MENU, self._handler_export_overlap_metrics,
+                id = vf.id_export_overlap_metrics)
+
         vf.Bind(wx.EVT_MENU, self._handler_close,
                 id = vf.id_quit)
 
@@ -684,6 +689,40 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
             else:
                 self._view_frame.dialog_exclaim("No valid file name specified")
 
+    def _handler_export_overlap_metrics(self, event):
+        """Saves the pairwise overlap metrics of the selected masks (or all masks if fewer than two are selected) to CSV"""
+        if self.test_valid_mask_selection_multiple(warn = False):
+            mask_names = self._view_frame.get_selected_mask_names_a()
+            for name in self._view_frame.get_selected_mask_names_b():
+                mask_names.add(name)
+        elif len(self.masks) >= 2:
+            mask_names = self.masks.keys()
+        else:
+            self._view_frame.dialog_info("At least 2 masks need to be loaded to compute overlap metrics!","Fewer than two masks loaded")
+            return
+
+        mask_set = self._get_mask_set(mask_names)
+        if mask_set is None:
+            return
+
+        filters = 'CSV files (*.csv)|*.csv'
+        dlg = wx.FileDialog(self._view_frame, "Choose a destination", self._config.last_used_dir, "overlap.csv", filters, wx.SAVE)
+        if dlg.ShowModal() == wx.ID_OK:
+            self._config.last_used_dir = dlg.GetDirectory()
+            file_path = dlg.GetPath()
+            mask_set.write_csv(file_path)
+            print 'Wrote overlap metrics of %d masks to %s' % (len(mask_set.names), file_path)
+        dlg.Destroy()
+
+    def _get_mask_set(self, mask_names):
+        """Returns maskcombinar_metrics.MaskSet of the named masks, or None (after showing an error) if their dimensions don't match"""
+        mask_names = sorted(mask_names)
+        try:
+            return maskcombinar_metrics.MaskSet(mask_names, [self.masks[name].data for name in mask_names])
+        except ValueError, e:
+            self._view_frame.dialog_error("%s\n\nUse the dimension tests to find the mismatching masks." % str(e), "Mismatching masks")
+            return None
+
     def _handler_align_masks_metadata(self, event):
         """Aligns two masks by copying metadata from the first to the second (origin, spacing, extent, wholeextent)
            As always, creates a new mask in the list of masks as output.
@@ -813,59 +852,21 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
             union_masksA = self.compute_mask_union(names_a)
             union_masksB = self.compute_mask_union(names_b)
 
-            # Given two binary volumes, this CodeRunner will implement
-            # the percentage volume overlap.  This is useful for
+            # percentage volume overlap, also called the Dice
+            # coefficient, ranges from 0.0 to 1.0.  This is useful for
             # doing validation with ground truth / golden standard /
-            # manually segmented volumes.  This is also called the Dice
-            # coefficient and ranges from 0.0 to 1.0.
+            # manually segmented volumes.
 
             # interesting paper w.r.t. segmentation validation:
             # Valmet: A new validation tool for assessing and improving 3D object segmentation
 
-            # basic idea:
-            # threshold data (so we have >0 == 1 and everything else 0)
-            # then histogram into two bins.
-
-            threshes = []
-
-            for _ in range(2):
-                t = vtk.vtkImageThreshold()
-                threshes.append(t)
-                # anything equal to or lower than 0.0 will be "In"
-                t.ThresholdByLower(0.0)
-                # <= 0 -> 0
-                t.SetInValue(0)
-                # > 0 -> 1
-                t.SetOutValue(1)
-                t.SetOutputScalarTypeToUnsignedChar()
-
-            # have to stuff all components into one image
-            iac = vtk.vtkImageAppendComponents()
-            iac.SetInput(0, threshes[0].GetOutput())
-            iac.SetInput(1, threshes[1].GetOutput())
-
-            # generate 2 by 2 matrix (histogram)
-            ia = vtk.vtkImageAccumulate()
-            ia.SetInput(iac.GetOutput())
-            ia.SetComponentExtent(0,1, 0,1, 0,0)
-
-            threshes[0].SetInput(union_masksA.data)
-            threshes[1].SetInput(union_masksB.data)
-            ia.Update()
-
-            iasc = ia.GetOutput().GetPointData().GetScalars()
-            cells = [0] * 4
-            for i in range(4):
-                cells[i] = iasc.GetTuple1(i)
-
-            # tuple 0: not in actor, not in b
-            # tuple 1: in actor, not in b
-            # tuple 2: in b, not in actor
-            # tuple 3: in actor, in b
-
-            # percentage overlap: (a intersect b) / (a union b)
-
-            dice_coeff = (2 * cells[3] / (2* cells[3] + cells[1] + cells[2]))
+            try:
+                mask_set = maskcombinar_metrics.MaskSet(['A', 'B'], [union_masksA.data, union_masksB.data])
+            except ValueError, e:
+                self._view_frame.dialog_error(str(e), "Mismatching masks")
+                return
+
+            dice_coeff = mask_set.get_dice()[0,1]
             
             print "Dice Coefficiet = %.2f" % (dice_coeff)
             copy_to_clipboard = self._view_frame.dialog_yesno('Dice coefficient = %f\n\nCopy to clipboard?' % dice_coeff, '%.1f%% overlap' % (100*dice_coeff))
@@ -876,85 +877,28 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
     def _compute_hausdorff_distances(self, maskA, maskB):
         """
         Computes the Hausdorff Distance between selections in A and B.
-        Uses the external software tool Metro to do point-based mesh sampling
+        Returns [hausdorff_distance, mean_hausdorff_distance], or None if the distances could not be computed.
+        See maskcombinar_metrics.compute_surface_distances
         """
-        
-        #We need meshes (polydata) for computing the Hausdorff distances
-        meshA = None
-        meshB = None
-        #actually this should never happen, but let's keep it for making double sure
-        if not self.surfaces.has_key(maskA.name):
-            self._view_frame.dialog_exclaim('Mesh belonging to Mask A not found in list, and created on the fly. This is unexpected...', 'Unexpected program state')
-            surface_creator_A = vtk.vtkDiscreteMarchingCubes()
-            surface_creator_A.SetInput(maskA.data)
-            surface_creator_A.Update()
-            meshA = surface_creator_A.GetOutput()
-        else:
-            meshA = self.surfaces[maskA.name]
-
-        #actually this should never happen, but let's keep it for making double sure
-        if not self.surfaces.has_key(maskB.name):
-            self._view_frame.dialog_exclaim('Mesh belonging to Mask B not found in list, and created on the fly. This is unexpected...', 'Unexpected program state')
-            surface_creator_B = vtk.vtkDiscreteMarchingCubes()
-            surface_creator_B.SetInput(maskB.data)
-            surface_creator_B.Update()
-            meshB = surface_creator_B.GetOutput()
-        else:
-            meshB = self.surfaces[maskB.name]
-
-        filename_a = '@temp_mesh_a.ply'
-        filename_b = '@temp_mesh_b.ply'
-
-        ply_writer = vtk.vtkPLYWriter()
-        ply_writer.SetFileTypeToBinary()
-        print 'Writing temporary PLY mesh A = %s' % filename_a
-        ply_writer.SetFileName(filename_a)
-        ply_writer.SetInput(meshA)
-        ply_writer.Update()
-        print 'Writing temporary PLY mesh B = %s' % filename_b
-        ply_writer.SetFileName(filename_b)
-        ply_writer.SetInput(meshB)
-        ply_writer.Update()
-
-        command = 'metro.exe %s %s' % (filename_a, filename_b)
-        p = subprocess.Popen(command, shell=True, stdout = subprocess.PIPE)
-        outp = p.stdout.read()                          #The command line output from metro
-
-        if len(outp) < 50:
-            self._view_frame.dialog_error('Hausdorff distance computation requires Metro to be installed and available in the system path.\n\nMetro failed to execute.\n\nAborting.\n\nMetro may be downloaded from http://vcg.sourceforge.net/index.php/Metro', 'Metro was not found')
-            return
-
-        print 'Executing: %s' % command
-        print '....................................'
-        print outp
-        print '....................................'
-
-        index = outp.find('max')
-        hdf = float(outp[index+6:index+54].split()[0])  #Forward Hausdorff distance
-        index = outp.find('max', index+3)
-        hdb = float(outp[index+6:index+54].split()[0])  #Backward Hausdorff distance
-
-        index = outp.find('mean')
-        mhdf = float(outp[index+7:index+35].split()[0])  #Forward Mean Hausdorff distance
-        index = outp.find('mean', index+4)
-        mhdb = float(outp[index+7:index+35].split()[0])  #Backward Mean Hausdorff distance
-
-        hausdorff_distance = max(hdf, hdb)
-        mean_hausdorff_distance = 0.5 * (mhdf + mhdb)
+        try:
+            sd = maskcombinar_metrics.compute_surface_distances(maskA.data, maskB.data)
+        except ValueError, e:
+            self._view_frame.dialog_error('Could not compute the Hausdorff distance between %s and %s:\n\n%s' % (maskA.name, maskB.name, str(e)), 'Hausdorff distance')
+            return None
 
-        print 'removing temporary files'
-        os.remove(filename_a)
-        os.remove(filename_b)
-        print 'done!'
+        hausdorff_distance = sd.get_hausdorff()
+        mean_hausdorff_distance = sd.get_mean()
 
-        print '\nSampled Hausdorff distance      = %.4f\nSampled Mean Hausdorff distance = %.4f\n' % (hausdorff_distance, mean_hausdorff_distance)
+        print '\nDirected Hausdorff distances      = %.4f, %.4f' % sd.get_directed_hausdorff()
+        print 'Directed Mean Hausdorff distances = %.4f, %.4f' % sd.get_directed_mean()
+        print '95%% Hausdorff distance            = %.4f' % sd.get_percentile(95)
+        print 'Hausdorff distance                = %.4f\nMean Hausdorff distance           = %.4f\n' % (hausdorff_distance, mean_hausdorff_distance)
 
         return [hausdorff_distance, mean_hausdorff_distance]
 
     def _handler_compute_hausdorff_distance(self, event):
         """
-        Computes the Hausdorff Distance between meshes in A and B.
-        Uses the external software tool Metro to do point-based mesh sampling
+        Computes the Hausdorff Distance between the masks in A and B.
         """
         if self.test_single_mask_pair_selection():
             names_a = self._view_frame.get_selected_mask_names_a()
@@ -962,15 +906,17 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
             maskA = self.masks[names_a.pop()]
             maskB = self.masks[names_b.pop()]
 
-            [hausdorff_distance, _] = self._compute_hausdorff_distances(maskA, maskB)
+            distances = self._compute_hausdorff_distances(maskA, maskB)
+            if distances is None:
+                return
+            [hausdorff_distance, _] = distances
             copy_to_clipboard = self._view_frame.dialog_yesno('Hausdorff distance = %.4f mm\n\nCopy to clipboard?' % hausdorff_distance, 'Hausdorff Distance')
             if copy_to_clipboard:
                 self._view_frame.copy_text_to_clipboard('%f' % hausdorff_distance)
 
     def _handler_compute_mean_hausdorff_distance(self, event):
         """
-        Computes the Mean Hausdorff Distance between meshes in A and B.
-        Uses the external software tool Metro to do point-based mesh sampling
+        Computes the Mean Hausdorff Distance between the masks in A and B.
         """
         if self.test_single_mask_pair_selection():
             names_a = self._view_frame.get_selected_mask_names_a()
@@ -978,7 +924,10 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
             maskA = self.masks[names_a.pop()]
             maskB = self.masks[names_b.pop()]
             
-            [_, mean_hausdorff_distance] = self._compute_hausdorff_distances(maskA, maskB)
+            distances = self._compute_hausdorff_distances(maskA, maskB)
+            if distances is None:
+                return
+            [_, mean_hausdorff_distance] = distances
 
             copy_to_clipboard = self._view_frame.dialog_yesno('Mean Hausdorff distance = %.4f mm\n\nCopy to clipboard?' % mean_hausdorff_distance, 'Mean Hausdorff distance')
             if copy_to_clipboard:
@@ -1032,68 +981,21 @@ class MaskComBinar(IntrospectModuleMixin, ModuleBase):
         """
         Tests for intersections between the masks listed in mask_names
         """
-        mask_names = copy.copy(mask_name_list)
-        first_name = mask_names.pop()
-        data = self.masks[first_name].data
-
-        intersections_found = False
-        eight_bit = False
-
-        for mask_name in mask_names:
-            print 'adding %s' % mask_name
-            data2 = self.masks[mask_name].data
-            adder = vtk.vtkImageMathematics()
-            adder.SetOperationToAdd()
-            adder.SetInput1(data)
-            adder.SetInput2(data2)
-            adder.Update()
-            data = adder.GetOutput()
-
-        accumulator = vtk.vtkImageAccumulate()
-        accumulator.SetInput(data)
-        accumulator.Update()
-        max = accumulator.GetMax()[0]
-
-        if max == 255:
-            eight_bit = True
-        elif max > 1:
-            intersections_found = True
-        else:
-            self._view_frame.dialog_info("No intersections found.\n(duplicate selections in A and B ignored).", "No intersections")
-
-        if eight_bit:
-            eight_bit_mask_names = ''
-            mask_names = copy.copy(mask_name_list)
+        mask_set = self._get_mask_set(mask_name_list)
+        if mask_set is None:
+            return
 
-            for mask_name in mask_names:
-                accumulator = vtk.vtkImageAccumulate()
-                accumulator.SetInput(self.masks[mask_name].data)
-                accumulator.Update()
-                if accumulator.GetMax()[0] == 255:
-                    eight_bit_mask_names = '%s, "%s"' % (eight_bit_mask_names, mask_name)
-            eight_bit_mask_names = eight_bit_mask_names[2:]     #Remove the first two characters for neat display purposes
+        if len(mask_set.non_binary) > 0:
+            eight_bit_mask_names = ', '.join(['"%s"' % mask_name for mask_name in mask_set.non_binary])
             self._view_frame.dialog_error("Masks should be binary. The following masks were found to be 8-bit:\n%s" % eight_bit_mask_names,"Non-binary mask found!")
+            return
 
-        elif intersections_found:
-            mask_name_pair_list = ''
-            mask_names = copy.copy(mask_name_list)
-
-            while len(mask_names) > 0:
-                name1 = mask_names.pop()
-
-                for name2 in mask_names:
-                    adder = vtk.vtkImageMathematics()
-                    adder.SetOperationToAdd()
-                    adder.SetInput1(self.masks[name1].data)
-                    adder.SetInput2(self.masks[name2].data)
-                    adder.Update()
-                    accumulator = vtk.vtkImageAccumulate()
-                    accumulator.SetInput(adder.GetOutput())
-                    accumulator.Update()
-                    if accumulator.GetMax()[0] == 2:
-                        mask_name_pair_list = '%s,\n ("%s","%s")' % (mask_name_pair_list, name1, name2)
-            mask_name_pair_list = mask_name_pair_list[2:]     #Remove the first two characters for neat display purposes
-            self._view_frame.dialog_exclaim("Intersections found between the following mask pairs:\n%s" % mask_name_pair_list,"Intersections found!")
+        mask_name_pairs = mask_set.get_intersecting_pairs()
+        if len(mask_name_pairs) == 0:
+            self._view_frame.dialog_info("No intersections found.\n(duplicate selections in A and B ignored).", "No intersections")
+        else:
+            mask_name_pair_list = ',\n '.join(['("%s","%s")' % pair for pair in mask_name_pairs])
+            self._view_frame.dialog_exclaim("Intersections found between the following mask pairs:\n %s" % mask_name_pair_list,"Intersections found!")
 
     def _test_dimensions(self, mask_names, msg):
         """
@@ -122,6 +122,10 @@ class MaskComBinarFrame(wx.Frame):
         menu_file.Append(self.id_save_multi_mask, "&Save multilabel Mask\tCtrl-Alt-S",
                 "Save selected (A) to multi-label (integer-labeled) mask", wx.ITEM_NORMAL)
 
+        self.id_export_overlap_metrics = wx.NewId()
+        menu_file.Append(self.id_export_overlap_metrics, "&Export overlap metrics\tCtrl-E",
+                "Save Dice, Jaccard and intersection volumes of all pairs of selected (or all) masks to CSV", wx.ITEM_NORMAL)
+
         self.id_quit = wx.NewId()
         menu_file.Append(self.id_quit, "&Exit\tCtrl-Q",
                 "Exit MaskComBinar", wx.ITEM_NORMAL)
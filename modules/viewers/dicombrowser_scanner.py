@@ -0,0 +1,417 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Background DICOM scanner with persistent index for the DICOMBrowser.
+
+See the documentation of L{DICOMScanner} and L{ScanIndex}.
+"""
+
+import gdcm
+import os
+import Queue
+import sqlite3
+import sys
+import threading
+
+# UIDs are unique for their domains.  Patient ID for example
+# is not unique.
+# Instance UID (0008,0018)
+# Patient ID (0010,0020)
+# Study UID (0020,000D) - data with common procedural context
+# Study description (0008,1030)
+# Series UID (0020,000E)
+
+# see http://public.kitware.com/pipermail/igstk-developers/
+# 2006-March/000901.html for explanation w.r.t. number of
+# frames; for now we are going to assume that this refers to
+# the number of included slices (as is the case for the
+# Toshiba 320 slice for example)
+
+TAG_TO_SYMBOL = {
+        (0x0008, 0x0018) : 'instance_uid',
+        (0x0010, 0x0010) : 'patient_name',
+        (0x0010, 0x0020) : 'patient_id',
+        (0x0020, 0x000d) : 'study_uid',
+        (0x0008, 0x1030) : 'study_description',
+        (0x0008, 0x0020) : 'study_date',
+        (0x0020, 0x000e) : 'series_uid',
+        (0x0008, 0x103e) : 'series_description',
+        (0x0008, 0x0060) : 'modality', # fixed per series
+        (0x0028, 0x0008) : 'number_of_frames',
+        (0x0028, 0x0010) : 'rows',
+        (0x0028, 0x0011) : 'columns'
+        }
+
+# columns of the ScanIndex in which the file_tags are stored
+TAG_COLUMNS = TAG_TO_SYMBOL.values()
+TAG_COLUMNS.sort()
+
+def find_files(paths):
+    """Given a combined list of files and directories, return a
+    combined list of sorted and unique fully-qualified filenames,
+    consisting of the supplied filenames and a recursive search
+    through all supplied directories.
+    """
+
+    # we'll use this to keep all filenames unique
+    files_dict = {}
+    d = gdcm.Directory()
+
+    for path in paths:
+        if os.path.isdir(path):
+            # we have to cast path to str (it's usually unicode)
+            # else the gdcm wrappers error on "bad number of
+            # arguments to overloaded function"
+            d.Load(str(path), True)
+            # fromkeys creates a new dictionary with GetFilenames
+            # as keys; then update merges this dictionary with the
+            # existing files_dict
+            normed = [os.path.normpath(i) for i in d.GetFilenames()]
+            files_dict.update(dict.fromkeys(normed, 1))
+
+        elif os.path.isfile(path):
+            files_dict[os.path.normpath(path)] = 1
+
+    # now sort everything
+    filenames = files_dict.keys()
+    filenames.sort()
+
+    return filenames
+
+def scan_block(filenames):
+    """Scan list of filenames with gdcm.Scanner.
+
+    This runs in the scanner worker processes, so it should only use
+    its arguments.
+
+    @return: list of (filename, file_tags) tuples, where file_tags is a
+    dictionary mapping from the symbols in TAG_TO_SYMBOL to the tag
+    values, or None if the file could not be read as DICOM.
+    """
+
+    s = gdcm.Scanner()
+    # add the tags we want to the scanner
+    for tag_tuple in TAG_TO_SYMBOL:
+        s.AddTag(gdcm.Tag(*tag_tuple))
+
+    if not s.Scan(filenames):
+        return [(f, None) for f in filenames]
+
+    results = []
+    for f in filenames:
+        if not s.IsKey(f):
+            results.append((f, None))
+            continue
+
+        # s now contains a Mapping (std::map) from filenames to stuff
+        # calling s.GetMapping(full filename) returns a TagToValue
+        # which we convert for our own use with a PythonTagToValue
+        file_tags = {}
+        pttv = gdcm.PythonTagToValue(s.GetMapping(f))
+        pttv.Start()
+        while not pttv.IsAtEnd():
+            tag = pttv.GetCurrentTag() # gdcm::Tag
+            val = pttv.GetCurrentValue() # string
+
+            symbol = TAG_TO_SYMBOL[(tag.GetGroup(), tag.GetElement())]
+            file_tags[symbol] = val
+
+            pttv.Next()
+
+        results.append((f, file_tags))
+
+    return results
+
+def get_file_stat(filename):
+    """Return (mtime, size) of filename, or None if it can't be
+    stat'ed.
+    """
+
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return st.st_mtime, st.st_size
+
+#########################################################################
+class ScanIndex:
+    """Persistent sqlite index of scanned files.
+
+    For every scanned file, the index stores its modification time, size
+    and the file_tags found by L{scan_block}, or None if it's not a DICOM
+    file.  A file only has to be scanned again if its modification time
+    or size has changed.
+
+    Every tag symbol has its own text column, which is NULL if the file
+    does not have the tag.  The index only ever contains plain strings,
+    so reading an index written by someone else can't run code.
+
+    Like all sqlite connections, a ScanIndex can only be used from the
+    thread that created it.
+    """
+
+    def __init__(self, filename):
+        """
+        @raise sqlite3.Error: if the index can't be opened or created.
+        """
+
+        self._conn = sqlite3.connect(filename)
+        # filenames are byte strings, also when they come back out
+        self._conn.text_factory = str
+        self._conn.execute(
+            'create table if not exists file_tags '
+            '(filename text primary key, mtime real, size integer, '
+            'is_dicom integer, %s)' %
+            (', '.join(['%s text' % (c,) for c in TAG_COLUMNS]),))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def get_unchanged(self, stats):
+        """Return file_tags of all indexed files that have not changed.
+
+        @param stats: dictionary mapping from filename to (mtime, size).
+        @return: dictionary mapping from filename to file_tags.
+        """
+
+        unchanged = {}
+        cursor = self._conn.execute(
+            'select filename, mtime, size, is_dicom, %s from file_tags' %
+            (', '.join(TAG_COLUMNS),))
+        for row in cursor:
+            filename, mtime, size, is_dicom = row[:4]
+            if stats.get(filename) != (mtime, size):
+                continue
+
+            if is_dicom:
+                file_tags = {}
+                for symbol, val in zip(TAG_COLUMNS, row[4:]):
+                    if val is not None:
+                        file_tags[symbol] = val
+
+                unchanged[filename] = file_tags
+
+            else:
+                unchanged[filename] = None
+
+        return unchanged
+
+    def store(self, results, stats):
+        """Store scan results.
+
+        @param results: list of (filename, file_tags) tuples.
+        @param stats: dictionary mapping from filename to (mtime, size).
+        """
+
+        rows = []
+        for filename, file_tags in results:
+            mtime, size = stats[filename]
+            if file_tags is None:
+                rows.append((filename, mtime, size, 0) +
+                            (None,) * len(TAG_COLUMNS))
+            else:
+                rows.append((filename, mtime, size, 1) +
+                            tuple([file_tags.get(c) for c in TAG_COLUMNS]))
+
+        self._conn.executemany(
+            'insert or replace into file_tags values (%s)' %
+            (', '.join(['?'] * (4 + len(TAG_COLUMNS))),), rows)
+        self._conn.commit()
+
+    def prune(self, paths, filenames):
+        """Remove all indexed files below the directories in paths that
+        are not in filenames anymore, i.e. that have been deleted.
+        """
+
+        dirs = [os.path.join(os.path.normpath(p), '')
+                for p in paths if os.path.isdir(p)]
+        if not dirs:
+            return
+
+        existing = dict.fromkeys(filenames)
+        cursor = self._conn.execute('select filename from file_tags')
+        removed = [(f,) for (f,) in cursor
+                   if f not in existing and
+                   [d for d in dirs if f.startswith(d)]]
+
+        self._conn.executemany('delete from file_tags where filename = ?',
+                               removed)
+        self._conn.commit()
+
+#########################################################################
+class DICOMScanner:
+    """Scans a list of files and directories for DICOM files in the
+    background.
+
+    L{start} starts a thread that finds all files, looks them up in the
+    L{ScanIndex} and scans all new or changed files in blocks with
+    L{scan_block}.  On POSIX systems, blocks are scanned in parallel by a
+    pool of num_processes worker processes; elsewhere, they are scanned
+    by the scanner thread itself.
+
+    Results are made available as they arrive: the user interface should
+    periodically call L{get_results}, also to get the results of
+    unchanged files, which are returned straight from the index.  A scan
+    can be stopped at any time with L{cancel}; blocks that have already
+    been scanned are kept in the index.
+    """
+
+    def __init__(self, paths, index_filename, num_processes=0,
+                 block_size=100):
+        """
+        @param index_filename: filename of ScanIndex, or None to scan
+        without index.
+        @param num_processes: number of worker processes, or 0 for the
+        number of CPUs.
+        """
+
+        self.paths = paths
+        self.index_filename = index_filename
+        self.num_processes = num_processes
+        self.block_size = block_size
+
+        # total number of files to process, known once all files have
+        # been found; and number of files that have been processed
+        self.num_files = 0
+        self.num_done = 0
+        # number of files that came from the index
+        self.num_unchanged = 0
+        # exception that stopped the scan, if any
+        self.error = None
+
+        self._results = Queue.Queue()
+        self._cancelled = False
+        self._pool = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stop the scan.  This returns immediately, the scanner thread
+        stops as soon as possible after that.
+        """
+
+        self._cancelled = True
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def is_running(self):
+        return self._thread is not None and self._thread.isAlive()
+
+    def get_results(self):
+        """Return list of all (filename, file_tags) tuples that have
+        arrived since the previous call.  file_tags is None for files
+        that are not DICOM.
+        """
+
+        results = []
+        while True:
+            try:
+                results.extend(self._results.get_nowait())
+            except Queue.Empty:
+                return results
+
+    def _get_num_processes(self):
+        if os.name != 'posix' or hasattr(sys, 'frozen'):
+            # worker processes would have to re-import DeVIDE
+            return 1
+
+        try:
+            import multiprocessing
+        except ImportError:
+            return 1
+
+        if self.num_processes > 0:
+            return self.num_processes
+
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+
+    def _run(self):
+        index = None
+        try:
+            try:
+                if self.index_filename:
+                    index = ScanIndex(self.index_filename)
+
+                self._scan(index)
+
+            except Exception, e:
+                if not self._cancelled:
+                    self.error = e
+
+        finally:
+            if index is not None:
+                index.close()
+
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def _scan(self, index):
+        filenames = find_files(self.paths)
+
+        stats = {}
+        for filename in filenames:
+            stat = get_file_stat(filename)
+            if stat is not None:
+                stats[filename] = stat
+
+        self.num_files = len(stats)
+
+        if index is None:
+            unchanged = {}
+        else:
+            index.prune(self.paths, filenames)
+            unchanged = index.get_unchanged(stats)
+
+        if unchanged:
+            self.num_unchanged = self.num_done = len(unchanged)
+            self._results.put(unchanged.items())
+
+        todo = [f for f in filenames if f in stats and f not in unchanged]
+        blocks = [todo[i:i + self.block_size]
+                  for i in range(0, len(todo), self.block_size)]
+
+        num_processes = self._get_num_processes()
+        if num_processes > 1 and len(blocks) > 1:
+            import multiprocessing
+            self._pool = multiprocessing.Pool(num_processes)
+            block_iter = self._pool.imap_unordered(scan_block, blocks)
+
+            def get_next_block():
+                # wait with timeout, so that we notice cancellation
+                while not self._cancelled:
+                    try:
+                        return block_iter.next(0.5)
+                    except multiprocessing.TimeoutError:
+                        pass
+
+                raise StopIteration
+
+        else:
+            block_iter = iter(blocks)
+
+            def get_next_block():
+                return scan_block(block_iter.next())
+
+        while not self._cancelled:
+            try:
+                results = get_next_block()
+            except StopIteration:
+                break
+
+            if index is not None:
+                index.store(results, stats)
+
+            self.num_done += len(results)
+            self._results.put(results)
@@ -0,0 +1,383 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Overlap and surface distance metrics for binary masks.
+
+This module is used by MaskComBinar, but only depends on numpy and VTK,
+so that it can also be used headless, e.g. from DeVIDE scripts:
+
+    from modules.viewers import maskcombinar_metrics
+    sd = maskcombinar_metrics.compute_surface_distances(image_a, image_b)
+    print sd.get_hausdorff(), sd.get_mean(), sd.get_percentile(95)
+
+    ms = maskcombinar_metrics.MaskSet(names, images)
+    print ms.get_dice()
+    ms.write_csv('overlap.csv')
+"""
+
+import csv
+from module_kits.numpy_kit import bridge
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+def get_mask_array(image_data):
+    """Return boolean (z,y,x) numpy array that is True where the first
+    scalar component of vtkImageData image_data is larger than 0.
+    """
+
+    scalars = bridge.vtk_to_numpy(image_data)
+    if scalars.ndim == 4:
+        scalars = scalars[..., 0]
+
+    return scalars > 0
+
+def check_same_grid(image_a, image_b):
+    """Raise ValueError if vtkImageData image_a and image_b do not have
+    the same extent, spacing and origin.
+    """
+
+    if image_a.GetExtent() != image_b.GetExtent():
+        raise ValueError('Masks have different extents: %s and %s.' %
+                         (image_a.GetExtent(), image_b.GetExtent()))
+
+    for attr in ('Spacing', 'Origin'):
+        va = getattr(image_a, 'Get' + attr)()
+        vb = getattr(image_b, 'Get' + attr)()
+        if numpy.abs(numpy.subtract(va, vb)).max() > 1e-6:
+            raise ValueError('Masks have different %s: %s and %s.' %
+                             (attr.lower(), va, vb))
+
+def get_surface(mask):
+    """Return boolean array that is True for all voxels of boolean array
+    mask that are on and have at least one 6-connected neighbour that is
+    off.  Voxels outside the array are off.
+    """
+
+    interior = mask.copy()
+    for axis in range(3):
+        n = mask.shape[axis]
+        if n == 1:
+            # 2D mask: this axis has no neighbours
+            continue
+
+        lo = [slice(None)] * 3
+        hi = [slice(None)] * 3
+        lo[axis] = slice(0, n - 1)
+        hi[axis] = slice(1, n)
+        interior[tuple(lo)] &= mask[tuple(hi)]
+        interior[tuple(hi)] &= mask[tuple(lo)]
+
+        lo[axis] = 0
+        hi[axis] = n - 1
+        interior[tuple(lo)] = False
+        interior[tuple(hi)] = False
+
+    return mask & ~interior
+
+def get_squared_distance_map(surface, spacing):
+    """Return array with squared world distance from every voxel to the
+    nearest True voxel in boolean array surface.
+    """
+
+    nz, ny, nx = surface.shape
+    image = vtk.vtkImageData()
+    image.SetDimensions(nx, ny, nz)
+    image.SetSpacing(spacing)
+    image.SetScalarTypeToUnsignedChar()
+    image.SetNumberOfScalarComponents(1)
+    # vtkImageEuclideanDistance computes distance to the nearest 0 voxel
+    image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(
+        (~surface).astype(numpy.uint8).ravel(), 1))
+
+    ed = vtk.vtkImageEuclideanDistance()
+    ed.SetInput(image)
+    ed.InitializeOn()
+    ed.ConsiderAnisotropyOn()
+    ed.SetAlgorithmToSaito()
+    ed.Update()
+
+    return numpy_support.vtk_to_numpy(
+        ed.GetOutput().GetPointData().GetScalars()).reshape(surface.shape)
+
+def get_percentile(values, p):
+    """Return p-th percentile (0 <= p <= 100) of the values in 1D numpy
+    array values, interpolating linearly between the closest ranks.
+    """
+
+    values = numpy.sort(values)
+    rank = (len(values) - 1) * p / 100.0
+    lo = int(numpy.floor(rank))
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (rank - lo)
+
+class SurfaceDistances:
+    """Distances between the surfaces of two masks A and B, as computed
+    by L{compute_surface_distances}.
+
+    The surface of a mask is sampled at its surface voxels, i.e. the
+    mask voxels with at least one 6-connected neighbour outside the mask.
+    points_a are the world coordinates of the surface voxels of A and
+    distances_a their distances to the surface of B; points_b and
+    distances_b are the same for B.  These per-point arrays can be used
+    to colour the surfaces, the get_ methods summarise them.
+    """
+
+    def __init__(self, points_a, distances_a, points_b, distances_b):
+        self.points_a = points_a
+        self.distances_a = distances_a
+        self.points_b = points_b
+        self.distances_b = distances_b
+
+    def get_directed_hausdorff(self):
+        """Return directed Hausdorff distances (A to B, B to A).
+        """
+
+        return self.distances_a.max(), self.distances_b.max()
+
+    def get_hausdorff(self):
+        """Return symmetric Hausdorff distance.
+        """
+
+        return max(self.get_directed_hausdorff())
+
+    def get_directed_mean(self):
+        """Return directed mean surface distances (A to B, B to A).
+        """
+
+        return self.distances_a.mean(), self.distances_b.mean()
+
+    def get_mean(self):
+        """Return symmetric mean surface distance, the average of the two
+        directed means.
+        """
+
+        return 0.5 * sum(self.get_directed_mean())
+
+    def get_directed_percentile(self, p):
+        """Return directed p-th percentile surface distances (A to B, B to
+        A).
+        """
+
+        return (get_percentile(self.distances_a, p),
+                get_percentile(self.distances_b, p))
+
+    def get_percentile(self, p):
+        """Return symmetric p-th percentile surface distance, the maximum
+        of the two directed percentiles (e.g. the 95% Hausdorff distance
+        for p = 95).
+        """
+
+        return max(self.get_directed_percentile(p))
+
+def compute_surface_distances(image_a, image_b):
+    """Compute distances between the surfaces of the masks in
+    vtkImageData image_a and image_b, which have to be on the same grid.
+    Voxels with a value larger than 0 are in the mask.
+
+    The distance maps are only computed on the bounding box of both
+    masks, so that memory use and time depend on the size of the masks,
+    not of the volume.  Distances are accurate up to the voxel size.
+
+    @return: L{SurfaceDistances} instance.
+    @raise ValueError: if the masks are not on the same grid or one of
+    them is empty.
+    """
+
+    check_same_grid(image_a, image_b)
+
+    mask_a = get_mask_array(image_a)
+    mask_b = get_mask_array(image_b)
+    if not mask_a.any() or not mask_b.any():
+        raise ValueError('Surface distances are undefined for empty masks.')
+
+    # crop both masks to the bounding box of their union
+    union = mask_a | mask_b
+    crop = []
+    for on in (union.any(2).any(1), union.any(2).any(0),
+               union.any(1).any(0)):
+        on = numpy.flatnonzero(on)
+        crop.append(slice(on[0], on[-1] + 1))
+
+    del union
+    crop = tuple(crop)
+    surface_a = get_surface(mask_a[crop])
+    surface_b = get_surface(mask_b[crop])
+
+    # numpy arrays are (z,y,x), VTK spacing and origin (x,y,z)
+    spacing = numpy.array(image_a.GetSpacing(), float)
+    extent_min = numpy.array(image_a.GetExtent()[0::2])
+    crop_min = numpy.array([s.start for s in crop][::-1])
+    offset = numpy.array(image_a.GetOrigin(), float) + \
+             spacing * (extent_min + crop_min)
+
+    def directed(surface, other_surface):
+        distances = numpy.sqrt(get_squared_distance_map(
+            other_surface, tuple(spacing))[surface])
+        idx = numpy.array(numpy.nonzero(surface)[::-1], float).transpose()
+        return offset + spacing * idx, distances
+
+    points_a, distances_a = directed(surface_a, surface_b)
+    points_b, distances_b = directed(surface_b, surface_a)
+
+    return SurfaceDistances(points_a, distances_a, points_b, distances_b)
+
+class MaskSet:
+    """A number of masks on the same grid, with all pairwise overlap
+    metrics.
+
+    The masks are read once and stored bit-packed (one bit per voxel per
+    mask), cropped to the bounding box of all masks.  The pairwise
+    intersection counts of all masks are then computed together in a
+    single pass over the packed masks: for every chunk of voxels, the
+    chunk is unpacked into a masks x voxels 0/1 matrix M and M M^T is
+    added to the counts.  The diagonal holds the mask sizes, so all
+    metrics follow from this one matrix.
+    """
+
+    # number of packed bytes (8 voxels each) that is unpacked at once
+    CHUNK_BYTES = 2**17
+
+    def __init__(self, names, images):
+        """
+        @param names: list of mask names.
+        @param images: list of vtkImageData masks, in the same order.
+        Voxels with a value larger than 0 are in the mask.
+        @raise ValueError: if the masks are not all on the same grid.
+        """
+
+        self.names = list(names)
+        # names of masks with values other than 0 and 1
+        self.non_binary = []
+
+        for image in images[1:]:
+            check_same_grid(images[0], image)
+
+        # first pass: bounding box of all masks.  Only one unpacked mask
+        # is kept in memory at a time.
+        lo = None
+        for name, image in zip(self.names, images):
+            if image.GetScalarRange()[1] > 1:
+                self.non_binary.append(name)
+
+            mask = get_mask_array(image)
+            if not mask.any():
+                continue
+
+            bounds = [numpy.flatnonzero(on)[[0,-1]] for on in
+                      (mask.any(2).any(1), mask.any(2).any(0),
+                       mask.any(1).any(0))]
+            if lo is None:
+                lo = [b[0] for b in bounds]
+                hi = [b[1] for b in bounds]
+            else:
+                lo = [min(l, b[0]) for l, b in zip(lo, bounds)]
+                hi = [max(h, b[1]) for h, b in zip(hi, bounds)]
+
+        # second pass: pack the cropped masks
+        if lo is None:
+            # all masks are empty
+            self.packed = numpy.zeros((len(images), 0), numpy.uint8)
+        else:
+            crop = tuple([slice(l, h + 1) for l, h in zip(lo, hi)])
+            self.packed = numpy.array(
+                [numpy.packbits(get_mask_array(image)[crop].ravel())
+                 for image in images], numpy.uint8)
+
+        if images:
+            spacing = images[0].GetSpacing()
+            self.voxel_volume = spacing[0] * spacing[1] * spacing[2]
+        else:
+            self.voxel_volume = 1.0
+
+        self.intersections = self._get_intersection_counts()
+
+    def _get_intersection_counts(self):
+        n = len(self.names)
+        counts = numpy.zeros((n, n))
+        for b0 in range(0, self.packed.shape[1], self.CHUNK_BYTES):
+            bits = numpy.unpackbits(
+                self.packed[:,b0:b0+self.CHUNK_BYTES], axis=1)
+            bits = bits.astype(numpy.float32)
+            # float32 is exact for counts up to 2**24, which is more than
+            # the number of voxels in a chunk
+            counts += numpy.dot(bits, bits.transpose())
+
+        return counts
+
+    def get_voxel_counts(self):
+        """Return array with number of voxels in every mask.
+        """
+
+        return self.intersections.diagonal().copy()
+
+    def get_volumes(self):
+        """Return array with volume of every mask in ml (assuming the
+        spacing is in mm).
+        """
+
+        return self.get_voxel_counts() * self.voxel_volume / 1000.0
+
+    def get_intersection_volumes(self):
+        """Return matrix with volume of pairwise intersections in ml.
+        """
+
+        return self.intersections * self.voxel_volume / 1000.0
+
+    def get_dice(self):
+        """Return matrix with pairwise Dice coefficients, 2 |A n B| / (|A|
+        + |B|).  The coefficient of two empty masks is 1.
+        """
+
+        c = self.get_voxel_counts()
+        return _safe_divide(2.0 * self.intersections, c[:,None] + c[None,:])
+
+    def get_jaccard(self):
+        """Return matrix with pairwise Jaccard indices, |A n B| / |A u B|.
+        The index of two empty masks is 1.
+        """
+
+        c = self.get_voxel_counts()
+        return _safe_divide(self.intersections,
+                            c[:,None] + c[None,:] - self.intersections)
+
+    def get_intersecting_pairs(self):
+        """Return list of (name1, name2) tuples of all intersecting masks.
+        """
+
+        i, j = numpy.nonzero(numpy.triu(self.intersections, 1))
+        return [(self.names[a], self.names[b]) for a, b in zip(i, j)]
+
+    def write_csv(self, filename):
+        """Write all pairwise metrics to CSV file filename, one row per
+        pair of masks.
+        """
+
+        volumes = self.get_volumes()
+        intersection_volumes = self.get_intersection_volumes()
+        dice = self.get_dice()
+        jaccard = self.get_jaccard()
+
+        f = open(filename, 'wb')
+        try:
+            w = csv.writer(f)
+            w.writerow(['mask_a', 'mask_b', 'volume_a_ml', 'volume_b_ml',
+                        'intersection_ml', 'dice', 'jaccard', 'intersects'])
+            n = len(self.names)
+            for i in range(n):
+                for j in range(i + 1, n):
+                    w.writerow([self.names[i], self.names[j],
+                                '%f' % (volumes[i],), '%f' % (volumes[j],),
+                                '%f' % (intersection_volumes[i,j],),
+                                '%f' % (dice[i,j],), '%f' % (jaccard[i,j],),
+                                int(self.intersections[i,j] > 0)])
+        finally:
+            f.close()
+
+def _safe_divide(numerator, denominator):
+    # x / 0 only happens for two empty masks, which overlap perfectly
+    result = numpy.ones(numerator.shape)
+    nz = denominator > 0
+    result[nz] = numerator[nz] / denominator[nz]
+    return result
@@ -42,7 +42,7 @@ class CodeRunner:
     """
 
 class CoMedI:
-    kits = ['vtk_kit', 'itk_kit', 'wx_kit']
+    kits = ['vtk_kit', 'itk_kit', 'wx_kit', 'vtktudoss_kit']
     cats = ['Viewers']
     keywords = ['compare', 'comparative visualisation',
             'comparative', 'comparative visualization']
@@ -54,7 +54,7 @@ class CoMedI:
             """
 
 class DICOMBrowser:
-    kits = ['vtk_kit', 'gdcm_kit']
+    kits = ['vtk_kit', 'gdcm_kit', 'sqlite_kit']
     cats = ['Viewers', 'Readers', 'DICOM', 'Medical']
     help = \
     """DICOMBrowser.  Does for DICOM reading what slice3dVWR does for
@@ -62,6 +62,14 @@ class DICOMBrowser:
 
     See the main DeVIDE help file (Special Modules | DICOMBrowser) for
     more information.  
+
+    Scanning happens in the background, and can be cancelled with the
+    Scan button.  On POSIX systems, files are scanned in parallel by
+    scan_processes processes (see the module config; 0, the default,
+    means one per CPU).  Scanned files are kept in an sqlite index, so
+    that a re-scan only reads new and changed files.  By default, this
+    is dicom_scan_index.db in the per-user DeVIDE directory; set
+    scan_index_filename in the module config to use another file.
     """
 
 class histogram1D:
@@ -110,7 +118,7 @@ class LarynxMeasurement:
     """
 
 class MaskComBinar:
-    kits = ['vtk_kit', 'wx_kit']
+    kits = ['vtk_kit', 'wx_kit', 'itk_kit', 'numpy_kit']
     cats = ['Viewers','Readers','Writers','Combine']
     help = """An interactive tool for viewing and perfoming operations on binary masks.
     
@@ -129,13 +137,9 @@ class MaskComBinar:
     Masks may be deleted (pressind "Del" once they are selected).
     Any mask shown in the listboxes may be saved to file (Ctrl-S).
     
-    The Hausdorff distance can only be calculated if the Metro tool has been installed so that it is available in the
-    command prompt. If Metro is not installed the Hausdorff operation will report an error.
-    Furthermore, MaskComBinar currently only supports the WINDOWS version of Metro since it calls metro.exe and relies
-    on the windows-specific command-line output generated by the windows version of Metro. Future versions should also work
-    with the Linux version, but this has not yet been tested.
-    
-    Metro can be downloaded from http://vcg.sourceforge.net/index.php/Metro   
+    The (mean) Hausdorff distance is computed between the surface voxels of the two masks using a Euclidean distance
+    transform, so it is accurate up to the voxel size. The same computation is available without the GUI in
+    maskcombinar_metrics.py, which also provides directed and percentile distances and per-point distance arrays.
     
     Known bug: Under some circumstances the module gets confused with pre-computed 3D isosurfaces (for display purposes).
     This can make the module use (leak) working memory, or cause the wrong isosurface to be displayed. 
@@ -144,7 +148,7 @@ class MaskComBinar:
     (Module by Francois Malan)"""
     
 class Measure2D:
-    kits = ['wx_kit', 'vtk_kit', 'geometry_kit']
+    kits = ['wx_kit', 'vtk_kit', 'geometry_kit', 'vtktudoss_kit']
     cats = ['Viewers']
     help = """Module for performing 2D measurements on image slices.
 
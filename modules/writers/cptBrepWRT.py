@@ -1,12 +1,18 @@
 # $Id$
 
 from module_base import ModuleBase
-from module_mixins import FilenameViewModuleMixin
+from module_mixins import ScriptedConfigModuleMixin
 import module_utils
+import numpy
 import vtk
+from vtk.util import numpy_support
+import wx # need this for wx.SAVE
 
+# number of points or triangles that are formatted and written in one
+# go.  This bounds the memory we need on top of the input mesh.
+CHUNK_SIZE = 2**16
 
-class cptBrepWRT(FilenameViewModuleMixin, ModuleBase):
+class cptBrepWRT(ScriptedConfigModuleMixin, ModuleBase):
 
     def __init__(self, module_manager):
 
@@ -19,48 +25,108 @@ class cptBrepWRT(FilenameViewModuleMixin, ModuleBase):
             self, self._triFilter,
             'Converting to triangles')
 
-        # ctor for this specific mixin
-        FilenameViewModuleMixin.__init__(
-            self,
-            'Select a filename',
-            'brep files (*.brep)|*.brep|All files (*)|*',
-            {'Module (self)' : self,
-             'vtkTriangleFilter': self._triFilter},
-            fileOpen=False)
-
         # set up some defaults
         self._config.filename = ''
+        self._config.binary = False
+
+        config_list = [
+            ('Filename:', 'filename', 'base:str', 'filebrowser',
+             'Output filename.',
+             {'fileMode' : wx.SAVE,
+              'fileMask' : 'brep files (*.brep)|*.brep|All files (*)|*'}),
+            ('Binary:', 'binary', 'base:bool', 'checkbox',
+             'Write the binary variant of the format, which is much '
+             'smaller and faster to write and read.')]
+
+        ScriptedConfigModuleMixin.__init__(
+            self, config_list,
+            {'Module (self)' : self,
+             'vtkTriangleFilter': self._triFilter})
+
         self.sync_module_logic_with_config()
-        
+
     def close(self):
         # we should disconnect all inputs
         self.set_input(0, None)
+        ScriptedConfigModuleMixin.close(self)
+        ModuleBase.close(self)
         del self._triFilter
-        FilenameViewModuleMixin.close(self)
 
     def get_input_descriptions(self):
 	return ('vtkPolyData',)
-    
+
     def set_input(self, idx, inputStream):
         self._triFilter.SetInput(inputStream)
-    
+
     def get_output_descriptions(self):
 	return ()
-    
+
     def get_output(self, idx):
         raise Exception
-    
+
     def logic_to_config(self):
         pass
 
     def config_to_logic(self):
         pass
 
-    def view_to_config(self):
-        self._config.filename = self._getViewFrameFilename()
-
-    def config_to_view(self):
-        self._setViewFrameFilename(self._config.filename)
+    def _get_faces(self, polyData):
+        """Return (n,3) array with the point indices of all n triangles
+        in polyData.
+        """
+
+        # the triangle filter has turned all polygons and strips into
+        # triangles, so the polys cell array is [3, i0, i1, i2, 3, ...]
+        cells = numpy_support.vtk_to_numpy(polyData.GetPolys().GetData())
+        if cells.size % 4 == 0:
+            cells = cells.reshape((-1, 4))
+            if (cells[:,0] == 3).all():
+                # view, no copy
+                return cells[:,1:]
+
+        # degenerate polygons: walk the cell array to pick out the
+        # triangles
+        faces = []
+        i = 0
+        while i < cells.size:
+            n = cells[i]
+            if n == 3:
+                faces.append(cells[i + 1:i + 4])
+
+            i += n + 1
+
+        return numpy.array(faces, dtype=cells.dtype).reshape((-1, 3))
+
+    def _write_text(self, f, points, faces):
+        f.write('%d\n%d\n' % (len(points), len(faces)))
+
+        for what, array, fmt in (('points', points, '%f %f %f\n'),
+                                 ('triangles', faces, '%d %d %d\n')):
+            n = len(array)
+            for start in xrange(0, n, CHUNK_SIZE):
+                chunk = array[start:start + CHUNK_SIZE]
+                f.write((fmt * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+                self._module_manager.setProgress(
+                    100.0 * (start + len(chunk)) / n,
+                    'Writing %s' % (what,))
+
+    def _write_binary(self, f, points, faces):
+        # little-endian int32 number of points and triangles, then
+        # float64 x,y,z of every point, then int32 i0,i1,i2 of every
+        # triangle
+        numpy.array([len(points), len(faces)], '<i4').tofile(f)
+
+        for what, array, dtype in (('points', points, '<f8'),
+                                   ('triangles', faces, '<i4')):
+            n = len(array)
+            for start in xrange(0, n, CHUNK_SIZE):
+                chunk = array[start:start + CHUNK_SIZE]
+                numpy.ascontiguousarray(chunk, dtype).tofile(f)
+
+                self._module_manager.setProgress(
+                    100.0 * (start + len(chunk)) / n,
+                    'Writing %s' % (what,))
 
     def execute_module(self):
         if len(self._config.filename) and self._triFilter.GetInput():
@@ -69,49 +135,26 @@ class cptBrepWRT(FilenameViewModuleMixin, ModuleBase):
             polyData = self._triFilter.GetOutput()
             polyData.Update()
 
-            # this will throw an exception if something went wrong.
-            
-            
-            # list of tuples, each tuple contains three indices into vertices
-            # list constituting a triangle face
-            faces = []
-
             self._module_manager.setProgress(10,'Extracting triangles')
-            # blaat.
-            numCells = polyData.GetNumberOfCells()
-            for cellIdx in xrange(numCells):
-                c = polyData.GetCell(cellIdx)
-                # make sure we're working with triangles
-                if c.GetClassName() == 'vtkTriangle':
-                    pointIds = c.GetPointIds()
-                    if pointIds.GetNumberOfIds() == 3:
-                        faces.append((pointIds.GetId(0), pointIds.GetId(1),
-                                      pointIds.GetId(2)))
+            faces = self._get_faces(polyData)
+
+            if polyData.GetNumberOfPoints() > 0:
+                points = numpy_support.vtk_to_numpy(
+                    polyData.GetPoints().GetData())
+            else:
+                points = numpy.zeros((0, 3))
 
             # now we can finally write
-            f = file(self._config.filename, 'w')
-            f.write('%d\n%d\n' % (polyData.GetNumberOfPoints(), len(faces)))
-
-            numPoints = polyData.GetNumberOfPoints()
-            for ptIdx in xrange(numPoints):
-                # polyData.GetPoint() returns a 3-tuple
-                f.write('%f %f %f\n' % polyData.GetPoint(ptIdx))
-
-                pp = ptIdx / numPoints * 100.0
-                if pp % 10 == 0:
-                    self._module_manager.setProgress(
-                        pp, 'Writing points')
-
-            numFaces = len(faces)
-            faceIdx = 0
-            for face in faces:
-                f.write('%d %d %d\n' % face)
-
-                # this is just for progress
-                faceIdx += 1
-
-                pp = faceIdx / numFaces * 100.0
-                if pp % 10 == 0:
-                    self._module_manager.setProgress(
-                        pp, 'Writing triangles')
-            
+            if self._config.binary:
+                f = open(self._config.filename, 'wb')
+            else:
+                f = open(self._config.filename, 'w')
+
+            try:
+                if self._config.binary:
+                    self._write_binary(f, points, faces)
+                else:
+                    self._write_text(f, points, faces)
+
+            finally:
+                f.close()
@@ -1,5 +1,5 @@
 class batchConverter:
-    kits = ['vtk_kit', 'wx_kit']
+    kits = ['vtk_kit', 'wx_kit', 'itk_kit']
     cats = ['Readers','Writers','Converters']
     keywords = ['batch','convert','read','write','vti','mha','gipl']
     help = """Batch converts image volume files from one type to another.
@@ -19,12 +19,20 @@ class batchConverter:
     (Module by Francois Malan)"""
 
 class cptBrepWRT:
-    kits = ['vtk_kit']
+    kits = ['vtk_kit', 'numpy_kit']
     cats = ['Writers']    
     help = """Writes polydata to disc in the format required by the Closest
     Point Transform (CPT) driver software.  Input data is put through
     a triangle filter first, as that is what the CPT requires.
 
+    If Binary is checked, the binary variant of the format is written:
+    the number of points and the number of triangles as little-endian
+    32-bit integers, then x,y,z of every point as little-endian 64-bit
+    floats, then the three point indices of every triangle as
+    little-endian 32-bit integers.  Points and triangles are written in
+    chunks, so very large meshes need little memory on top of the mesh
+    itself.
+
     See the
     <a href="http://www.acm.caltech.edu/~seanm/projects/cpt/cpt.html">CPT
     home page</a> for more information about the algorithm and the
@@ -77,7 +77,7 @@ class vtiWRT(FilenameViewModuleMixin, ModuleBase):
 
     def streaming_execute_module(self):
         if len(self._writer.GetFileName()) and self._writer.GetInput():
-            sp = self._module_manager.get_app_main_config().streaming_pieces
+            sp = self._module_manager.get_streaming_pieces(self)
             self._writer.SetNumberOfPieces(sp)
             self._writer.Write()
 
@@ -0,0 +1,399 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Layered (Sugiyama-style) layout of module networks.
+
+The layout only needs the instance names of the modules and the
+connections between them, as returned by NetworkManager.load_network and
+ModuleManager.serialise_module_instances, so it also works without the
+graph editor, e.g. for networks that are built by scripts.
+
+Data flows from the top to the bottom, as in the graph editor, so
+producers end up in layers above their consumers.  The layout has the
+usual four phases:
+
+ 1. cycles are broken by reversing the back edges of a depth-first
+    search;
+ 2. every module is put in the layer below its lowest producer, sources
+    are moved down to just above their highest consumer, and every
+    connection that spans more than one layer gets a dummy vertex in
+    each layer that it passes through;
+ 3. crossings are reduced by ordering the layers on the barycentres of
+    their neighbours, in alternating downward and upward sweeps,
+    keeping the ordering with the fewest crossings;
+ 4. every vertex is centred on its neighbours, as far as the order and
+    spacing in its layer allow.
+
+Every phase is linear in the number of vertices and edges, dummies
+included, apart from sorting and crossing counting, which add a log
+factor.  The number of sweeps is fixed.
+"""
+
+# (width, height) that is assumed for glyphs of unknown size
+DEFAULT_GLYPH_SIZE = (150, 70)
+# horizontal space between glyphs in a layer
+H_SPACING = 40
+# vertical space between layers, this has to leave room for the ports
+# and for routing connections
+V_SPACING = 80
+# horizontal space taken up by a connection passing through a layer
+DUMMY_WIDTH = 20
+# number of downward plus upward ordering sweeps
+NUM_SWEEPS = 8
+# number of downward plus upward positioning passes
+NUM_POSITION_PASSES = 4
+
+def layout_network(instance_names, connection_list, sizes=None,
+                   origin=(0, 0)):
+    """Return dictionary mapping from every name in instance_names to a
+    glyph position, i.e. the bottom left corner of the glyph in world
+    space.
+
+    Connections with an end that is not in instance_names are ignored,
+    so that a part of a network can be laid out on its own.
+
+    @param connection_list: list of PickledConnection instances.  Only
+    their source_instance_name and target_instance_name are used.
+    @param sizes: dictionary mapping from instance name to glyph (width,
+    height).  Missing sizes default to DEFAULT_GLYPH_SIZE.
+    @param origin: top left corner of the layout in world space.
+    """
+
+    names = list(instance_names)
+    if not names:
+        return {}
+
+    if sizes is None:
+        sizes = {}
+
+    index = dict([(name, i) for i, name in enumerate(names)])
+    edges = {}
+    for c in connection_list:
+        u = index.get(c.source_instance_name)
+        v = index.get(c.target_instance_name)
+        if u is not None and v is not None and u != v:
+            edges[(u, v)] = 1
+
+    num_real = len(names)
+    edges = _remove_cycles(num_real, edges.keys())
+    layer_of = _assign_layers(num_real, edges)
+
+    # split long edges with dummy vertices
+    widths = [sizes.get(name, DEFAULT_GLYPH_SIZE)[0] for name in names]
+    ups = [[] for i in range(num_real)]
+    downs = [[] for i in range(num_real)]
+    for u, v in edges:
+        prev = u
+        for layer in range(layer_of[u] + 1, layer_of[v]):
+            d = len(layer_of)
+            layer_of.append(layer)
+            widths.append(DUMMY_WIDTH)
+            ups.append([prev])
+            downs.append([])
+            downs[prev].append(d)
+            prev = d
+
+        downs[prev].append(v)
+        ups[v].append(prev)
+
+    layers = [[] for i in range(max(layer_of) + 1)]
+    for v in _get_initial_order(num_real, downs, ups):
+        layers[layer_of[v]].append(v)
+
+    layers = _order_layers(layers, ups, downs)
+    centres = _position_layers(layers, widths, ups, downs)
+
+    # layers are stacked downwards from the origin
+    heights = [0] * len(layers)
+    for i in range(num_real):
+        height = sizes.get(names[i], DEFAULT_GLYPH_SIZE)[1]
+        heights[layer_of[i]] = max(heights[layer_of[i]], height)
+
+    tops = []
+    top = origin[1]
+    for height in heights:
+        tops.append(top)
+        top -= height + V_SPACING
+
+    left = min([centres[i] - widths[i] / 2.0 for i in range(num_real)])
+    positions = {}
+    for i, name in enumerate(names):
+        height = sizes.get(name, DEFAULT_GLYPH_SIZE)[1]
+        positions[name] = (
+            origin[0] + centres[i] - widths[i] / 2.0 - left,
+            tops[layer_of[i]] - height)
+
+    return positions
+
+def complete_positions(instance_names, connection_list, positions):
+    """Return copy of positions to which the layout of all names in
+    instance_names that have no position has been added.
+
+    This is used for networks in which some or all modules have no
+    glyph position.  The new modules are laid out to the right of the
+    modules that do have a position.
+    """
+
+    missing = [name for name in instance_names if name not in positions]
+    positions = positions.copy()
+    if not missing:
+        return positions
+
+    if positions:
+        xs = [p[0] for p in positions.values()]
+        ys = [p[1] for p in positions.values()]
+        origin = (max(xs) + DEFAULT_GLYPH_SIZE[0] + H_SPACING,
+                  max(ys) + DEFAULT_GLYPH_SIZE[1])
+    else:
+        origin = (0, 0)
+
+    positions.update(layout_network(missing, connection_list,
+                                    origin=origin))
+    return positions
+
+def _remove_cycles(num_vertices, edges):
+    """Return list of edges in which the back edges of a depth-first
+    search have been reversed, so that the graph is acyclic.
+    """
+
+    succs = [[] for i in range(num_vertices)]
+    for u, v in edges:
+        succs[u].append(v)
+
+    # 0: unvisited, 1: on the DFS stack, 2: done
+    state = [0] * num_vertices
+    reversed_edges = {}
+    for root in range(num_vertices):
+        if state[root]:
+            continue
+
+        state[root] = 1
+        stack = [(root, iter(succs[root]))]
+        while stack:
+            u, it = stack[-1]
+            for v in it:
+                if state[v] == 1:
+                    reversed_edges[(u, v)] = 1
+                elif state[v] == 0:
+                    state[v] = 1
+                    stack.append((v, iter(succs[v])))
+                    break
+            else:
+                state[u] = 2
+                stack.pop()
+
+    result = {}
+    for u, v in edges:
+        if (u, v) in reversed_edges:
+            result[(v, u)] = 1
+        else:
+            result[(u, v)] = 1
+
+    return result.keys()
+
+def _assign_layers(num_vertices, edges):
+    """Return list with the layer of every vertex, given acyclic edges.
+    """
+
+    succs = [[] for i in range(num_vertices)]
+    num_preds = [0] * num_vertices
+    for u, v in edges:
+        succs[u].append(v)
+        num_preds[v] += 1
+
+    # longest path layering in topological order
+    layer_of = [0] * num_vertices
+    todo = [v for v in range(num_vertices) if num_preds[v] == 0]
+    order = []
+    while todo:
+        u = todo.pop()
+        order.append(u)
+        for v in succs[u]:
+            layer_of[v] = max(layer_of[v], layer_of[u] + 1)
+            num_preds[v] -= 1
+            if num_preds[v] == 0:
+                todo.append(v)
+
+    # move sources, e.g. readers that only feed a module far down, to
+    # just above their highest consumer, which shortens their edges
+    has_preds = [False] * num_vertices
+    for u, v in edges:
+        has_preds[v] = True
+
+    for u in order:
+        if not has_preds[u] and succs[u]:
+            layer_of[u] = min([layer_of[v] for v in succs[u]]) - 1
+
+    # this can leave layers empty, so we renumber the layers in use
+    used = dict([(layer, 1) for layer in layer_of]).keys()
+    used.sort()
+    renumber = dict([(layer, i) for i, layer in enumerate(used)])
+    return [renumber[layer] for layer in layer_of]
+
+def _get_initial_order(num_real, downs, ups):
+    """Return all vertices in depth-first order from the sources, which
+    is a good starting point for the ordering sweeps because it keeps
+    connected vertices together.
+    """
+
+    num_vertices = len(downs)
+    seen = [False] * num_vertices
+    order = []
+    for root in range(num_real):
+        if seen[root] or ups[root]:
+            continue
+
+        seen[root] = True
+        stack = [root]
+        while stack:
+            u = stack.pop()
+            order.append(u)
+            for v in reversed(downs[u]):
+                if not seen[v]:
+                    seen[v] = True
+                    stack.append(v)
+
+    # vertices that are only reachable via cycles that were broken are
+    # already covered, but we play it safe
+    order.extend([v for v in range(num_vertices) if not seen[v]])
+    return order
+
+def _order_layers(layers, ups, downs):
+    """Reduce crossings with barycentre sweeps and return the best
+    ordering of layers that was found.
+    """
+
+    pos = {}
+    for layer in layers:
+        for i, v in enumerate(layer):
+            pos[v] = i
+
+    best = [layer[:] for layer in layers]
+    best_crossings = _count_all_crossings(layers, downs, pos)
+
+    for sweep in range(NUM_SWEEPS):
+        if best_crossings == 0:
+            break
+
+        if sweep % 2 == 0:
+            layer_indices = range(1, len(layers))
+            neighbours = ups
+        else:
+            layer_indices = range(len(layers) - 2, -1, -1)
+            neighbours = downs
+
+        for li in layer_indices:
+            layer = layers[li]
+            keys = []
+            for v in layer:
+                nbs = neighbours[v]
+                if nbs:
+                    key = float(sum([pos[n] for n in nbs])) / len(nbs)
+                else:
+                    # vertices without neighbours stay where they are
+                    key = pos[v]
+
+                keys.append((key, pos[v], v))
+
+            keys.sort()
+            layers[li] = layer = [v for key, p, v in keys]
+            for i, v in enumerate(layer):
+                pos[v] = i
+
+        crossings = _count_all_crossings(layers, downs, pos)
+        if crossings < best_crossings:
+            best_crossings = crossings
+            best = [layer[:] for layer in layers]
+
+    return best
+
+def _count_all_crossings(layers, downs, pos):
+    total = 0
+    for li in range(len(layers) - 1):
+        total += _count_crossings(layers[li], len(layers[li + 1]),
+                                  downs, pos)
+
+    return total
+
+def _count_crossings(layer, num_lower, downs, pos):
+    """Count the crossings between the edges from layer to the layer
+    below it, by counting the inversions in the lower positions of the
+    edges sorted on their upper positions, with a Fenwick tree.
+    """
+
+    lower = []
+    for u in layer:
+        lower.extend(sorted([pos[v] for v in downs[u]]))
+
+    tree = [0] * (num_lower + 1)
+    crossings = 0
+    for seen, p in enumerate(lower):
+        # count the edges seen so far with a lower position > p
+        i = p + 1
+        not_greater = 0
+        while i > 0:
+            not_greater += tree[i]
+            i -= i & -i
+
+        crossings += seen - not_greater
+
+        i = p + 1
+        while i <= num_lower:
+            tree[i] += 1
+            i += i & -i
+
+    return crossings
+
+def _position_layers(layers, widths, ups, downs):
+    """Return list with the x coordinate of the centre of every vertex.
+    """
+
+    centres = [0.0] * len(widths)
+    for layer in layers:
+        x = 0.0
+        for v in layer:
+            centres[v] = x + widths[v] / 2.0
+            x += widths[v] + H_SPACING
+
+    for p in range(NUM_POSITION_PASSES):
+        if p % 2 == 0:
+            layer_indices = range(1, len(layers))
+            neighbours = ups
+        else:
+            layer_indices = range(len(layers) - 2, -1, -1)
+            neighbours = downs
+
+        for li in layer_indices:
+            layer = layers[li]
+            if not layer:
+                continue
+
+            desired = []
+            for v in layer:
+                nbs = neighbours[v]
+                if nbs:
+                    desired.append(
+                        sum([centres[n] for n in nbs]) / len(nbs))
+                else:
+                    desired.append(centres[v])
+
+            # place from left to right, as close to the desired centre
+            # as the previous vertex allows, then shift the whole layer
+            # back by the average error
+            placed = []
+            for i, v in enumerate(layer):
+                c = desired[i]
+                if i > 0:
+                    prev = layer[i - 1]
+                    c = max(c, placed[-1] + (widths[prev] + widths[v]) /
+                            2.0 + H_SPACING)
+
+                placed.append(c)
+
+            shift = sum([d - c for d, c in zip(desired, placed)]) / \
+                    len(layer)
+            for i, v in enumerate(layer):
+                centres[v] = placed[i] + shift
+
+    return centres
@@ -7,6 +7,7 @@ from ConfigParser import NoOptionError
 import copy
 from module_kits.misc_kit.mixins import SubjectMixin
 from module_manager import PickledModuleState, PickledConnection
+import network_layout
 import os
 import time
 import types
@@ -23,6 +24,11 @@ class NetworkManager(SubjectMixin):
         self._devide_app = devide_app
         SubjectMixin.__init__(self)
 
+        # the scheduler instance that was used during the previous network
+        # execution.  Different schedulers use different transfer
+        # timestamps, so after a switch all modules have to be visited.
+        self._previous_scheduler = None
+
     def close(self):
         SubjectMixin.close(self)
 
@@ -30,20 +36,49 @@ class NetworkManager(SubjectMixin):
         """Execute network represented by all modules in the list
         meta_modules.
 
+        Only the modules downstream of parts that have been modified,
+        connected or disconnected since the previous execution (the
+        dirty closure maintained by the ModuleManager) are handed to the
+        scheduler, so the cost of an execution is proportional to the
+        part of the network that is affected by the changes.
         """
 
         # trigger start event so that our observers can auto-save and
         # whatnot
         self.notify('execute_network_start')
 
-        # convert all MetaModules to schedulerModules
-        sms = self._devide_app.scheduler.meta_modules_to_scheduler_modules(
-            meta_modules)
+        mm = self._devide_app.get_module_manager()
+        scheduler = self._devide_app.scheduler
+
+        if scheduler.get_scheduler() is not self._previous_scheduler:
+            mm.mark_all_dirty()
+            self._previous_scheduler = scheduler.get_scheduler()
+
+        dirty_closure = mm.get_dirty_closure()
+
+        # convert all MetaModules to schedulerModules, then keep only
+        # those that could require transfers or execution
+        sms = [sm for sm in
+               scheduler.meta_modules_to_scheduler_modules(meta_modules)
+               if (sm.meta_module, sm.part) in dirty_closure]
 
         print "STARTING network execute ----------------------------"
         print time.ctime()
+        print "scheduling %d module parts (%d in dirty closure)" % \
+              (len(sms), len(dirty_closure))
+
+        mm.profiler.begin_run(
+            [(sm.meta_module, sm.part) for sm in sms],
+            scheduler.get_scheduler().__class__.__name__)
 
-        self._devide_app.scheduler.execute_modules(sms)
+        try:
+            scheduler.execute_modules(sms)
+        finally:
+            # whether or not execution completed, find out which parts
+            # still have outstanding work
+            mm.update_dirty_parts(dirty_closure.keys())
+            # this logs the per-module summary, if profiling is enabled
+            mm.profiler.end_run()
         
         self._devide_app.set_progress(100.0, 'Network execution complete.')
 
@@ -93,6 +128,9 @@ class NetworkManager(SubjectMixin):
 
         All occurrences of %(dvn_dir)s will be expanded to the
         directory that the DVN file is being loaded from.
+
+        Modules without a glyph_position, e.g. in networks that were
+        written by scripts, are laid out automatically.
         """
       
         # need this for substitution during reading of
@@ -166,10 +204,10 @@ class NetworkManager(SubjectMixin):
                     gp = eval(cp.get(sec, 'glyph_position'),
                              {"__builtins__": {}})
                 except NoOptionError:
-                    # no glyph_pos, so we assign it the default origin
-                    gp = (0,0)
-
-                glyph_pos_dict[pms.instance_name] = gp
+                    # no glyph_pos, this module will be laid out below
+                    pass
+                else:
+                    glyph_pos_dict[pms.instance_name] = gp
 
             elif sec.startswith('connections/'):
                 pc = PickledConnection()
@@ -188,6 +226,9 @@ class NetworkManager(SubjectMixin):
                     # valid connections
                     connection_list.append(pc)
 
+        glyph_pos_dict = network_layout.complete_positions(
+            pms_dict.keys(), connection_list, glyph_pos_dict)
+
         return pms_dict, connection_list, glyph_pos_dict
 
                 
@@ -265,11 +306,20 @@ class NetworkManager(SubjectMixin):
         ModuleManager._serialise_network, write the whole thing to disk
         as a config-style DVN file.
 
+        @param glyph_pos_dict: dictionary mapping from instance name to
+        glyph position.  Modules without a position, or all modules if
+        this is None, are laid out automatically.
         @param export: If True, will transform all filenames that are
         below the network directory to relative pathnames.  These will
         be expanded (relative to the loaded network) at load-time.
         """
 
+        if glyph_pos_dict is None:
+            glyph_pos_dict = {}
+
+        glyph_pos_dict = network_layout.complete_positions(
+            pms_dict.keys(), connection_list, glyph_pos_dict)
+
         cp = ConfigParser.ConfigParser()
 
         # general section with network configuration
@@ -0,0 +1,457 @@
+# Copyright (c) Charl P. Botha, TU Delft.
+# All rights reserved.
+# See COPYRIGHT for details.
+
+"""Content-addressed cache of module outputs.
+
+See the documentation of L{OutputCache} for details.
+"""
+
+import cPickle
+import hashlib
+import os
+import re
+import threading
+import types
+
+try:
+    from ast import literal_eval
+except ImportError:
+    literal_eval = None
+
+# bump this when the key or storage format changes, so that old on-disk
+# cache entries are never mistaken for new ones
+CACHE_FORMAT = 'devide-output-cache-2'
+
+# names of the output files in a disk entry
+ENTRY_FNAME_RE = re.compile('^[0-9]+\\.(vtk|npy)$')
+
+#########################################################################
+class OutputCacheException(Exception):
+    pass
+
+#########################################################################
+class OutputCache:
+    """Cache of module outputs, keyed on everything that determines them.
+
+    The key of a module execution is a hash of the full module name, the
+    module configuration as returned by get_config(), the modification
+    times and sizes of all files referred to by config attributes of
+    which the names contain 'filename' or 'file_name', and the
+    fingerprints of all outputs that are connected to the module's
+    inputs.  The fingerprint of an output is in turn derived from the
+    key of the execution that produced it.  Because keys do not depend
+    on the MetaModule timestamps, they remain valid after a network has
+    been reloaded or a module has been recreated.
+
+    When the ModuleManager is about to execute a module, it asks the
+    cache for its key.  If an entry for that key exists, the outputs are
+    restored into the MetaModule (see L{MetaModule.restore_outputs}) and
+    execute_module() is not called at all.  If not, the module is
+    executed and its outputs are stored.
+
+    Only single-part modules with at least one output can be cached:
+    modules without outputs are executed for their side effects
+    (writers, viewers) and multi-part modules are interactive.  Modules
+    can also opt out by setting the class attribute CACHE_OUTPUTS to
+    False.  If any of a module's inputs comes from a module that could
+    not be cached, that module can not be cached either.
+
+    Supported output types are VTK data objects, numpy arrays, ITK
+    images (memory only) and None.
+
+    On disk, every entry is a directory with one file per output and an
+    index that lists them.  The index is a repr() that is read back with
+    ast.literal_eval and checked, so entries never cause code to be run.
+
+    @ivar mode: 'memory' or 'disk'.
+    """
+
+    def __init__(self, module_manager, mode='memory', cache_dir=None,
+                 max_entries=100):
+        """
+        @param mode: 'memory' keeps at most max_entries copies of module
+        outputs in RAM, least recently used entries are discarded first.
+        'disk' writes outputs to cache_dir, so that they survive the
+        DeVIDE process, e.g. for batch runs.
+        @param cache_dir: directory for 'disk' mode.  Will be created,
+        only accessible by the user, if it does not exist.
+        """
+
+        if mode not in ('memory', 'disk'):
+            raise OutputCacheException(
+                'Unknown output cache mode %s.' % (mode,))
+
+        if mode == 'disk':
+            if not cache_dir:
+                raise OutputCacheException(
+                    'Disk output cache requires a cache directory.')
+
+            if literal_eval is None:
+                raise OutputCacheException(
+                    'Disk output cache requires Python 2.6 or newer.')
+
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0700)
+
+        self._module_manager = module_manager
+        self.mode = mode
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+        # key -> {output_idx : output copy}
+        self._memory_entries = {}
+        # keys, least recently used first
+        self._lru_keys = []
+        # the wavefront scheduler calls us from more than one thread
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.clear()
+        del self._module_manager
+
+    def clear(self):
+        """Remove all in-memory entries.  Disk entries are left alone.
+        """
+        self._lock.acquire()
+        try:
+            self._memory_entries.clear()
+            self._lru_keys = []
+        finally:
+            self._lock.release()
+
+    def get_key(self, meta_module, part=0):
+        """Determine cache key for executing part of meta_module.
+
+        @return: hex digest string, or None if the module can not be
+        cached.
+        """
+
+        instance = meta_module.instance
+
+        if meta_module.numParts > 1 or \
+           len(meta_module.outputs) == 0 or \
+           not getattr(instance, 'CACHE_OUTPUTS', True):
+            return None
+
+        # fingerprints of all connected producer outputs
+        input_fingerprints = []
+        for input_idx, input_tuple in enumerate(meta_module.inputs):
+            if input_tuple is None:
+                input_fingerprints.append(None)
+                continue
+
+            p_instance, p_output_idx = input_tuple
+            p_meta_module = self._module_manager.get_meta_module(p_instance)
+            fp = p_meta_module.output_fingerprints.get(p_output_idx)
+            if fp is None:
+                # producer is uncacheable, so are we
+                return None
+
+            input_fingerprints.append(fp)
+
+        try:
+            config_dict = instance.get_config().__dict__
+            config_items = config_dict.items()
+            config_items.sort()
+            config_string = cPickle.dumps(config_items, 0)
+
+        except Exception:
+            # no config, or config that can't be pickled
+            return None
+
+        h = hashlib.sha1(CACHE_FORMAT)
+        h.update(meta_module.module_name)
+        h.update(config_string)
+        h.update(repr(self._get_file_stamps(config_dict)))
+        h.update(repr(input_fingerprints))
+
+        return h.hexdigest()
+
+    def get_output_fingerprint(self, key, output_idx):
+        """Derive the fingerprint of an output from the key of the
+        execution that produced it.
+        """
+        return hashlib.sha1('%s:%d' % (key, output_idx)).hexdigest()
+
+    def restore(self, key, meta_module, part=0):
+        """Restore the outputs cached under key into meta_module.
+
+        @return: True if there was a cache entry, False otherwise.
+        """
+
+        if self.mode == 'memory':
+            self._lock.acquire()
+            try:
+                outputs = self._memory_entries.get(key)
+                if outputs is not None:
+                    self._lru_keys.remove(key)
+                    self._lru_keys.append(key)
+            finally:
+                self._lock.release()
+
+        else:
+            try:
+                outputs = self._read_disk_entry(key)
+            except Exception, e:
+                self._module_manager.log_warning(
+                    'Could not read output cache entry %s: %s' %
+                    (key, str(e)))
+                outputs = None
+
+        if outputs is None:
+            self.misses += 1
+            return False
+
+        # consumers could modify numpy arrays in place, so they get their
+        # own copy.  VTK outputs are shallow copied by the transfer.
+        outputs = outputs.copy()
+        for output_idx, od in outputs.items():
+            if get_output_type(od) == 'npy':
+                outputs[output_idx] = od.copy()
+
+        fingerprints = {}
+        for output_idx in outputs:
+            fingerprints[output_idx] = \
+                self.get_output_fingerprint(key, output_idx)
+
+        meta_module.restore_outputs(part, outputs, fingerprints)
+        self.hits += 1
+        return True
+
+    def store(self, key, meta_module, part=0):
+        """Store copies of the current outputs of meta_module under key
+        and record their fingerprints in meta_module.
+
+        If any of the outputs is of an unsupported type, nothing is
+        stored and the outputs get no fingerprints, which makes all
+        consumers uncacheable.
+        """
+
+        outputs = {}
+        for output_idx in range(len(meta_module.outputs)):
+            od = meta_module.get_output(output_idx)
+            if get_output_type(od) is None or \
+               (self.mode == 'disk' and get_output_type(od) == 'itk'):
+                return
+
+            outputs[output_idx] = od
+
+        if self.mode == 'memory':
+            copies = {}
+            for output_idx, od in outputs.items():
+                copies[output_idx] = copy_output(od)
+
+            self._lock.acquire()
+            try:
+                if key not in self._memory_entries:
+                    self._lru_keys.append(key)
+
+                self._memory_entries[key] = copies
+
+                while len(self._lru_keys) > self.max_entries:
+                    del self._memory_entries[self._lru_keys.pop(0)]
+            finally:
+                self._lock.release()
+
+        else:
+            try:
+                self._write_disk_entry(key, outputs)
+            except Exception, e:
+                self._module_manager.log_warning(
+                    'Could not write output cache entry %s: %s' %
+                    (key, str(e)))
+                return
+
+        for output_idx in outputs:
+            meta_module.output_fingerprints[output_idx] = \
+                self.get_output_fingerprint(key, output_idx)
+
+    def _get_file_stamps(self, config_dict):
+        """Return list of (filename, mtime, size) for all existing files
+        referred to by config attributes of which the names contain
+        'filename' or 'file_name'.
+        """
+
+        filenames = []
+        for k, v in config_dict.items():
+            if k.find('filename') >= 0 or k.find('file_name') >= 0:
+                if type(v) in [types.StringType, types.UnicodeType]:
+                    filenames.append(v)
+                elif type(v) in [types.ListType, types.TupleType]:
+                    filenames.extend(
+                        [p for p in v if type(p) in
+                         [types.StringType, types.UnicodeType]])
+
+        stamps = []
+        for fn in filenames:
+            try:
+                st = os.stat(fn)
+            except OSError:
+                # not (yet) a file, e.g. output filenames of writers
+                continue
+
+            stamps.append((fn, st.st_mtime, st.st_size))
+
+        stamps.sort()
+        return stamps
+
+    def _get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read_disk_entry(self, key):
+        entry_dir = self._get_entry_dir(key)
+        index_fname = os.path.join(entry_dir, 'index')
+        if not os.path.exists(index_fname):
+            return None
+
+        f = open(index_fname, 'rb')
+        try:
+            index = literal_eval(f.read())
+        finally:
+            f.close()
+
+        if not isinstance(index, dict):
+            raise OutputCacheException('Corrupt index.')
+
+        outputs = {}
+        for output_idx, (otype, fname) in index.items():
+            if otype == 'none':
+                outputs[output_idx] = None
+
+            elif otype in ('vtk', 'npy') and \
+                 ENTRY_FNAME_RE.match(str(fname)) and \
+                 fname.endswith(otype):
+                outputs[output_idx] = read_output(
+                    otype, os.path.join(entry_dir, fname))
+
+            else:
+                raise OutputCacheException(
+                    'Corrupt index entry %s.' % (repr(fname),))
+
+        return outputs
+
+    def _write_disk_entry(self, key, outputs):
+        entry_dir = self._get_entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir, 0700)
+
+        index = {}
+        for output_idx, od in outputs.items():
+            otype = get_output_type(od)
+            if otype == 'none':
+                index[output_idx] = ('none', None)
+            else:
+                fname = '%d.%s' % (output_idx, otype)
+                write_output(od, otype, os.path.join(entry_dir, fname))
+                index[output_idx] = (otype, fname)
+
+        # the index is written last, so an entry without index (e.g. after
+        # a crash) is simply ignored
+        f = open(os.path.join(entry_dir, 'index'), 'wb')
+        try:
+            f.write(repr(index))
+        finally:
+            f.close()
+
+#########################################################################
+def get_output_type(od):
+    """Return 'none', 'vtk', 'npy', 'itk' for the supported output types
+    and None otherwise.
+    """
+
+    if od is None:
+        return 'none'
+
+    elif hasattr(od, 'GetClassName') and hasattr(od, 'DeepCopy') and \
+         hasattr(od, 'GetActualMemorySize'):
+        return 'vtk'
+
+    elif hasattr(od, '__array_interface__') and hasattr(od, 'copy'):
+        return 'npy'
+
+    elif re.search('^<itkImagePython.itkImage', repr(od)):
+        return 'itk'
+
+    return None
+
+def copy_output(od):
+    """Return deep copy of supported output object.
+    """
+
+    otype = get_output_type(od)
+
+    if otype == 'none':
+        return None
+
+    elif otype == 'vtk':
+        c = od.__class__()
+        c.DeepCopy(od)
+        return c
+
+    elif otype == 'npy':
+        return od.copy()
+
+    elif otype == 'itk':
+        import itk
+        dup = itk.ImageDuplicator[od.__class__].New()
+        dup.SetInputImage(od)
+        dup.Update()
+        return dup.GetOutput()
+
+    raise OutputCacheException(
+        'Unsupported output type %s.' % (od.__class__.__name__,))
+
+def write_output(od, otype, fname):
+    if otype == 'vtk':
+        import vtk
+        w = vtk.vtkDataSetWriter()
+        w.SetFileTypeToBinary()
+        w.SetInput(od)
+        w.SetFileName(fname)
+        w.Write()
+
+    elif otype == 'npy':
+        import numpy
+        f = open(fname, 'wb')
+        try:
+            numpy.save(f, od)
+        finally:
+            f.close()
+
+    else:
+        raise OutputCacheException(
+            'Output type %s can not be written to disk.' % (otype,))
+
+def read_output(otype, fname):
+    if otype == 'vtk':
+        import vtk
+        r = vtk.vtkDataSetReader()
+        r.SetFileName(fname)
+        r.Update()
+        # we give the output its own identity, disconnected from the
+        # reader
+        od = r.GetOutput()
+        c = od.__class__()
+        c.ShallowCopy(od)
+        return c
+
+    elif otype == 'npy':
+        import numpy
+        f = open(fname, 'rb')
+        try:
+            try:
+                # object arrays would be unpickled
+                return numpy.load(f, allow_pickle=False)
+            except TypeError:
+                # numpy older than 1.10 has no allow_pickle
+                return numpy.load(f)
+        finally:
+            f.close()
+
+    raise OutputCacheException(
+        'Output type %s can not be read from disk.' % (otype,))
+
@@ -5,7 +5,12 @@
 """
 """
 
+import math
+from memory_budget import estimate_full_output_size
 import mutex
+import Queue
+import sys
+import threading
 
 #########################################################################
 class SchedulerException(Exception):
@@ -20,9 +25,10 @@ class SchedulerModuleWrapper:
     object.  
     
     We can use this to handle exceptions, such as the viewer
-    split.  Module instances are wrapped on an ad hoc basis, so you CAN'T
-    use equality testing or 'in' tests to check for matches.  Use the
-    L{matches} method.
+    split.  Module instances are wrapped on an ad hoc basis, but
+    wrappers compare and hash on their (meta_module, part) tuple, so
+    equality testing, 'in' tests and dictionary lookups work as
+    expected.  The L{matches} method is kept for backwards compatibility.
 
     @ivar instance: the module instance, e.g. instance of child of ModuleBase
     @ivar input_independent_part: part of module that is not input dependent,
@@ -32,8 +38,7 @@ class SchedulerModuleWrapper:
 
     @todo: functionality in this class has been reduced to such an
     extent that we should throw it OUT in favour of just working with
-    (meta_module, part) tuples.  These we CAN use for hashing and
-    equality tests.
+    (meta_module, part) tuples, as the ModuleGraph already does.
     
     @author: Charl P. Botha <http://cpbotha.net/>
     """
@@ -42,13 +47,19 @@ class SchedulerModuleWrapper:
         self.meta_module = meta_module
         self.part = part
 
+    def __eq__(self, other):
+        return isinstance(other, SchedulerModuleWrapper) and \
+               self.matches(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.meta_module, self.part))
+
     def matches(self, otherModule):
         """Checks if two schedulerModules are equivalent.
         
-        Module instances are wrapped with this class on an ad hoc basis,
-        so you can not check for equivalency with the equality or 'in'
-        operators for example.  Use this method instead.
-        
         @param otherModule: module with which equivalency should be tested.
         @return: True if equivalent, False otherwise.
         """
@@ -101,6 +112,28 @@ class Scheduler:
     streaming_execute_module() method called and the
     streaming_execute_timestamp touched.
 
+    Streaming is extent-based: the terminating module updates its
+    output in pieces, and every piece request propagates upstream
+    through the pipelines of the non-terminating modules, each
+    enlarging the requested extent (or ITK region) by the padding that
+    its own neighbourhood operations need.  Non-terminating modules are
+    therefore not executed, so their pipelines have to be connected
+    when their inputs are set.  Modules that only connect their
+    pipelines when executed, such as VTKtoITK and ITKtoVTK, define a
+    streaming_connect_module() method, which is called instead of
+    executing them.  Modules that can't produce pieces of their output
+    on request, e.g. numpy-based ones, set streaming_terminates = True
+    so that they always terminate their subset; in their
+    streaming_execute_module() they can still pull their input in
+    pieces, see module_kits.numpy_kit.bridge.process_in_pieces().
+
+    Wavefront scheduling:
+    This is event-driven scheduling where the topologically sorted
+    modules are grouped into wavefronts of mutually independent
+    modules.  Transfers are done exactly as for event-driven
+    scheduling, but the modules in a wavefront are executed
+    concurrently on a pool of worker threads.  See L{WavefrontScheduler}.
+
     Timestamps:
     There are four collections of timestamps:
     1. per module modified_time (initvalue 0)
@@ -158,9 +191,8 @@ class Scheduler:
         """Preprocess module instance list before cycle detection or
         topological sorting to take care of exceptions.
         
-        Note that the modules are wrapped anew by this method, so equality
-        tests with previously existing scheduleModules will not work.  You have
-        to use the L{SchedulerModuleWrapper.matches()} method.
+        Note that the modules are wrapped anew by this method, but
+        equality tests with previously existing scheduleModules will work.
 
         @param module_instances: list of raw module instances
         @return: list with SchedulerModuleWrappers
@@ -179,47 +211,28 @@ class Scheduler:
     def getConsumerModules(self, schedulerModule):
         """Return consumers of schedulerModule as a list of schedulerModules.
         
-        The consumers that are returned have been wrapped on an ad hoc basis,
-        so you can't trust normal equality or 'in' tests.  Use the 
-        L{SchedulerModuleWrapper.matches} method instead.
+        The consumers that are returned have been wrapped on an ad hoc
+        basis.  Each consumer part occurs only once, even if it is
+        connected to more than one output of schedulerModule.
 
         @param schedulerModule: determine modules that are connected to outputs
-        of this instance.
-        @param part: Only return modules that are dependent on this part.
+        of this instance.  Only modules that are dependent on its part
+        are returned.
         @return: list of consumer schedulerModules, ad hoc wrappings.
         """
 
+        mg = self._devideApp.get_module_manager().get_module_graph()
+        consumers = mg.get_consumers(
+            (schedulerModule.meta_module, schedulerModule.part))
 
-        # get the producer meta module
-        p_meta_module = schedulerModule.meta_module
-
-        # only consumers that are dependent on p_part are relevant
-        p_part = schedulerModule.part
-
-        # consumers is a list of (output_idx, consumerMetaModule,
-        # consumerInputIdx) tuples
-        mm = self._devideApp.get_module_manager()        
-        consumers = mm.get_consumers(p_meta_module)
-        
-        sConsumers = []
-        for output_idx, consumerMetaModule, consumerInputIdx in consumers:
-            if p_meta_module.getPartForOutput(output_idx) == p_part:
-
-                # now see which part of the consumerMetaModule is dependent
-                cPart = consumerMetaModule.getPartForInput(consumerInputIdx)
-                
-                sConsumers.append(
-                    SchedulerModuleWrapper(consumerMetaModule, cPart))
-
-        return sConsumers
+        return [SchedulerModuleWrapper(c_meta_module, c_part)
+                for c_meta_module, c_part in consumers]
 
     def getProducerModules(self, schedulerModule):
         """Return producer modules and indices that supply schedulerModule
         with data.
 
-        The producers that are returned have been wrapped on an ad hoc basis,
-        so you can't trust normal equality or 'in' tests. Use the
-        L{SchedulerModuleWrapper.matches} method instead.
+        The producers that are returned have been wrapped on an ad hoc basis.
 
         @param schedulerModule: determine modules that are connected to inputs
         of this instance.
@@ -256,109 +269,52 @@ class Scheduler:
         """Given a list of moduleWrappers, detect cycles in the topology
         of the modules.
 
+        This uses a linear-time depth-first search on the ModuleGraph
+        maintained by the ModuleManager.  Only cycles between modules in
+        schedulerModules are reported.
+
         @param schedulerModules: list of module instances that has to be
         checked.
         @return: True if cycles detected, False otherwise.
-        @todo: check should really be limited to modules in selection.
         """
 
-        def detectCycleMatch(visited, currentModule):
-            """Recursive function used to check for cycles in the module
-            network starting from initial module currentModule.
-
-            @param visited: list of schedulerModules used during recursion.
-            @param currentModule: initial schedulerModule
-            @return: True if cycle detected starting from currentModule
-            """
-            
-            consumers = self.getConsumerModules(currentModule)
-
-            for consumer in consumers:
-                for v in visited:
-                    if consumer.matches(v):
-                        return True
-                    
-                else:
-                    # we need to make a copy of visited and send it along
-                    # if we don't, changes to visit are shared between
-                    # different branches of the recursion; we only want
-                    # it to aggregate per recursion branch 
-                    visited_copy = {}
-                    visited_copy.update(visited)
-                    visited_copy[consumer] = 1
-                    
-                    if detectCycleMatch(visited_copy, consumer):
-                        return True
-
-            # the recursion ends when there are no consumers and 
-            return False
-            
-
-        for schedulerModule in schedulerModules:
-            if detectCycleMatch({schedulerModule : 1},
-                                schedulerModule):
-                return True
-
-
-        return False
+        mg = self._devideApp.get_module_manager().get_module_graph()
+        return mg.has_cycles([(sm.meta_module, sm.part)
+                              for sm in schedulerModules])
 
     def topoSort(self, schedulerModules):
         """Perform topological sort on list of modules.
 
         Given a list of module instances, this will perform a
         topological sort that can be used to determine the execution
-        order of the give modules.  The modules are checked beforehand
-        for cycles.  If any cycles are found, an exception is raised.
+        order of the give modules.  This uses Kahn's algorithm on the
+        ModuleGraph maintained by the ModuleManager, so it's linear in
+        the number of modules and connections.  If any cycles are found,
+        an exception is raised.
 
         @param schedulerModules: list of module instance to be sorted
         @return: modules in topological order; in this case the instances DO
         match the input instances.
-        @todo: separate topologically independent trees
+        @raise CyclesDetectedException: if schedulerModules contains cycles.
         """
-        
-        def isFinalVertex(schedulerModule, currentList):
-            """Determines whether schedulerModule is a final vertex relative
-            to the currentList.
-            
-            A final vertex is a vertex/module with no consumers in the
-            currentList.
-            
-            @param schedulerModule: module whose finalness is determined
-            @param currentList: list relative to which the finalness is
-            determined.
-            @return: True if final, False if not.
-            """
-            
-            # find consumers
-            consumers = self.getConsumerModules(schedulerModule)
-            # now check if any one of these consumers is present in currentList
-            for consumer in consumers:
-                for cm in currentList:
-                    if consumer.matches(cm):
-                        return False
-                    
-            return True
-            
 
-        if self.detectCycles(schedulerModules):
+        # the wrappers are hashable on (meta_module, part), so we can
+        # map back to the instances we were given
+        sm_dict = {}
+        for sm in schedulerModules:
+            sm_dict[(sm.meta_module, sm.part)] = sm
+
+        vertices = [(sm.meta_module, sm.part) for sm in schedulerModules
+                    if sm_dict[(sm.meta_module, sm.part)] is sm]
+
+        mg = self._devideApp.get_module_manager().get_module_graph()
+        sorted_vertices = mg.topological_sort(vertices)
+
+        if len(sorted_vertices) < len(vertices):
             raise CyclesDetectedException(
                 'Cycles detected in network.  Unable to schedule.')
-            
-        # keep on finding final vertices, move to final list
-        scheduleList = [] # this will be the actual schedules list
-        tempList = schedulerModules[:] # copy of list so we can futz around
-        
-        while tempList:
-            finalVertices = [sm for sm in tempList 
-                             if isFinalVertex(sm, tempList)]
-                             
-            scheduleList.extend(finalVertices)
-            for fv in finalVertices:
-                tempList.remove(fv)
-        
-        
-        scheduleList.reverse()
-        return scheduleList
+
+        return [sm_dict[v] for v in sorted_vertices]
 
     def execute_modules(self, schedulerModules):
         """Execute the modules in schedulerModules in topological order.
@@ -434,17 +390,241 @@ class Scheduler:
                     print 'executing part %d of %s' % \
                           (sm.part, sm.meta_module.instance.__class__.__name__)
 
+                    mm.prepare_module_execution(sm.meta_module, sm.part)
                     mm.execute_module(sm.meta_module, sm.part)
+                    mm.finish_module_execution(sm.meta_module, sm.part)
 
         finally:
             # in whichever way execution terminates, we have to unlock the
             # mutex.
             Scheduler._execute_mutex.unlock()
                 
+    def compute_wavefronts(self, sched_list):
+        """Group topologically sorted modules into dependency wavefronts.
+
+        Wavefront 0 contains all modules that have no producers in
+        sched_list, wavefront n contains all modules of which the
+        deepest producer is in wavefront n-1.  Modules in the same
+        wavefront are independent of each other and may be executed
+        concurrently once all previous wavefronts have completed.
+
+        @param sched_list: topologically sorted list of
+        SchedulerModuleWrapper instances, as returned by L{topoSort}.
+        @return: list of wavefronts, each a list of
+        SchedulerModuleWrapper instances in topological order.
+        """
+
+        # maps from (meta_module, part) to wavefront index
+        levels = {}
+        wavefronts = []
+
+        for sm in sched_list:
+            level = 0
+            for pmodule, output_index, input_index in \
+                    self.getProducerModules(sm):
+                pmt = (pmodule.meta_module, pmodule.part)
+                # producers that are not in sched_list (e.g. blocked
+                # modules) impose no ordering constraints
+                if pmt in levels:
+                    level = max(level, levels[pmt] + 1)
+
+            levels[(sm.meta_module, sm.part)] = level
+
+            # due to the topological ordering, level can be at most one
+            # more than the current deepest wavefront
+            if level == len(wavefronts):
+                wavefronts.append([])
+
+            wavefronts[level].append(sm)
+
+        return wavefronts
+                
 #########################################################################
 class EventDrivenScheduler(Scheduler):
     pass
 
+#########################################################################
+class WavefrontScheduler(EventDrivenScheduler):
+    """Event-driven scheduler that executes independent modules
+    concurrently.
+
+    The topologically sorted network is grouped into dependency
+    wavefronts (see L{Scheduler.compute_wavefronts}).  Wavefronts are
+    processed one after the other.  For each wavefront, all data
+    transfers and should_execute checks are done serially on the
+    calling thread, so that the transfer timestamp logic in MetaModule
+    behaves exactly as for the event-driven scheduler.  Only the
+    actual module executions are then handed to a pool of worker
+    threads.  The next wavefront is only started when all executions
+    in the current wavefront have completed.
+
+    Parts of the same meta module are always executed one after the
+    other by the same worker.  In view mode, modules are free to
+    update their wx views during execution, so all executions are
+    done on the calling thread.
+
+    This scheduler is only useful if the modules release the GIL
+    during their heavy lifting, as is the case for the patched VTK
+    and for ITK.
+    """
+
+    def __init__(self, devideApp, num_workers=0):
+        """Initialise wavefront scheduler instance.
+
+        @param num_workers: maximum number of worker threads that will
+        be used to execute a single wavefront.  If this is 0 or less,
+        the number of processors is used.
+        """
+        
+        EventDrivenScheduler.__init__(self, devideApp)
+        self.set_num_workers(num_workers)
+
+    def set_num_workers(self, num_workers):
+        if num_workers <= 0:
+            try:
+                import multiprocessing
+                num_workers = multiprocessing.cpu_count()
+            except (ImportError, NotImplementedError):
+                num_workers = 1
+
+        self.num_workers = num_workers
+
+    def _execute_wavefront(self, tasks):
+        """Execute list of tasks, each a list of SchedulerModuleWrapper
+        instances that have to be executed in order, on at most
+        num_workers threads.
+
+        All tasks are allowed to run to completion.  If any of the tasks
+        raised an exception, the first one is re-raised afterwards.
+        """
+
+        mm = self._devideApp.get_module_manager()
+        exc_infos = []
+
+        def run_task(task):
+            for sm in task:
+                print 'executing part %d of %s' % \
+                      (sm.part, sm.meta_module.instance.__class__.__name__)
+
+                mm.execute_module(sm.meta_module, sm.part)
+
+        if self.num_workers < 2 or len(tasks) < 2 or \
+                self._devideApp.view_mode:
+            # no point in starting up any threads
+            for task in tasks:
+                run_task(task)
+
+            return
+
+        task_queue = Queue.Queue()
+        for task in tasks:
+            task_queue.put(task)
+
+        def worker():
+            while True:
+                try:
+                    task = task_queue.get_nowait()
+                except Queue.Empty:
+                    break
+
+                try:
+                    run_task(task)
+                except Exception:
+                    # list.append is atomic, no locking required
+                    exc_infos.append(sys.exc_info())
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(self.num_workers, len(tasks)))]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        if exc_infos:
+            # re-raise with the original traceback
+            raise exc_infos[0][0], exc_infos[0][1], exc_infos[0][2]
+
+    def execute_modules(self, schedulerModules):
+        """Execute the modules in schedulerModules wavefront by
+        wavefront, executing independent modules concurrently.
+
+        @param schedulerModules: list of modules that should be executed in
+        order.
+        @raise CyclesDetectedException: This exception is raised if any
+        cycles are detected in the modules that have to be executed.
+        """
+
+        # stop concurrent calls of execute_modules.
+        if not Scheduler._execute_mutex.testandset():
+            return
+
+        # first remove all blocked modules from the list, before we do any
+        # kind of analysis.
+        schedulerModules = [sm for sm in schedulerModules
+                            if not sm.meta_module.blocked]
+
+        try:
+            if self.detectCycles(schedulerModules):
+                raise CyclesDetectedException(
+                    'Cycles detected in selected network modules.  '
+                    'Unable to execute.')
+
+            schedList = self.topoSort(schedulerModules)
+            mm = self._devideApp.get_module_manager()
+
+            for wavefront in self.compute_wavefronts(schedList):
+                print "### wavefront:", \
+                      [sm.meta_module.instance.__class__.__name__
+                       for sm in wavefront]
+
+                # tasks keyed on meta_module, so that parts of the same
+                # module end up in the same task
+                tasks = {}
+                task_order = []
+
+                for sm in wavefront:
+                    # transfer relevant data on this thread
+                    producers = self.getProducerModules(sm)
+                    for pmodule, output_index, input_index in producers:
+                        if mm.should_transfer_output(
+                            pmodule.meta_module, output_index,
+                            sm.meta_module, input_index):
+
+                            print 'transferring output: %s:%d to %s:%d' % \
+                                  (pmodule.meta_module.instance.__class__.__name__,
+                                   output_index,
+                                   sm.meta_module.instance.__class__.__name__,
+                                   input_index)
+
+                            mm.transfer_output(
+                                pmodule.meta_module, output_index,
+                                sm.meta_module, input_index)
+
+                    if mm.should_execute_module(sm.meta_module, sm.part):
+                        # recomputation of released inputs also happens
+                        # on this thread
+                        mm.prepare_module_execution(sm.meta_module, sm.part)
+
+                        if sm.meta_module not in tasks:
+                            tasks[sm.meta_module] = []
+                            task_order.append(sm.meta_module)
+
+                        tasks[sm.meta_module].append(sm)
+
+                task_list = [tasks[m] for m in task_order]
+                self._execute_wavefront(task_list)
+
+                for task in task_list:
+                    for sm in task:
+                        mm.finish_module_execution(sm.meta_module, sm.part)
+
+        finally:
+            # in whichever way execution terminates, we have to unlock the
+            # mutex.
+            Scheduler._execute_mutex.unlock()
+
 #########################################################################
 class HybridScheduler(Scheduler):
 
@@ -541,9 +721,19 @@ class HybridScheduler(Scheduler):
                     if streamables_dict[smt] == 2:
                         # terminating module in streamable subset
                         if mm.should_execute_module(sm.meta_module, sm.part):
+                            pieces, size = self.get_streaming_pieces(
+                                smt, streamables_dict)
+                            sm.meta_module.streaming_pieces = pieces
+
                             print 'streaming executing part %d of %s' % \
                                   (sm.part, \
                                    sm.meta_module.instance.__class__.__name__)
+                            print 'streaming in %d pieces ' \
+                                  '(estimated unstreamed size %d KB, ' \
+                                  'streaming_memory %d KB)' % \
+                                  (pieces, size / 1024,
+                                   self._devideApp.main_config.\
+                                   streaming_memory)
                             
                             mm.execute_module(sm.meta_module, sm.part,
                                     streaming=True)
@@ -556,6 +746,10 @@ class HybridScheduler(Scheduler):
                     # execute it.  this is used in the transfer
                     # caching
                     elif sm.meta_module.should_touch(sm.part):
+                        # modules that only compute their outputs when
+                        # executed, e.g. the VTK/ITK glue, connect
+                        # their pipelines instead.
+                        mm.streaming_connect_module(sm.meta_module, sm.part)
                         sm.meta_module.streaming_touch_timestamp_module(sm.part)
 
 
@@ -566,7 +760,9 @@ class HybridScheduler(Scheduler):
                               (sm.part, \
                                sm.meta_module.instance.__class__.__name__)
                         
+                        mm.prepare_module_execution(sm.meta_module, sm.part)
                         mm.execute_module(sm.meta_module, sm.part)
+                        mm.finish_module_execution(sm.meta_module, sm.part)
                                 
 
         finally:
@@ -574,6 +770,62 @@ class HybridScheduler(Scheduler):
             # mutex.
             Scheduler._execute_mutex.unlock()
 
+    def get_streaming_pieces(self, smt, streamables_dict):
+        """Determine the number of pieces in which the terminating
+        streamable module smt should stream.
+
+        All streamable modules upstream of smt process one piece at a
+        time, so the memory needed per piece is the estimated unstreamed
+        size of the outputs that they pass on, divided by the number of
+        pieces.  We choose the smallest number of pieces for which this
+        fits in the streaming_memory budget.  If the budget is 0, or if
+        the size can't be estimated, the configured streaming_pieces is
+        used.
+
+        @param smt: (meta_module, part) tuple of terminating module.
+        @param streamables_dict: as returned by find_streamable_subsets.
+        @return: tuple (number of pieces, estimated unstreamed size in
+        bytes).
+        """
+
+        main_config = self._devideApp.main_config
+
+        # find all (producer meta_module, output_idx) connections that
+        # stream data into smt, directly or via other streamables
+        connections = {}
+        todo = [smt]
+        done = {smt : 1}
+        while todo:
+            meta_module, part = todo.pop()
+            producers = self.getProducerModules(
+                SchedulerModuleWrapper(meta_module, part))
+            for pmodule, output_idx, input_idx in producers:
+                pmt = (pmodule.meta_module, pmodule.part)
+                if pmt not in streamables_dict:
+                    # this data is not streamed, it's already complete
+                    continue
+
+                connections[(pmodule.meta_module, output_idx)] = 1
+                if pmt not in done:
+                    done[pmt] = 1
+                    todo.append(pmt)
+
+        size = 0
+        for meta_module, output_idx in connections:
+            try:
+                od = meta_module.instance.get_output(output_idx)
+                size += estimate_full_output_size(od)
+            except Exception:
+                # some modules can't give an output before execution
+                pass
+
+        # streaming_memory is in kilobytes
+        budget = main_config.streaming_memory * 1024
+        if budget <= 0 or size == 0:
+            return main_config.streaming_pieces, size
+
+        return max(1, int(math.ceil(float(size) / budget))), size
+
     def find_streamable_subsets(self, scheduler_modules):
         """
         Algorithm for finding streamable subsets in a network.  Also
@@ -617,8 +869,11 @@ class HybridScheduler(Scheduler):
             sm = SchedulerModuleWrapper(smt[0], smt[1])
             consumers = self.getConsumerModules(sm)
 
-            # if there are no consumers, per def a terminating module
-            if len(consumers) == 0:
+            # if there are no consumers, per def a terminating module.
+            # modules that can only produce complete outputs, e.g.
+            # numpy-based ones, always terminate.
+            if len(consumers) == 0 or \
+               getattr(smt[0].instance, 'streaming_terminates', False):
                 terminating = True
             else:
                 # check if ANY of the the consumers is non-streamable
@@ -638,7 +893,7 @@ class HybridScheduler(Scheduler):
                 ctuples = [(i.meta_module, i.part) for i in consumers]
                 streamable_subset.append(ctuples)
                 # also add them all to V_ss
-                streamables_dict.fromkeys(ctuples, 1)
+                streamables_dict.update(dict.fromkeys(ctuples, 1))
                 for c in consumers:
                     handle_new_streamable((c.meta_module, c.part), 
                             streamable_subset)
@@ -674,10 +929,13 @@ class SchedulerProxy:
 
     EVENT_DRIVEN_MODE = 0
     HYBRID_MODE = 1
+    WAVEFRONT_MODE = 2
 
     def __init__(self, devide_app):
         self.event_driven_scheduler = EventDrivenScheduler(devide_app)
         self.hybrid_scheduler = HybridScheduler(devide_app)
+        self.wavefront_scheduler = WavefrontScheduler(
+            devide_app, devide_app.main_config.scheduler_workers)
         # default mode
         self.mode = SchedulerProxy.EVENT_DRIVEN_MODE
 
@@ -685,7 +943,8 @@ class SchedulerProxy:
         """Return the correct scheduler instance, dependent on the
         current mode.
         """
-        s = [self.event_driven_scheduler, self.hybrid_scheduler][self.mode]
+        s = [self.event_driven_scheduler, self.hybrid_scheduler,
+             self.wavefront_scheduler][self.mode]
         return s
 
     def execute_modules(self, scheduler_modules):
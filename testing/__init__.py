@@ -12,9 +12,10 @@ from testing import basic_wx
 from testing import graph_editor
 from testing import numpy_tests
 from testing import matplotlib_tests
+from testing import engines
 
 module_list = [misc, basic_vtk, basic_wx, graph_editor, 
-        numpy_tests, matplotlib_tests]
+        numpy_tests, matplotlib_tests, engines]
 
 for m in module_list:
     reload(m)
@@ -31,7 +32,8 @@ class DeVIDETesting:
                       basic_wx.get_suite(self),
                       graph_editor.get_suite(self),
                       numpy_tests.get_suite(self), 
-                      matplotlib_tests.get_suite(self)
+                      matplotlib_tests.get_suite(self),
+                      engines.get_suite(self)
                       ]
 
         self.main_suite = unittest.TestSuite(tuple(suite_list))
@@ -40,7 +42,7 @@ class DeVIDETesting:
         runner = unittest.TextTestRunner(verbosity=2)
         runner.run(self.main_suite)
 
-        print "Complete suite consists of 19 (multi-part) tests on "
+        print "Complete suite consists of 34 (multi-part) tests on "
         print "lin32, lin64, win32, win64."
 
     def runSomeTest(self):
@@ -0,0 +1,394 @@
+"""Module to test the GUI-independent engines of DeVIDE.
+"""
+
+import unittest
+
+class FakeMetaModule:
+    """Just enough of a MetaModule for the ModuleGraph: every input and
+    output belongs to part input_idx % num_parts.
+    """
+
+    def __init__(self, name, num_parts=1):
+        self.name = name
+        self.numParts = num_parts
+
+    def getPartForInput(self, input_idx):
+        return input_idx % self.numParts
+
+    def getPartForOutput(self, output_idx):
+        return output_idx % self.numParts
+
+class FakeConnection:
+    """The part of a PickledConnection that network_layout uses.
+    """
+
+    def __init__(self, source_instance_name, target_instance_name):
+        self.source_instance_name = source_instance_name
+        self.target_instance_name = target_instance_name
+
+class ModuleGraphTest(unittest.TestCase):
+    def setUp(self):
+        from module_graph import ModuleGraph
+        self.g = ModuleGraph()
+        self.m = {}
+        for name in 'abcde':
+            self.m[name] = FakeMetaModule(name)
+            self.g.add_module(self.m[name])
+
+    def v(self, name, part=0):
+        return (self.m[name], part)
+
+    def connect(self, p, c, output_idx=0, input_idx=0):
+        self.g.add_connection(self.m[p], output_idx, self.m[c], input_idx)
+
+    def disconnect(self, p, c, output_idx=0, input_idx=0):
+        self.g.remove_connection(self.m[p], output_idx, self.m[c],
+                                 input_idx)
+
+    def all_vertices(self):
+        return [self.v(name) for name in 'abcde']
+
+    def check_order(self, order, edges):
+        pos = dict([(v, i) for i, v in enumerate(order)])
+        for p, c in edges:
+            self.failUnless(pos[self.v(p)] < pos[self.v(c)],
+                            '%s not before %s' % (p, c))
+
+    def test_topological_order(self):
+        """Test topological order after connecting and disconnecting.
+        """
+
+        # connect in reverse order, so that insertion order doesn't help
+        for p, c in (('d', 'e'), ('c', 'd'), ('a', 'c'), ('b', 'c'),
+                     ('a', 'e')):
+            self.connect(p, c)
+
+        order = self.g.topological_sort(self.all_vertices())
+        self.failUnlessEqual(len(order), 5)
+        self.check_order(order, [('d', 'e'), ('c', 'd'), ('a', 'c'),
+                                 ('b', 'c'), ('a', 'e')])
+
+        # e now comes before c
+        self.disconnect('c', 'd')
+        self.connect('e', 'c', input_idx=1)
+        order = self.g.topological_sort(self.all_vertices())
+        self.failUnlessEqual(len(order), 5)
+        self.check_order(order, [('d', 'e'), ('e', 'c'), ('a', 'c'),
+                                 ('b', 'c'), ('a', 'e')])
+
+    def test_cycle_detection(self):
+        """Test that cycles are found, and disappear when disconnected.
+        """
+
+        self.connect('a', 'b')
+        self.connect('b', 'c')
+        self.connect('c', 'd')
+        self.failIf(self.g.has_cycles(self.all_vertices()))
+
+        self.connect('d', 'b', input_idx=1)
+        cycle = self.g.find_cycle(self.all_vertices())
+        self.failIf(cycle is None)
+        cycle.sort()
+        expected = [self.v('b'), self.v('c'), self.v('d')]
+        expected.sort()
+        self.failUnlessEqual(cycle, expected)
+
+        # the vertices in and after the cycle can't be sorted
+        order = self.g.topological_sort(self.all_vertices())
+        self.failIf(self.v('b') in order or self.v('d') in order)
+        self.failUnless(self.v('a') in order and self.v('e') in order)
+
+        # the cycle is not in this subset
+        self.failIf(self.g.has_cycles(
+            [self.v('a'), self.v('b'), self.v('c')]))
+
+        self.disconnect('d', 'b', input_idx=1)
+        self.failIf(self.g.has_cycles(self.all_vertices()))
+
+    def test_connection_reference_counting(self):
+        """Test that an edge remains while any connection remains.
+        """
+
+        self.connect('a', 'b', 0, 0)
+        self.connect('a', 'b', 0, 1)
+        self.disconnect('a', 'b', 0, 0)
+        self.failUnlessEqual(self.g.get_consumers(self.v('a')),
+                             [self.v('b')])
+
+        self.disconnect('a', 'b', 0, 1)
+        self.failUnlessEqual(self.g.get_consumers(self.v('a')), [])
+        self.failUnlessEqual(self.g.get_producers(self.v('b')), [])
+
+    def test_downstream_closure(self):
+        """Test the contents of the dirty closure.
+        """
+
+        self.connect('a', 'b')
+        self.connect('b', 'c')
+        self.connect('d', 'c', input_idx=1)
+
+        closure = self.g.get_downstream_closure([self.v('b')])
+        self.failUnlessEqual(len(closure), 2)
+        self.failUnless(self.v('b') in closure and self.v('c') in closure)
+
+        closure = self.g.get_downstream_closure([self.v('d'), self.v('e')])
+        self.failUnlessEqual(len(closure), 3)
+        for name in 'dce':
+            self.failUnless(self.v(name) in closure)
+
+        self.g.remove_module(self.m['c'])
+        closure = self.g.get_downstream_closure([self.v('a')])
+        self.failUnlessEqual(len(closure), 2)
+        self.failUnless(self.v('a') in closure and self.v('b') in closure)
+
+    def test_multi_part_modules(self):
+        """Test that edges connect the right parts.
+        """
+
+        vwr = FakeMetaModule('vwr', 2)
+        self.g.add_module(vwr)
+        # input 1 and output 1 belong to part 1
+        self.g.add_connection(self.m['a'], 0, vwr, 1)
+        self.g.add_connection(vwr, 1, self.m['b'], 0)
+
+        closure = self.g.get_downstream_closure([self.v('a')])
+        self.failUnless((vwr, 1) in closure)
+        self.failIf((vwr, 0) in closure)
+        self.failUnless(self.v('b') in closure)
+
+class SpatialGridTest(unittest.TestCase):
+    def setUp(self):
+        from internal.devide_canvas.spatial_index import SpatialGrid
+        self.grid = SpatialGrid(cell_size=100.0)
+
+    def test_queries_after_insert(self):
+        """Test point and rectangle queries, topmost object first.
+        """
+
+        g = self.grid
+        g.insert('a', (0, 0, 50, 50))
+        g.insert('b', (25, 25, 75, 75))
+        # spans several cells and negative coordinates
+        g.insert('c', (-250, -250, 250, 20))
+
+        self.failUnlessEqual(g.query_point(30, 30), ['b', 'a'])
+        self.failUnlessEqual(g.query_point(60, 60), ['b'])
+        self.failUnlessEqual(g.query_point(-200, -200), ['c'])
+        self.failUnlessEqual(g.query_point(500, 500), [])
+
+        self.failUnlessEqual(g.query_rect((40, 40, 60, 60)), ['b', 'a'])
+        self.failUnlessEqual(g.query_rect((-300, -300, 5, 5)),
+                             ['c', 'a'])
+        self.failUnlessEqual(g.query_rect((60, 80, 90, 90)), [])
+        self.failUnlessEqual(len(g), 3)
+
+    def test_queries_after_move(self):
+        """Test that moved objects are only found at their new bounds,
+        and keep their stacking order.
+        """
+
+        g = self.grid
+        g.insert('a', (0, 0, 50, 50))
+        g.insert('b', (500, 500, 550, 550))
+        g.insert('a', (510, 510, 560, 560))
+
+        self.failUnlessEqual(g.query_point(25, 25), [])
+        self.failUnlessEqual(g.query_rect((0, 0, 100, 100)), [])
+        self.failUnlessEqual(g.query_point(520, 520), ['b', 'a'])
+        self.failUnlessEqual(g.get_bounds('a'), (510, 510, 560, 560))
+
+    def test_queries_after_remove(self):
+        """Test that removed objects are no longer found.
+        """
+
+        g = self.grid
+        g.insert('a', (0, 0, 350, 350))
+        g.insert('b', (10, 10, 20, 20))
+        g.remove('a')
+
+        self.failIf('a' in g)
+        self.failUnlessEqual(g.query_point(300, 300), [])
+        self.failUnlessEqual(g.query_rect((0, 0, 400, 400)), ['b'])
+
+        g.remove('b')
+        self.failUnlessEqual(len(g), 0)
+        self.failUnlessEqual(g.query_rect((0, 0, 400, 400)), [])
+
+class LineRouterTest(unittest.TestCase):
+    def setUp(self):
+        from internal.devide_canvas.line_router import LineRouter
+        self.obstacles = []
+        self.router = LineRouter(self.get_obstacles, margin=5.0)
+
+    def get_obstacles(self, bounds):
+        return [o for o in self.obstacles
+                if o[0] <= bounds[2] and bounds[0] <= o[2] and
+                o[1] <= bounds[3] and bounds[1] <= o[3]]
+
+    def check_route(self, start, end):
+        from internal.devide_canvas.line_router import _segment_crosses
+        points = [start] + self.router.route(start, end) + [end]
+        for i in range(len(points) - 1):
+            p0, p1 = points[i], points[i + 1]
+            for o in self.obstacles:
+                self.failIf(_segment_crosses(p0, p1, o),
+                            'segment %s-%s crosses obstacle %s' %
+                            (p0, p1, o))
+
+        return points
+
+    def test_straight_line(self):
+        """Test that unobstructed lines are not routed.
+        """
+
+        self.obstacles = [(0, 100, 50, 150)]
+        self.failUnlessEqual(self.router.route((0, 0), (200, 0)), [])
+
+    def test_route_around_obstacle(self):
+        """Test that a line through an obstacle is routed around it.
+        """
+
+        self.obstacles = [(40, -50, 60, 50)]
+        self.failUnless(self.router.is_obstructed((0, 0), (100, 0)))
+        points = self.check_route((0, 0), (100, 0))
+        self.failUnless(len(points) > 2)
+
+    def test_route_through_wall_gap(self):
+        """Test routing through the gap in a long wall and around a row
+        of blocks.
+        """
+
+        # wall from y=-500 to 500 with a gap between y=200 and y=260
+        self.obstacles = [(100, -500, 120, 200), (100, 260, 120, 500)]
+        # a row of blocks between the wall and the end
+        for i in range(5):
+            self.obstacles.append((200, -100 + i * 60, 240, -60 + i * 60))
+
+        points = self.check_route((0, 0), (300, 0))
+        self.failUnless(len(points) > 2)
+        # we can only have gone through the gap
+        self.failUnless([p for p in points if 200 <= p[1] <= 260])
+
+    def test_routes_among_many_obstacles(self):
+        """Test routes across a grid of glyph-sized obstacles.
+        """
+
+        for i in range(6):
+            for j in range(6):
+                x, y = i * 200, j * 120
+                self.obstacles.append((x, y, x + 150, y + 70))
+
+        for start, end in (((-20, -20), (1200, 720)),
+                           ((175, 35), (975, 635)),
+                           ((1175, 95), (-25, 395))):
+            self.check_route(start, end)
+
+class NetworkLayoutTest(unittest.TestCase):
+    def get_connections(self, edges):
+        return [FakeConnection(p, c) for p, c in edges]
+
+    def check_no_overlaps(self, positions, sizes={}):
+        from network_layout import DEFAULT_GLYPH_SIZE
+        rects = []
+        for name, (x, y) in positions.items():
+            w, h = sizes.get(name, DEFAULT_GLYPH_SIZE)
+            rects.append((name, x, y, x + w, y + h))
+
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                self.failIf(a[1] < b[3] and b[1] < a[3] and
+                            a[2] < b[4] and b[2] < a[4],
+                            '%s overlaps %s' % (a[0], b[0]))
+
+    def test_layered_layout(self):
+        """Test that producers are above consumers and nothing overlaps.
+        """
+
+        import network_layout
+        edges = [('rdr', 'thresh'), ('rdr', 'gauss'), ('gauss', 'thresh'),
+                 ('thresh', 'contour'), ('contour', 'slice3d'),
+                 ('rdr', 'slice3d'), ('rdr2', 'slice3d')]
+        names = ['rdr', 'rdr2', 'gauss', 'thresh', 'contour', 'slice3d',
+                 'lonely']
+        sizes = {'slice3d' : (300, 120), 'rdr' : (80, 40)}
+        positions = network_layout.layout_network(
+            names, self.get_connections(edges), sizes)
+
+        self.failUnlessEqual(len(positions), len(names))
+        self.check_no_overlaps(positions, sizes)
+        # data flows downwards: the bottom of every producer is above
+        # the top of its consumer
+        for p, c in edges:
+            c_top = positions[c][1] + \
+                    sizes.get(c, network_layout.DEFAULT_GLYPH_SIZE)[1]
+            self.failUnless(positions[p][1] > c_top,
+                            '%s not above %s' % (p, c))
+
+    def test_cycles_are_broken(self):
+        """Test that no cycles are left after cycle removal, and that
+        cyclic networks are still laid out.
+        """
+
+        import network_layout
+        edges = [(0, 1), (1, 2), (2, 0), (2, 3), (3, 4), (4, 2)]
+        acyclic = network_layout._remove_cycles(5, edges)
+
+        # every edge is kept, possibly reversed
+        self.failUnlessEqual(len(acyclic), len(edges))
+        for u, v in edges:
+            self.failUnless((u, v) in acyclic or (v, u) in acyclic)
+
+        # layering only succeeds for all vertices if there is no cycle
+        layer_of = network_layout._assign_layers(5, acyclic)
+        for u, v in acyclic:
+            self.failUnless(layer_of[u] < layer_of[v])
+
+        # layout_network also has to cope with self-loops
+        names = ['m%d' % (i,) for i in range(5)]
+        positions = network_layout.layout_network(
+            names, self.get_connections(
+                [(names[u], names[v]) for u, v in edges + [(4, 4)]]))
+        self.failUnlessEqual(len(positions), 5)
+        self.check_no_overlaps(positions)
+
+    def test_complete_positions(self):
+        """Test that existing positions are kept and new glyphs are
+        placed clear of them.
+        """
+
+        import network_layout
+        existing = {'a' : (0, 0), 'b' : (0, -150)}
+        edges = [('a', 'b'), ('b', 'c'), ('c', 'd')]
+        positions = network_layout.complete_positions(
+            ['a', 'b', 'c', 'd'], self.get_connections(edges), existing)
+
+        self.failUnlessEqual(positions['a'], (0, 0))
+        self.failUnlessEqual(positions['b'], (0, -150))
+        self.failUnless('c' in positions and 'd' in positions)
+        self.check_no_overlaps(positions)
+
+def get_suite(devide_testing):
+    engines_suite = unittest.TestSuite()
+
+    for test_class, names in [
+        (ModuleGraphTest, ['test_topological_order',
+                           'test_cycle_detection',
+                           'test_connection_reference_counting',
+                           'test_downstream_closure',
+                           'test_multi_part_modules']),
+        (SpatialGridTest, ['test_queries_after_insert',
+                           'test_queries_after_move',
+                           'test_queries_after_remove']),
+        (LineRouterTest, ['test_straight_line',
+                          'test_route_around_obstacle',
+                          'test_route_through_wall_gap',
+                          'test_routes_among_many_obstacles']),
+        (NetworkLayoutTest, ['test_layered_layout',
+                             'test_cycles_are_broken',
+                             'test_complete_positions'])]:
+
+        for name in names:
+            engines_suite.addTest(test_class(name))
+
+    return engines_suite
@@ -545,9 +545,9 @@ def get_suite(devide_testing):
     graph_editor_suite.addTest(t)
     
 
-    # module_kit_list is up to date with the actual module_kits that
-    # were imported
-    if 'itk_kit' in mm.module_kits.module_kit_list:
+    # itk_kit is only loaded on first use, so we load it here to find
+    # out whether it's available
+    if mm.load_module_kits(['itk_kit']):
         t = TestITKBasic('test_confidence_seed_connect')
         t._devide_app = devide_app
         graph_editor_suite.addTest(t)
@@ -69,7 +69,7 @@ def get_suite(devide_testing):
 
     mpl_suite = unittest.TestSuite()
 
-    if 'matplotlib_kit' in mm.module_kits.module_kit_list:
+    if mm.load_module_kits(['matplotlib_kit']):
         t = MPLTest('test_figure_output')
         t._devide_app = devide_app
         t._devide_testing = devide_testing
@@ -26,7 +26,7 @@ def get_suite(devide_testing):
 
     numpy_suite = unittest.TestSuite()
 
-    if 'numpy_kit' in mm.module_kits.module_kit_list:
+    if mm.load_module_kits(['numpy_kit']):
         t = NumPyTest('test_import_mixing')
         t._devide_app = devide_app
         t._devide_testing = devide_testing